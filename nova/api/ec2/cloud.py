@@ -1040,9 +1040,12 @@ class CloudController(object):
             try:
                 # always filter out deleted instances
                 search_opts['deleted'] = False
+                # Listings tolerate slightly stale data, read them from
+                # the replica when one is configured.
                 instances = self.compute_api.get_all(context,
                                                      search_opts=search_opts,
-                                                     sort_dir='asc')
+                                                     sort_dir='asc',
+                                                     use_slave=True)
             except exception.NotFound:
                 instances = []
         for instance in instances:
@@ -69,8 +69,9 @@ class Controller(servers.Controller):
         context = req.environ['nova.context']
         if 'servers' in resp_obj.obj and authorize(context):
             resp_obj.attach(xml=ServersConfigDriveTemplate())
-            servers = resp_obj.obj['servers']
-            self._add_config_drive(req, servers)
+            resp_obj.extend_items(
+                    'servers',
+                    lambda server: self._add_config_drive(req, [server]))
 
 
 class Config_drive(extensions.ExtensionDescriptor):
@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Statistics of the SQL statements issued by the API service."""
+
+import webob
+
+from nova.api.openstack import extensions
+from nova.db import query_stats
+
+
+authorize = extensions.extension_authorizer('compute', 'db_query_stats')
+
+
+class DbQueryStatsController(object):
+    """Returns the SQL statements counted per API action.
+
+    Statements are only counted when sql_query_stats is enabled.  Other
+    services, like compute, log the counters of their periodic tasks.
+    """
+
+    def index(self, req):
+        context = req.environ['nova.context']
+        authorize(context)
+        return {'db_query_stats': query_stats.get_stats()}
+
+    def reset(self, req):
+        context = req.environ['nova.context']
+        authorize(context)
+        query_stats.reset_stats()
+        return webob.Response(status_int=202)
+
+
+class Db_query_stats(extensions.ExtensionDescriptor):
+    """Admin-only SQL statement statistics of API actions"""
+    name = "DbQueryStats"
+    alias = "os-db-query-stats"
+    namespace = "http://docs.openstack.org/compute/ext/db_query_stats/api/v2"
+    updated = "2012-11-01T00:00:00+00:00"
+
+    def get_resources(self):
+        collection_actions = {'reset': 'POST'}
+        res = extensions.ResourceExtension(
+            'os-db-query-stats',
+            DbQueryStatsController(),
+            collection_actions=collection_actions)
+        return [res]
@@ -81,8 +81,9 @@ class ImageDiskConfigController(wsgi.Controller):
         context = req.environ['nova.context']
         if 'images' in resp_obj.obj and authorize(context):
             resp_obj.attach(xml=ImagesDiskConfigTemplate())
-            images = resp_obj.obj['images']
-            self._add_disk_config(context, images)
+            resp_obj.extend_items(
+                    'images',
+                    lambda image: self._add_disk_config(context, [image]))
 
 
 class ServerDiskConfigTemplate(xmlutil.TemplateBuilder):
@@ -126,8 +127,9 @@ class ServerDiskConfigController(wsgi.Controller):
         context = req.environ['nova.context']
         if 'servers' in resp_obj.obj and authorize(context):
             resp_obj.attach(xml=ServersDiskConfigTemplate())
-            servers = resp_obj.obj['servers']
-            self._add_disk_config(req, servers)
+            resp_obj.extend_items(
+                    'servers',
+                    lambda server: self._add_disk_config(req, [server]))
 
     def _set_disk_config(self, dict_):
         if API_DISK_CONFIG in dict_:
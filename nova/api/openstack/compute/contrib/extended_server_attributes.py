@@ -74,13 +74,14 @@ class ExtendedServerAttributesController(wsgi.Controller):
             # Attach our slave template to the response object
             resp_obj.attach(xml=ExtendedServerAttributesTemplate())
 
-            servers = list(resp_obj.obj['servers'])
-            for server in servers:
+            def extend(server):
                 db_instance = req.get_db_instance(server['id'])
                 # server['id'] is guaranteed to be in the cache due to
                 # the core API adding it in its 'detail' method.
                 self._extend_server(context, server, db_instance)
 
+            resp_obj.extend_items('servers', extend)
+
 
 class Extended_server_attributes(extensions.ExtensionDescriptor):
     """Extended Server Attributes support."""
@@ -55,13 +55,15 @@ class ExtendedStatusController(wsgi.Controller):
         if authorize(context):
             # Attach our slave template to the response object
             resp_obj.attach(xml=ExtendedStatusesTemplate())
-            servers = list(resp_obj.obj['servers'])
-            for server in servers:
+
+            def extend(server):
                 db_instance = req.get_db_instance(server['id'])
                 # server['id'] is guaranteed to be in the cache due to
                 # the core API adding it in its 'detail' method.
                 self._extend_server(server, db_instance)
 
+            resp_obj.extend_items('servers', extend)
+
 
 class Extended_status(extensions.ExtensionDescriptor):
     """Extended Status support"""
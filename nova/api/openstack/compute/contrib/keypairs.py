@@ -182,8 +182,9 @@ class Controller(servers.Controller):
         context = req.environ['nova.context']
         if 'servers' in resp_obj.obj and soft_authorize(context):
             resp_obj.attach(xml=ServersKeyNameTemplate())
-            servers = resp_obj.obj['servers']
-            self._add_key_name(req, servers)
+            resp_obj.extend_items(
+                    'servers',
+                    lambda server: self._add_key_name(req, [server]))
 
 
 class Keypairs(extensions.ExtensionDescriptor):
@@ -492,7 +492,8 @@ class SecurityGroupsOutputController(wsgi.Controller):
         if not softauth(req.environ['nova.context']):
             return
         resp_obj.attach(xml=SecurityGroupServersTemplate())
-        self._extend_servers(req, list(resp_obj.obj['servers']))
+        resp_obj.extend_items(
+                'servers', lambda server: self._extend_servers(req, [server]))
 
 
 class SecurityGroupsTemplateElement(xmlutil.TemplateElement):
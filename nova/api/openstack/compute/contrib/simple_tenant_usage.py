@@ -22,6 +22,8 @@ from nova.api.openstack import extensions
 from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
 from nova.compute import api
+from nova.compute import utils as compute_utils
+from nova import db
 from nova import exception
 from nova import flags
 from nova.openstack.common import timeutils
@@ -33,6 +35,9 @@ authorize_show = extensions.extension_authorizer('compute',
 authorize_list = extensions.extension_authorizer('compute',
                                                  'simple_tenant_usage:list')
 
+USAGE_COUNTERS = ('total_hours', 'total_local_gb_usage', 'total_vcpus_usage',
+                  'total_memory_mb_usage')
+
 
 def make_usage(elem):
     for subelem_tag in ('tenant_id', 'total_local_gb_usage',
@@ -69,40 +74,7 @@ class SimpleTenantUsagesTemplate(xmlutil.TemplateBuilder):
 
 class SimpleTenantUsageController(object):
     def _hours_for(self, instance, period_start, period_stop):
-        launched_at = instance['launched_at']
-        terminated_at = instance['terminated_at']
-        if terminated_at is not None:
-            if not isinstance(terminated_at, datetime.datetime):
-                terminated_at = timeutils.parse_strtime(terminated_at,
-                                                        "%Y-%m-%d %H:%M:%S.%f")
-
-        if launched_at is not None:
-            if not isinstance(launched_at, datetime.datetime):
-                launched_at = timeutils.parse_strtime(launched_at,
-                                                      "%Y-%m-%d %H:%M:%S.%f")
-
-        if terminated_at and terminated_at < period_start:
-            return 0
-        # nothing if it started after the usage report ended
-        if launched_at and launched_at > period_stop:
-            return 0
-        if launched_at:
-            # if instance launched after period_started, don't charge for first
-            start = max(launched_at, period_start)
-            if terminated_at:
-                # if instance stopped before period_stop, don't charge after
-                stop = min(period_stop, terminated_at)
-            else:
-                # instance is still running, so charge them up to current time
-                stop = period_stop
-            dt = stop - start
-            seconds = (dt.days * 3600 * 24 + dt.seconds +
-                       dt.microseconds / 100000.0)
-
-            return seconds / 3600.0
-        else:
-            # instance hasn't launched, so no charge
-            return 0
+        return compute_utils.usage_hours(instance, period_start, period_stop)
 
     def _tenant_usages_for_period(self, context, period_start,
                                   period_stop, tenant_id=None, detailed=True):
@@ -187,6 +159,57 @@ class SimpleTenantUsageController(object):
 
         return rval.values()
 
+    def _tenant_totals_for_period(self, context, period_start,
+                                  period_stop):
+        """Sum the usage of each tenant, from the rollups if possible.
+
+        The usage over the latest run of contiguous rolled up periods
+        comes from the rollups, the rest of the period is summed by the
+        database from the instances.
+        """
+
+        periods = db.tenant_usage_rollup_get_periods(context, period_start,
+                                                     period_stop)
+        if not periods:
+            usages = db.tenant_usage_get_totals_by_window(context,
+                                                          period_start,
+                                                          period_stop)
+            for summary in usages:
+                summary['start'] = period_start
+                summary['stop'] = period_stop
+            return usages
+
+        rolled_up_start, rolled_up_stop = periods[-1]
+        for beginning, ending in reversed(periods[:-1]):
+            if ending != rolled_up_start:
+                break
+            rolled_up_start = beginning
+
+        rval = {}
+        for usage in db.tenant_usage_rollup_get_totals(context,
+                                                       rolled_up_start,
+                                                       rolled_up_stop):
+            rval[usage['tenant_id']] = usage
+
+        for start, stop in ((period_start, rolled_up_start),
+                            (rolled_up_stop, period_stop)):
+            if start >= stop:
+                continue
+            for usage in db.tenant_usage_get_totals_by_window(context,
+                                                              start, stop):
+                summary = rval.get(usage['tenant_id'])
+                if summary is None:
+                    summary = dict((counter, 0) for counter in USAGE_COUNTERS)
+                    summary['tenant_id'] = usage['tenant_id']
+                    rval[usage['tenant_id']] = summary
+                for counter in USAGE_COUNTERS:
+                    summary[counter] += usage[counter]
+
+        for summary in rval.values():
+            summary['start'] = period_start
+            summary['stop'] = period_stop
+        return rval.values()
+
     def _parse_datetime(self, dtstr):
         if not dtstr:
             return timeutils.utcnow()
@@ -221,10 +244,15 @@ class SimpleTenantUsageController(object):
         now = timeutils.utcnow()
         if period_stop > now:
             period_stop = now
-        usages = self._tenant_usages_for_period(context,
-                                                period_start,
-                                                period_stop,
-                                                detailed=detailed)
+        if detailed:
+            usages = self._tenant_usages_for_period(context,
+                                                    period_start,
+                                                    period_stop,
+                                                    detailed=True)
+        else:
+            usages = self._tenant_totals_for_period(context,
+                                                    period_start,
+                                                    period_stop)
         return {'tenant_usages': usages}
 
     @wsgi.serializers(xml=SimpleTenantUsageTemplate)
@@ -19,6 +19,7 @@ Module dedicated functions/classes dealing with rate limiting requests.
 
 import collections
 import copy
+import hashlib
 import httplib
 import math
 import re
@@ -30,13 +31,17 @@ import webob.exc
 from nova.api.openstack.compute.views import limits as limits_views
 from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
+from nova import flags
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
 from nova import quota
 from nova import wsgi as base_wsgi
 
 
 QUOTAS = quota.QUOTAS
+FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
 
 
 # Convenience constants for the limits dictionary passed to Limiter().
@@ -383,6 +388,228 @@ class Limiter(object):
         return result
 
 
+class LocalBucketBackend(object):
+    """
+    Keeps the token buckets of a `BucketLimiter` in process memory.
+    """
+
+    # Number of updates between two sweeps of the empty buckets
+    SWEEP_INTERVAL = 1000
+
+    def __init__(self):
+        self.buckets = {}
+        self._updates = 0
+
+    def get_multi(self, keys):
+        """Return the stored values of the given bucket keys."""
+        return dict((key, self.buckets[key]) for key in keys
+                    if key in self.buckets)
+
+    def update(self, key, fn):
+        """
+        Replace the value of a bucket by the one computed by fn.
+
+        @param fn: Called with the stored value, or None, and returning a
+                   tuple of the new value, or None to leave it alone, the
+                   number of seconds to keep it and a result
+        @return: The result returned by fn
+        """
+        value, ttl, result = fn(self.buckets.get(key))
+        if value is not None:
+            self.buckets[key] = (value, time.time() + ttl)
+
+        self._updates += 1
+        if self._updates >= self.SWEEP_INTERVAL:
+            self._updates = 0
+            now = time.time()
+            for bucket_key, (_value, expires) in self.buckets.items():
+                if expires <= now:
+                    del self.buckets[bucket_key]
+
+        return result
+
+
+class MemcacheBucketBackend(object):
+    """
+    Keeps the token buckets of a `BucketLimiter` in memcached, where they
+    are shared by all the API workers.
+
+    Buckets are updated with gets and cas, so that concurrent updates
+    from several workers are never lost.
+    """
+
+    # Attempts to update a bucket under contention before giving up
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, key):
+        return 'nova-ratelimit-%s' % hashlib.md5(key.encode('utf-8')).\
+                hexdigest()
+
+    def get_multi(self, keys):
+        """Return the stored values of the given bucket keys."""
+        mc_keys = dict((self._key(key), key) for key in keys)
+        values = self.client.get_multi(mc_keys.keys())
+        return dict((mc_keys[mc_key], (float(value), None))
+                    for mc_key, value in values.items())
+
+    def update(self, key, fn):
+        """
+        Replace the value of a bucket by the one computed by fn.
+
+        @param fn: Called with the stored value, or None, and returning a
+                   tuple of the new value, or None to leave it alone, the
+                   number of seconds to keep it and a result
+        @return: The result returned by fn
+        """
+        key = self._key(key)
+        # Only the cas id of this update is needed, so don't let the
+        # client remember one for every bucket it has seen.
+        self.client.reset_cas()
+
+        for attempt in xrange(self.MAX_ATTEMPTS):
+            stored = self.client.gets(key)
+            if stored is not None:
+                stored = (float(stored), None)
+            value, ttl, result = fn(stored)
+            if value is None:
+                return result
+
+            value = repr(value)
+            ttl = int(math.ceil(ttl))
+            if stored is None:
+                stored = self.client.add(key, value, time=ttl)
+            else:
+                stored = self.client.cas(key, value, time=ttl)
+            if stored:
+                return result
+
+        LOG.warn(_("Rate limit bucket %(key)s is too contended to be "
+                   "updated"), locals())
+        return result
+
+
+class BucketLimiter(Limiter):
+    """
+    Rate-limit checking class which keeps a token bucket per user and
+    limit in a backend.
+
+    The buckets are kept in memcached when memcached_servers is set, so
+    that all the API workers enforce the limits together, and in process
+    memory otherwise.  Only the limits with the verb of a request are
+    checked against its URL.
+    """
+
+    def __init__(self, limits, backend=None, **kwargs):
+        """
+        Initialize the new `BucketLimiter`.
+
+        @param limits: List of `Limit` objects
+        @param backend: Bucket backend, picked from the flags if None
+        """
+        self.limits = limits
+        self.user_limits = {}
+
+        # Pick up any per-user limit information
+        for key, value in kwargs.items():
+            if key.startswith('user:'):
+                username = key[5:]
+                self.user_limits[username] = self.parse_limits(value)
+
+        self._dispatch = {}
+        for username, user_limits in ([(None, limits)] +
+                                      self.user_limits.items()):
+            verbs = collections.defaultdict(list)
+            for index, limit in enumerate(user_limits):
+                verbs[limit.verb].append((index, limit,
+                                          re.compile(limit.regex)))
+            self._dispatch[username] = dict(verbs)
+
+        if backend is None:
+            if FLAGS.memcached_servers:
+                import memcache
+                client = memcache.Client(FLAGS.memcached_servers, debug=0,
+                                         cache_cas=True)
+                backend = MemcacheBucketBackend(client)
+            else:
+                backend = LocalBucketBackend()
+        self.backend = backend
+
+    def _get_time(self):
+        """Retrieve the current time. Broken out for testability."""
+        return time.time()
+
+    def _get_user_limits(self, username):
+        if username in self.user_limits:
+            return username, self.user_limits[username]
+        return None, self.limits
+
+    def _bucket_key(self, username, index):
+        return u'%s:%d' % (username or '', index)
+
+    def get_limits(self, username=None):
+        """
+        Return the limits for a given user.
+        """
+        limits_key, user_limits = self._get_user_limits(username)
+        keys = [self._bucket_key(username, index)
+                for index in xrange(len(user_limits))]
+        buckets = self.backend.get_multi(keys)
+        now = self._get_time()
+
+        result = []
+        for key, limit in zip(keys, user_limits):
+            level = 0.0
+            if key in buckets:
+                level = max(buckets[key][0] - now, 0.0)
+            display = limit.display()
+            display['remaining'] = int(math.floor(
+                    (limit.capacity - level) / limit.capacity * limit.value))
+            display['resetTime'] = int(now + max(level + limit.request_value -
+                                                 limit.capacity, 0.0))
+            result.append(display)
+        return result
+
+    def check_for_delay(self, verb, url, username=None):
+        """
+        Check the given verb/user/user triplet for limit.
+
+        @return: Tuple of delay (in seconds) and error message (or None, None)
+        """
+        limits_key, _user_limits = self._get_user_limits(username)
+        delays = []
+
+        for index, limit, regex in self._dispatch[limits_key].get(verb, ()):
+            if not regex.match(url):
+                continue
+
+            now = self._get_time()
+
+            def take(stored):
+                # The bucket is stored as the time it will be empty at.
+                level = 0.0
+                if stored is not None:
+                    level = max(stored[0] - now, 0.0)
+                level += limit.request_value
+                difference = level - limit.capacity
+                if difference > 0:
+                    return None, None, difference
+                return now + level, level + 1, None
+
+            delay = self.backend.update(self._bucket_key(username, index),
+                                        take)
+            if delay:
+                delays.append((delay, limit.error_message))
+
+        if delays:
+            delays.sort()
+            return delays[0]
+
+        return None, None
+
+
 class WsgiLimiter(object):
     """
     Rate-limit checking from a WSGI application. Uses an in-memory `Limiter`.
@@ -529,12 +529,20 @@ class Controller(wsgi.Controller):
             else:
                 search_opts['user_id'] = context.user_id
 
+        # The index view only shows the uuid and name of each instance,
+        # skip loading the relationships the detail view needs.
+        columns_to_join = None if is_detail else []
+
         limit, marker = common.get_limit_and_marker(req)
         try:
+            # Listings tolerate slightly stale data, read them from the
+            # replica when one is configured.
             instance_list = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     limit=limit,
-                                                     marker=marker)
+                                             search_opts=search_opts,
+                                             limit=limit,
+                                             marker=marker,
+                                             columns_to_join=columns_to_join,
+                                             use_slave=True)
         except exception.MarkerNotFound as e:
             msg = _('marker [%s] not found') % marker
             raise webob.exc.HTTPBadRequest(explanation=msg)
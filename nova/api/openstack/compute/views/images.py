@@ -18,6 +18,7 @@
 import os.path
 
 from nova.api.openstack import common
+from nova.api.openstack import wsgi
 from nova import flags
 from nova import utils
 
@@ -90,7 +91,8 @@ class ViewBuilder(common.ViewBuilder):
 
     def _list_view(self, list_func, request, images):
         """Provide a view for a list of images."""
-        image_list = [list_func(request, image)["image"] for image in images]
+        image_list = wsgi.build_items(
+                images, lambda image: list_func(request, image)["image"])
         images_links = self._get_collection_links(request,
                                                   images,
                                                   self._collection_name)
@@ -22,6 +22,7 @@ from nova.api.openstack import common
 from nova.api.openstack.compute.views import addresses as views_addresses
 from nova.api.openstack.compute.views import flavors as views_flavors
 from nova.api.openstack.compute.views import images as views_images
+from nova.api.openstack import wsgi
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 
@@ -128,7 +129,8 @@ class ViewBuilder(common.ViewBuilder):
 
     def _list_view(self, func, request, servers):
         """Provide a view for a list of servers."""
-        server_list = [func(request, server)["server"] for server in servers]
+        server_list = wsgi.build_items(
+                servers, lambda server: func(request, server)["server"])
         servers_links = self._get_collection_links(request,
                                                    servers,
                                                    self._collection_name)
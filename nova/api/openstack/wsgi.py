@@ -16,6 +16,7 @@
 #    under the License.
 
 import inspect
+import itertools
 import math
 import time
 from xml.dom import minidom
@@ -24,12 +25,26 @@ from xml.parsers import expat
 from lxml import etree
 import webob
 
+from nova import context as nova_context
+from nova.db import query_stats
 from nova import exception
+from nova import flags
+from nova.openstack.common import cfg
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova import wsgi
 
 
+stream_lists_opt = cfg.BoolOpt('osapi_stream_lists',
+                               default=False,
+                               help='Build and serialize the items of JSON '
+                                    'server and image listings one at a '
+                                    'time while sending the response')
+
+FLAGS = flags.FLAGS
+FLAGS.register_opt(stream_lists_opt)
+
+
 XMLNS_V10 = 'http://docs.rackspacecloud.com/servers/api/v1.0'
 XMLNS_V11 = 'http://docs.openstack.org/compute/api/v1.1'
 
@@ -37,6 +52,9 @@ XMLNS_ATOM = 'http://www.w3.org/2005/Atom'
 
 LOG = logging.getLogger(__name__)
 
+# Size of the chunks written by streamed JSON responses
+STREAM_CHUNK_SIZE = 65536
+
 # The vendor content types should serialize identically to the non-vendor
 # content types. So to avoid littering the code with both options, we
 # map the vendor to the other when looking up the type
@@ -310,12 +328,156 @@ class DictSerializer(ActionDispatcher):
         return ""
 
 
+class ItemStream(object):
+    """A list of response items built while the response is sent.
+
+    Items are built from the source objects by the builder and passed
+    to the hooks added by extensions.  Serializers able to write the
+    items one at a time use stream(), so that the items are never all
+    held in memory.  Using the object as a list builds all the items
+    and keeps them.
+    """
+
+    def __init__(self, objects, builder):
+        self._objects = objects
+        self._builder = builder
+        self._hooks = []
+        self._items = None
+        self._started = []
+
+    def _build(self, obj):
+        item = self._builder(obj)
+        for hook in self._hooks:
+            hook(item)
+        return item
+
+    def add_hook(self, hook):
+        """Call hook with each item once it is built."""
+        if self._items is not None:
+            for item in self._items:
+                hook(item)
+        else:
+            for item in self._started:
+                hook(item)
+            self._hooks.append(hook)
+
+    def start(self):
+        """Build the first item ahead of stream().
+
+        Builders and hooks failing on every item then fail before the
+        response is sent.
+        """
+        if self._items is None and not self._started:
+            self._started = [self._build(obj)
+                             for obj in itertools.islice(self._objects, 1)]
+
+    def stream(self):
+        """Return an iterator building the items one at a time."""
+        if self._items is not None:
+            return iter(self._items)
+        rest = itertools.islice(self._objects, len(self._started), None)
+        return itertools.chain(self._started,
+                               (self._build(obj) for obj in rest))
+
+    def materialize(self):
+        """Build all the items and return them as a list."""
+        if self._items is None:
+            self._items = list(self.stream())
+        return self._items
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __getitem__(self, idx):
+        return self.materialize()[idx]
+
+    def __eq__(self, other):
+        return self.materialize() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+
+def build_items(objects, builder):
+    """Build the items of a list response.
+
+    Returns an ItemStream when osapi_stream_lists is set, and the list
+    of the items otherwise.
+    """
+
+    if FLAGS.osapi_stream_lists:
+        return ItemStream(objects, builder)
+    return [builder(obj) for obj in objects]
+
+
+def _has_item_streams(data):
+    return (isinstance(data, dict) and
+            any(isinstance(value, ItemStream) for value in data.values()))
+
+
+def _materialize(data):
+    """Replace the ItemStream values of a response by lists."""
+
+    if not _has_item_streams(data):
+        return data
+    return dict((key, value.materialize()
+                 if isinstance(value, ItemStream) else value)
+                for key, value in data.items())
+
+
 class JSONDictSerializer(DictSerializer):
     """Default JSON request body serialization"""
 
     def default(self, data):
         return jsonutils.dumps(data)
 
+    def _stream(self, data):
+        if not _has_item_streams(data):
+            yield jsonutils.dumps(data)
+            return
+
+        yield '{'
+        for idx, (key, value) in enumerate(data.items()):
+            if idx:
+                yield ', '
+            yield jsonutils.dumps(key) + ': '
+            if not isinstance(value, ItemStream):
+                yield jsonutils.dumps(value)
+                continue
+
+            yield '['
+            for item_idx, item in enumerate(value.stream()):
+                if item_idx:
+                    yield ', '
+                yield jsonutils.dumps(item)
+            yield ']'
+        yield '}'
+
+    def stream(self, data):
+        """Serialize data in chunks.
+
+        The items of the ItemStream values of data are built and
+        serialized one at a time, as the chunks are consumed.
+        """
+
+        chunk = []
+        size = 0
+        for piece in self._stream(data):
+            chunk.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
+
 
 class XMLDictSerializer(DictSerializer):
 
@@ -558,6 +720,23 @@ class ResponseObject(object):
         self.media_type = mtype
         self.serializer = serializer()
 
+    def extend_items(self, key, func):
+        """Call func with each item of a list response.
+
+        For an ItemStream, func is called as each item is built while
+        the response is serialized.
+
+        :param key: The key of the list in the response object.
+        :param func: A callable taking an item, which it may update.
+        """
+
+        items = self.obj[key]
+        if isinstance(items, ItemStream):
+            items.add_hook(func)
+        else:
+            for item in items:
+                func(item)
+
     def attach(self, **kwargs):
         """Attach slave templates to serializers."""
 
@@ -584,7 +763,19 @@ class ResponseObject(object):
             response.headers[hdr] = value
         response.headers['Content-Type'] = content_type
         if self.obj is not None:
-            response.body = serializer.serialize(self.obj)
+            if (hasattr(serializer, 'stream') and
+                    _has_item_streams(self.obj)):
+                # NOTE: Build the first items before sending anything,
+                # so that a view builder or extension hook failing on
+                # every item still results in a fault.
+                for value in self.obj.values():
+                    if isinstance(value, ItemStream):
+                        value.start()
+                response.app_iter = StreamedBody(serializer.stream(self.obj),
+                                                 request.url)
+                response.content_length = None
+            else:
+                response.body = serializer.serialize(_materialize(self.obj))
 
         return response
 
@@ -601,6 +792,39 @@ class ResponseObject(object):
         return self._headers.copy()
 
 
+class StreamedBody(object):
+    """The body of a response serialized while it is sent.
+
+    Errors once the status has been sent can't become faults anymore,
+    they are logged and the response is aborted, which drops the
+    connection so that clients don't take it as complete.  Statements
+    issued while building the body are counted in the query stats
+    scope of the request, which ends with the body.
+    """
+
+    def __init__(self, chunks, url):
+        self.chunks = chunks
+        self.url = url
+        self.query_stats = None
+
+    def __iter__(self):
+        try:
+            with query_stats.resume(self.query_stats):
+                for chunk in self.chunks:
+                    yield chunk
+        except Exception:
+            LOG.exception(_("Aborting the response to %s"), self.url)
+            raise
+        finally:
+            self.close()
+
+    def close(self):
+        """End the query stats scope of the request."""
+        stats, self.query_stats = self.query_stats, None
+        if stats is not None:
+            query_stats.finish(stats)
+
+
 def action_peek_json(body):
     """Determine action to invoke."""
 
@@ -881,8 +1105,14 @@ class Resource(wsgi.Application):
         #            function.  If we try to audit __call__(), we can
         #            run into troubles due to the @webob.dec.wsgify()
         #            decorator.
-        return self._process_stack(request, action, action_args,
-                                   content_type, body, accept)
+        with query_stats.scope(self._query_stats_scope(request, action,
+                                                       content_type, body)):
+            response = self._process_stack(request, action, action_args,
+                                           content_type, body, accept)
+            if isinstance(getattr(response, 'app_iter', None),
+                          StreamedBody):
+                response.app_iter.query_stats = query_stats.detach()
+            return response
 
     def _process_stack(self, request, action, action_args,
                        content_type, body, accept):
@@ -923,6 +1153,9 @@ class Resource(wsgi.Application):
             msg = _("Malformed request url")
             return Fault(webob.exc.HTTPBadRequest(explanation=msg))
 
+        if context:
+            context.request_cache = nova_context.RequestCache()
+
         # Run pre-processing extensions
         response, post = self.pre_process_extensions(extensions,
                                                      request, action_args)
@@ -971,6 +1204,12 @@ class Resource(wsgi.Application):
             msg = _("%(url)s returned a fault: %(e)s") % msg_dict
 
         LOG.info(msg)
+        if context and context.request_cache.hits:
+            LOG.debug(_("Request cache for %(url)s: %(hits)d hits, "
+                        "%(misses)d misses"),
+                      dict(url=request.url,
+                           hits=context.request_cache.hits,
+                           misses=context.request_cache.misses))
 
         return response
 
@@ -1015,6 +1254,23 @@ class Resource(wsgi.Application):
         return (self.wsgi_actions[action_name],
                 self.wsgi_action_extensions.get(action_name, []))
 
+    def _query_stats_scope(self, request, action, content_type, body):
+        """Name the SQL statements issued by a request after its method."""
+        if not FLAGS.sql_query_stats:
+            return action
+        try:
+            method, _extensions = self.get_method(request, action,
+                                                  content_type, body)
+        except (AttributeError, TypeError, KeyError,
+                exception.MalformedRequestBody):
+            # _process_stack() turns the lookup error into a fault
+            return action
+        owner = getattr(method, 'im_self', None)
+        if owner is None:
+            return getattr(method, '__name__', repr(method))
+        return '%s.%s.%s' % (owner.__class__.__module__,
+                             owner.__class__.__name__, method.__name__)
+
     def dispatch(self, method, request, action_args):
         """Dispatch a call to the action-specific method."""
 
@@ -27,6 +27,15 @@ XMLNS_V11 = 'http://docs.openstack.org/compute/api/v1.1'
 XMLNS_COMMON_V10 = 'http://docs.openstack.org/common/api/v1.0'
 XMLNS_ATOM = 'http://www.w3.org/2005/Atom'
 
+# Bumped whenever a template element changes, which invalidates all the
+# compiled templates
+_generation = 0
+
+
+def _template_changed():
+    global _generation
+    _generation += 1
+
 
 def validate_schema(xml, schema_name):
     if isinstance(xml, str):
@@ -172,6 +181,7 @@ class TemplateElement(object):
         self._text = None
         self._children = []
         self._childmap = {}
+        self._compiled = {}
 
         # Run the incoming attributes through set() so that they
         # become selectorized
@@ -219,6 +229,7 @@ class TemplateElement(object):
 
         self._children.append(elem)
         self._childmap[elem.tag] = elem
+        _template_changed()
 
     def extend(self, elems):
         """Append children to the element."""
@@ -240,6 +251,7 @@ class TemplateElement(object):
         # Update the children
         self._children.extend(elemlist)
         self._childmap.update(elemmap)
+        _template_changed()
 
     def insert(self, idx, elem):
         """Insert a child element at the given index."""
@@ -253,6 +265,7 @@ class TemplateElement(object):
 
         self._children.insert(idx, elem)
         self._childmap[elem.tag] = elem
+        _template_changed()
 
     def remove(self, elem):
         """Remove a child element."""
@@ -266,6 +279,7 @@ class TemplateElement(object):
 
         self._children.remove(elem)
         del self._childmap[elem.tag]
+        _template_changed()
 
     def get(self, key):
         """Get an attribute.
@@ -296,6 +310,7 @@ class TemplateElement(object):
             value = Selector(value)
 
         self.attrib[key] = value
+        _template_changed()
 
     def keys(self):
         """Return the attribute names."""
@@ -453,9 +468,11 @@ class TemplateElement(object):
             value = Selector(value)
 
         self._text = value
+        _template_changed()
 
     def _text_del(self):
         self._text = None
+        _template_changed()
 
     text = property(_text_get, _text_set, _text_del)
 
@@ -489,6 +506,181 @@ class TemplateElement(object):
                 (' '.join(contents), ''.join(children), self.tag))
 
 
+def _nieces(siblings):
+    """Group the children of sibling template elements.
+
+    Returns a list with, for each child tag of the siblings, the list
+    of the children with that tag in sibling order.
+    """
+
+    result = []
+    seen = set()
+    for idx, sibling in enumerate(siblings):
+        for child in sibling:
+            # Have we handled this child already?
+            if child.tag in seen:
+                continue
+            seen.add(child.tag)
+
+            # Determine the child's siblings
+            nieces = [child]
+            for sib in siblings[idx + 1:]:
+                if child.tag in sib:
+                    nieces.append(sib[child.tag])
+            result.append(nieces)
+
+    return result
+
+
+def _selector_chain(selector):
+    """Return the indexes of a plain Selector, or None.
+
+    Compiled template elements index the object directly instead of
+    calling a Selector whose chain has no callables.
+    """
+
+    if selector is None or type(selector) is not Selector:
+        return None
+    for elem in selector.chain:
+        if callable(elem):
+            return None
+    return selector.chain
+
+
+class CompiledTemplateElement(object):
+    """Represent a template element merged with its patches.
+
+    A compiled element holds what is needed to render a template
+    element and the slave template elements patching it, computed once
+    instead of for every object serialized: the text and attribute
+    selectors of all the siblings, in the order they are applied, and
+    the compiled children.  The will_render() hook of the template
+    element is honored; the other rendering methods are not called.
+    """
+
+    def __init__(self, siblings):
+        """Compile a template element and its patches.
+
+        :param siblings: The template element followed by the
+                         template elements to apply as patches.
+        """
+
+        elem = siblings[0]
+        self.tag = elem.tag
+        self.dyntag = callable(elem.tag)
+        self.selector = elem.selector
+        self.chain = _selector_chain(elem.selector)
+        self.subselector = elem.subselector
+        self.will_render = None
+        if (elem.will_render.im_func is not
+                TemplateElement.will_render.im_func):
+            self.will_render = elem.will_render
+
+        # Later patches override the text and attributes of earlier
+        # ones, except for the attributes without a value
+        self.text = None
+        self.attrib = []
+        for sibling in siblings:
+            if sibling.text is not None:
+                self.text = sibling.text
+            for key, value in sibling.items():
+                self.attrib.append((key, _selector_chain(value), value))
+        self.text_chain = _selector_chain(self.text)
+
+        self.children = [CompiledTemplateElement(nieces)
+                         for nieces in _nieces(siblings)]
+
+    def render(self, parent, obj, nsmap=None):
+        """Render an object and its children.
+
+        Renders an object against this compiled element, recursing to
+        the children.  Returns the first etree.Element instance
+        rendered, or None.
+
+        :param parent: The parent etree.Element instance.  Can be
+                       None.
+        :param obj: The object to render.
+        :param nsmap: An optional namespace dictionary to be
+                      associated with the etree.Element instances.
+        """
+
+        # First, get the data we're rendering
+        data = obj
+        if obj is not None:
+            if self.chain is None:
+                data = self.selector(obj)
+            else:
+                try:
+                    for index in self.chain:
+                        data = data[index]
+                except (KeyError, IndexError):
+                    data = None
+
+        # Check if we should render at all
+        if self.will_render is not None:
+            if not self.will_render(data):
+                return None
+        elif data is None:
+            return None
+
+        subselector = self.subselector
+        if data is None:
+            data = [None]
+            subselector = None
+        elif not isinstance(data, list):
+            data = [data]
+        elif parent is None:
+            raise ValueError(_('root element selecting a list'))
+
+        first = None
+        for datum in data:
+            if subselector is not None:
+                datum = subselector(datum)
+
+            tagname = self.tag(datum) if self.dyntag else self.tag
+            if parent is None:
+                elem = etree.Element(tagname, nsmap=nsmap)
+            else:
+                elem = etree.SubElement(parent, tagname)
+
+            if datum is not None:
+                if self.text is not None:
+                    if self.text_chain is None:
+                        text = self.text(datum)
+                    else:
+                        text = datum
+                        try:
+                            for index in self.text_chain:
+                                text = text[index]
+                        except (KeyError, IndexError):
+                            text = None
+                    elem.text = unicode(text)
+
+                for key, chain, value in self.attrib:
+                    if chain is None:
+                        try:
+                            value = value(datum, True)
+                        except KeyError:
+                            # Attribute has no value, so don't include it
+                            continue
+                    else:
+                        value = datum
+                        try:
+                            for index in chain:
+                                value = value[index]
+                        except (KeyError, IndexError):
+                            continue
+                    elem.set(key, unicode(value))
+
+            for child in self.children:
+                child.render(elem, datum)
+
+            if first is None:
+                first = elem
+
+        return first
+
+
 def SubTemplateElement(parent, tag, attrib=None, selector=None,
                        subselector=None, **extra):
     """Create a template element as a child of another.
@@ -528,50 +720,6 @@ class Template(object):
         self.nsmap = nsmap or {}
         self.serialize_options = dict(encoding='UTF-8', xml_declaration=True)
 
-    def _serialize(self, parent, obj, siblings, nsmap=None):
-        """Internal serialization.
-
-        Recursive routine to build a tree of etree.Element instances
-        from an object based on the template.  Returns the first
-        etree.Element instance rendered, or None.
-
-        :param parent: The parent etree.Element instance.  Can be
-                       None.
-        :param obj: The object to render.
-        :param siblings: The TemplateElement instances against which
-                         to render the object.
-        :param nsmap: An optional namespace dictionary to be
-                      associated with the etree.Element instance
-                      rendered.
-        """
-
-        # First step, render the element
-        elems = siblings[0].render(parent, obj, siblings[1:], nsmap)
-
-        # Now, recurse to all child elements
-        seen = set()
-        for idx, sibling in enumerate(siblings):
-            for child in sibling:
-                # Have we handled this child already?
-                if child.tag in seen:
-                    continue
-                seen.add(child.tag)
-
-                # Determine the child's siblings
-                nieces = [child]
-                for sib in siblings[idx + 1:]:
-                    if child.tag in sib:
-                        nieces.append(sib[child.tag])
-
-                # Now we recurse for every data element
-                for elem, datum in elems:
-                    self._serialize(elem, datum, nieces)
-
-        # Return the first element; at the top level, this will be the
-        # root element
-        if elems:
-            return elems[0][0]
-
     def serialize(self, obj, *args, **kwargs):
         """Serialize an object.
 
@@ -605,12 +753,24 @@ class Template(object):
         if self.root is None:
             return None
 
-        # Get the siblings and nsmap of the root element
-        siblings = self._siblings()
-        nsmap = self._nsmap()
-
         # Form the element tree
-        return self._serialize(None, obj, siblings, nsmap)
+        return self.compile().render(None, obj, self._nsmap())
+
+    def compile(self):
+        """Compile the template.
+
+        Returns the CompiledTemplateElement for the root element and
+        its siblings.  It is cached on the root element, per set of
+        siblings, until a template element is changed.
+        """
+
+        siblings = self._siblings()
+        key = tuple(siblings[1:])
+        cached = self.root._compiled.get(key)
+        if cached is None or cached[0] != _generation:
+            cached = (_generation, CompiledTemplateElement(siblings))
+            self.root._compiled[key] = cached
+        return cached[1]
 
     def _siblings(self):
         """Hook method for computing root siblings.
@@ -35,6 +35,7 @@ from nova.compute import rpcapi as compute_rpcapi
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova.consoleauth import rpcapi as consoleauth_rpcapi
+from nova import context as nova_context
 from nova import crypto
 from nova.db import base
 from nova import exception
@@ -1015,7 +1016,19 @@ class API(base.Base):
     #NOTE(bcwaldon): this doesn't really belong in this class
     def get_instance_type(self, context, instance_type_id):
         """Get an instance type by instance type id."""
-        return instance_types.get_instance_type(instance_type_id)
+        return nova_context.cached_lookup(context, 'instance_type',
+                                          instance_type_id,
+                                          instance_types.get_instance_type,
+                                          instance_type_id)
+
+    def get_instance_type_by_flavor_id(self, context, flavor_id):
+        """Get an instance type, including deleted ones, by flavor id.
+
+        :raises: FlavorNotFound
+        """
+        return nova_context.cached_lookup(
+                context, 'flavor', flavor_id,
+                instance_types.get_instance_type_by_flavor_id, flavor_id)
 
     def get(self, context, instance_id):
         """Get a single instance with the given instance_id."""
@@ -1033,7 +1046,8 @@ class API(base.Base):
         return inst
 
     def get_all(self, context, search_opts=None, sort_key='created_at',
-                sort_dir='desc', limit=None, marker=None):
+                sort_dir='desc', limit=None, marker=None,
+                columns_to_join=None, use_slave=False):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -1045,6 +1059,13 @@ class API(base.Base):
         The results will be returned sorted in the order specified by the
         'sort_dir' parameter using the key specified in the 'sort_key'
         parameter.
+
+        The instances come with the relationships named in
+        'columns_to_join' loaded, or all of them when it is None.
+
+        With 'use_slave', the instances are read from the database replica
+        when one is configured.  Only listings shown to users, which
+        tolerate replication lag, should ask for it.
         """
 
         #TODO(bcwaldon): determine the best argument for target here
@@ -1065,8 +1086,8 @@ class API(base.Base):
 
         def _remap_flavor_filter(flavor_id):
             try:
-                instance_type = instance_types.get_instance_type_by_flavor_id(
-                        flavor_id)
+                instance_type = self.get_instance_type_by_flavor_id(
+                        context, flavor_id)
             except exception.FlavorNotFound:
                 raise ValueError()
 
@@ -1110,9 +1131,9 @@ class API(base.Base):
                         return []
 
         inst_models = self._get_instances_by_filters(context, filters,
-                                                     sort_key, sort_dir,
-                                                     limit=limit,
-                                                     marker=marker)
+                                sort_key, sort_dir, limit=limit, marker=marker,
+                                columns_to_join=columns_to_join,
+                                use_slave=use_slave)
 
         # Convert the models to dictionaries
         instances = []
@@ -1127,7 +1148,9 @@ class API(base.Base):
     def _get_instances_by_filters(self, context, filters,
                                   sort_key, sort_dir,
                                   limit=None,
-                                  marker=None):
+                                  marker=None,
+                                  columns_to_join=None,
+                                  use_slave=False):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1137,8 +1160,8 @@ class API(base.Base):
             filters['uuid'] = uuids
 
         return self.db.instance_get_all_by_filters(context, filters,
-                                                   sort_key, sort_dir,
-                                                   limit=limit, marker=marker)
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join, use_slave=use_slave)
 
     @wrap_check_policy
     @check_instance_state(vm_state=[vm_states.ACTIVE, vm_states.STOPPED])
@@ -1594,8 +1617,8 @@ class API(base.Base):
                       instance=instance)
             new_instance_type = current_instance_type
         else:
-            new_instance_type = instance_types.get_instance_type_by_flavor_id(
-                    flavor_id)
+            new_instance_type = self.get_instance_type_by_flavor_id(
+                    context, flavor_id)
 
         current_instance_type_name = current_instance_type['name']
         new_instance_type_name = new_instance_type['name']
@@ -2257,6 +2280,11 @@ class SecurityGroupAPI(base.Base):
 
         :param context: the security context
         """
+        nova_context.cached_lookup(context, 'security_group',
+                                   ('default', context.project_id),
+                                   self._ensure_default, context)
+
+    def _ensure_default(self, context):
         existed, group = self.db.security_group_ensure_default(context)
         if not existed:
             self.sgh.trigger_security_group_create_refresh(context, group)
@@ -2296,11 +2324,15 @@ class SecurityGroupAPI(base.Base):
         self.ensure_default(context)
         try:
             if name:
-                return self.db.security_group_get_by_name(context,
-                                                          context.project_id,
-                                                          name)
+                return nova_context.cached_lookup(
+                        context, 'security_group',
+                        ('name', context.project_id, name),
+                        self.db.security_group_get_by_name,
+                        context, context.project_id, name)
             elif id:
-                return self.db.security_group_get(context, id)
+                return nova_context.cached_lookup(
+                        context, 'security_group', ('id', id),
+                        self.db.security_group_get, context, id)
         except exception.NotFound as exp:
             if map_exception:
                 msg = unicode(exp)
@@ -2354,6 +2386,7 @@ class SecurityGroupAPI(base.Base):
         LOG.audit(_("Delete security group %s"), security_group.name,
                   context=context)
         self.db.security_group_destroy(context, security_group.id)
+        nova_context.invalidate_cached(context, 'security_group')
 
         self.sgh.trigger_security_group_destroy_refresh(context,
                                                         security_group.id)
@@ -2402,6 +2435,7 @@ class SecurityGroupAPI(base.Base):
         self.db.instance_add_security_group(context.elevated(),
                                             instance_uuid,
                                             security_group['id'])
+        nova_context.invalidate_cached(context, 'security_group')
         # NOTE(comstud): No instance_uuid argument to this compute manager
         # call
         self.security_group_rpcapi.refresh_security_group_rules(context,
@@ -2432,6 +2466,7 @@ class SecurityGroupAPI(base.Base):
         self.db.instance_remove_security_group(context.elevated(),
                                                instance_uuid,
                                                security_group['id'])
+        nova_context.invalidate_cached(context, 'security_group')
         # NOTE(comstud): No instance_uuid argument to this compute manager
         # call
         self.security_group_rpcapi.refresh_security_group_rules(context,
@@ -2624,6 +2659,7 @@ class SecurityGroupAPI(base.Base):
         LOG.audit(msg, name, context=context)
 
         rules = [self.db.security_group_rule_create(context, v) for v in vals]
+        nova_context.invalidate_cached(context, 'security_group')
 
         self.trigger_rules_refresh(context, id=id)
         self.trigger_handler('security_group_rule_create', context,
@@ -2636,6 +2672,7 @@ class SecurityGroupAPI(base.Base):
 
         for rule_id in rule_ids:
             self.db.security_group_rule_destroy(context, rule_id)
+        nova_context.invalidate_cached(context, 'security_group')
 
         # NOTE(vish): we removed some rules, so refresh
         self.trigger_rules_refresh(context, id=security_group['id'])
@@ -112,7 +112,7 @@ def get_all_types(ctxt=None, inactive=False, filters=None):
         ctxt = context.get_admin_context()
 
     inst_types = db.instance_type_get_all(
-            ctxt, inactive=inactive, filters=filters)
+            ctxt, inactive=inactive, filters=filters, use_slave=True)
 
     inst_type_dict = {}
     for inst_type in inst_types:
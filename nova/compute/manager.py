@@ -35,6 +35,7 @@ terminating it.
 """
 
 import contextlib
+import datetime
 import functools
 import socket
 import sys
@@ -141,6 +142,15 @@ compute_opts = [
     cfg.BoolOpt('instance_usage_audit',
                default=False,
                help="Generate periodic compute.instance.exists notifications"),
+    cfg.BoolOpt('tenant_usage_rollups',
+                default=False,
+                help="Roll up the usage of every tenant hourly, for the "
+                     "os-simple-tenant-usage API. Enabling it on a couple of "
+                     "compute hosts is enough"),
+    cfg.IntOpt('tenant_usage_rollup_backfill_hours',
+               default=24,
+               help="Number of past hours to roll up tenant usage for when "
+                    "they are missing"),
     ]
 
 FLAGS = flags.FLAGS
@@ -255,6 +265,22 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         return instance_ref
 
+    def _instance_update_bulk(self, context, instance_uuids, **kwargs):
+        """Update many instances in the database using kwargs as values.
+
+        Returns the instances that were updated, which can be fewer than
+        instance_uuids when an expected state guard is given.
+        """
+
+        results = self.db.instance_update_bulk(context, instance_uuids,
+                                               kwargs)
+        instance_refs = [instance_ref for _old_ref, instance_ref in results]
+        self.resource_tracker.update_usage_bulk(context, instance_refs)
+        for old_ref, instance_ref in results:
+            notifications.send_update(context, old_ref, instance_ref)
+
+        return instance_refs
+
     def _set_instance_error_state(self, context, instance_uuid):
         try:
             self._instance_update(context, instance_uuid,
@@ -593,11 +619,18 @@ class ComputeManager(manager.SchedulerDependentManager):
         filters = {'vm_state': vm_states.BUILDING}
         building_insts = self.db.instance_get_all_by_filters(context, filters)
 
-        for instance in building_insts:
-            if timeutils.is_older_than(instance['created_at'], timeout):
-                self._set_instance_error_state(context, instance['uuid'])
-                LOG.warn(_("Instance build timed out. Set to error state."),
-                         instance=instance)
+        timed_out_uuids = [instance['uuid'] for instance in building_insts
+                if timeutils.is_older_than(instance['created_at'], timeout)]
+        if not timed_out_uuids:
+            return
+
+        # Instances that finished building in the meantime are left alone
+        timed_out_insts = self._instance_update_bulk(context,
+                timed_out_uuids, vm_state=vm_states.ERROR,
+                expected_vm_state=vm_states.BUILDING)
+        for instance in timed_out_insts:
+            LOG.warn(_("Instance build timed out. Set to error state."),
+                     instance=instance)
 
     def _update_access_ip(self, context, instance, nw_info):
         """Update the access ip values for a given instance.
@@ -2558,6 +2591,28 @@ class ComputeManager(manager.SchedulerDependentManager):
                                               num_instances,
                                               time.time() - start_time))
 
+    @manager.periodic_task
+    def _roll_up_tenant_usage(self, context):
+        if not FLAGS.tenant_usage_rollups:
+            return
+
+        end = timeutils.utcnow().replace(minute=0, second=0, microsecond=0)
+        begin = end - datetime.timedelta(
+                hours=FLAGS.tenant_usage_rollup_backfill_hours)
+        rolled_up = set(beginning for beginning, _ending in
+                        self.db.tenant_usage_rollup_get_periods(context,
+                                                                begin, end))
+
+        period_beginning = begin
+        while period_beginning < end:
+            period_ending = period_beginning + datetime.timedelta(hours=1)
+            if period_beginning not in rolled_up:
+                LOG.debug(_("Rolling up tenant usage from %(period_beginning)s"
+                            " to %(period_ending)s"), locals())
+                compute_utils.roll_up_tenant_usage(context, period_beginning,
+                                                   period_ending)
+            period_beginning = period_ending
+
     @manager.periodic_task
     def _poll_bandwidth_usage(self, context):
         prev_time, start_time = utils.last_completed_audit_period()
@@ -2645,8 +2700,9 @@ class ComputeManager(manager.SchedulerDependentManager):
         To sync power state data we make a DB call to get the number of
         virtual machines known by the hypervisor and if the number matches the
         number of virtual machines known by the database, we proceed in a lazy
-        loop, one database record at a time, checking if the hypervisor has the
-        same power state as is in the database.
+        loop, checking if the hypervisor has the same power state as is in
+        the database.  The power states that changed are saved with one
+        database update per power state.
 
         If the instance is not found on the hypervisor, but is in the database,
         then a stop() API will be called on the instance.
@@ -2660,8 +2716,8 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        vm_power_states = {}
         for db_instance in db_instances:
-            db_power_state = db_instance['power_state']
             if db_instance['task_state'] is not None:
                 LOG.info(_("During sync_power_state the instance has a "
                            "pending task. Skip."), instance=db_instance)
@@ -2672,12 +2728,28 @@ class ComputeManager(manager.SchedulerDependentManager):
                 vm_power_state = vm_instance['state']
             except exception.InstanceNotFound:
                 vm_power_state = power_state.NOSTATE
-            # Note(maoy): the above get_info call might take a long time,
-            # for example, because of a broken libvirt driver.
-            # We re-query the DB to get the latest instance info to minimize
-            # (not eliminate) race condition.
-            u = self.db.instance_get_by_uuid(context,
-                                             db_instance['uuid'])
+            vm_power_states[db_instance['uuid']] = vm_power_state
+
+        if not vm_power_states:
+            return
+
+        # Note(maoy): the above get_info calls might take a long time, for
+        # example, because of a broken libvirt driver.
+        # We re-query the DB to get the latest instance info to minimize
+        # (not eliminate) race condition.
+        db_instances = dict((db_instance['uuid'], db_instance)
+                            for db_instance in db_instances)
+        filters = {'uuid': vm_power_states.keys()}
+        current_instances = self.db.instance_get_all_by_filters(context,
+                filters, columns_to_join=[])
+
+        power_state_updates = {}
+        vm_state_checks = []
+        for u in current_instances:
+            if u['deleted']:
+                continue
+            db_instance = db_instances[u['uuid']]
+            vm_power_state = vm_power_states[u['uuid']]
             db_power_state = u["power_state"]
             vm_state = u['vm_state']
             if self.host != u['host']:
@@ -2705,74 +2777,86 @@ class ComputeManager(manager.SchedulerDependentManager):
                            "pending task. Skip."), instance=db_instance)
                 continue
             if vm_power_state != db_power_state:
-                # power_state is always updated from hypervisor to db
-                self._instance_update(context,
-                                      db_instance['uuid'],
-                                      power_state=vm_power_state)
-                db_power_state = vm_power_state
-            # Note(maoy): Now resolve the discrepancy between vm_state and
-            # vm_power_state. We go through all possible vm_states.
-            if vm_state in (vm_states.BUILDING,
-                            vm_states.RESCUED,
-                            vm_states.RESIZED,
-                            vm_states.SUSPENDED,
-                            vm_states.PAUSED,
-                            vm_states.ERROR):
-                # TODO(maoy): we ignore these vm_state for now.
-                pass
-            elif vm_state == vm_states.ACTIVE:
-                # The only rational power state should be RUNNING
-                if vm_power_state in (power_state.NOSTATE,
-                                       power_state.SHUTDOWN,
-                                       power_state.CRASHED):
-                    LOG.warn(_("Instance shutdown by itself. Calling "
-                               "the stop API."), instance=db_instance)
-                    try:
-                        # Note(maoy): here we call the API instead of
-                        # brutally updating the vm_state in the database
-                        # to allow all the hooks and checks to be performed.
-                        self.compute_api.stop(context, db_instance)
-                    except Exception:
-                        # Note(maoy): there is no need to propagate the error
-                        # because the same power_state will be retrieved next
-                        # time and retried.
-                        # For example, there might be another task scheduled.
-                        LOG.exception(_("error during stop() in "
-                                        "sync_power_state."),
-                                      instance=db_instance)
-                elif vm_power_state in (power_state.PAUSED,
-                                        power_state.SUSPENDED):
-                    LOG.warn(_("Instance is paused or suspended "
-                               "unexpectedly. Calling "
-                               "the stop API."), instance=db_instance)
-                    try:
-                        self.compute_api.stop(context, db_instance)
-                    except Exception:
-                        LOG.exception(_("error during stop() in "
-                                        "sync_power_state."),
-                                      instance=db_instance)
-            elif vm_state == vm_states.STOPPED:
-                if vm_power_state not in (power_state.NOSTATE,
-                                          power_state.SHUTDOWN,
-                                          power_state.CRASHED):
-                    LOG.warn(_("Instance is not stopped. Calling "
-                               "the stop API."), instance=db_instance)
-                    try:
-                        # Note(maoy): this assumes that the stop API is
-                        # idempotent.
-                        self.compute_api.stop(context, db_instance)
-                    except Exception:
-                        LOG.exception(_("error during stop() in "
-                                        "sync_power_state."),
-                                      instance=db_instance)
-            elif vm_state in (vm_states.SOFT_DELETED,
-                              vm_states.DELETED):
-                if vm_power_state not in (power_state.NOSTATE,
-                                          power_state.SHUTDOWN):
-                    # Note(maoy): this should be taken care of periodically in
-                    # _cleanup_running_deleted_instances().
-                    LOG.warn(_("Instance is not (soft-)deleted."),
-                             instance=db_instance)
+                power_state_updates.setdefault(vm_power_state, []).append(
+                        u['uuid'])
+            vm_state_checks.append((db_instance, vm_state, vm_power_state))
+
+        # power_state is always updated from hypervisor to db, instances
+        # that got a task since they were read are left for the next round
+        for vm_power_state, instance_uuids in power_state_updates.iteritems():
+            self._instance_update_bulk(context, instance_uuids,
+                                       power_state=vm_power_state,
+                                       expected_task_state=None)
+
+        for db_instance, vm_state, vm_power_state in vm_state_checks:
+            self._sync_instance_vm_state(context, db_instance, vm_state,
+                                         vm_power_state)
+
+    def _sync_instance_vm_state(self, context, db_instance, vm_state,
+                                vm_power_state):
+        """Resolve the discrepancy between vm_state and vm_power_state."""
+        # Note(maoy): We go through all possible vm_states.
+        if vm_state in (vm_states.BUILDING,
+                        vm_states.RESCUED,
+                        vm_states.RESIZED,
+                        vm_states.SUSPENDED,
+                        vm_states.PAUSED,
+                        vm_states.ERROR):
+            # TODO(maoy): we ignore these vm_state for now.
+            pass
+        elif vm_state == vm_states.ACTIVE:
+            # The only rational power state should be RUNNING
+            if vm_power_state in (power_state.NOSTATE,
+                                   power_state.SHUTDOWN,
+                                   power_state.CRASHED):
+                LOG.warn(_("Instance shutdown by itself. Calling "
+                           "the stop API."), instance=db_instance)
+                try:
+                    # Note(maoy): here we call the API instead of
+                    # brutally updating the vm_state in the database
+                    # to allow all the hooks and checks to be performed.
+                    self.compute_api.stop(context, db_instance)
+                except Exception:
+                    # Note(maoy): there is no need to propagate the error
+                    # because the same power_state will be retrieved next
+                    # time and retried.
+                    # For example, there might be another task scheduled.
+                    LOG.exception(_("error during stop() in "
+                                    "sync_power_state."),
+                                  instance=db_instance)
+            elif vm_power_state in (power_state.PAUSED,
+                                    power_state.SUSPENDED):
+                LOG.warn(_("Instance is paused or suspended "
+                           "unexpectedly. Calling "
+                           "the stop API."), instance=db_instance)
+                try:
+                    self.compute_api.stop(context, db_instance)
+                except Exception:
+                    LOG.exception(_("error during stop() in "
+                                    "sync_power_state."),
+                                  instance=db_instance)
+        elif vm_state == vm_states.STOPPED:
+            if vm_power_state not in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN,
+                                      power_state.CRASHED):
+                LOG.warn(_("Instance is not stopped. Calling "
+                           "the stop API."), instance=db_instance)
+                try:
+                    # Note(maoy): this assumes that the stop API is
+                    # idempotent.
+                    self.compute_api.stop(context, db_instance)
+                except Exception:
+                    LOG.exception(_("error during stop() in "
+                                    "sync_power_state."),
+                                  instance=db_instance)
+        elif vm_state in (vm_states.SOFT_DELETED,
+                          vm_states.DELETED):
+            if vm_power_state not in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN):
+                # Note(maoy): this should be taken care of periodically in
+                # _cleanup_running_deleted_instances().
+                LOG.warn(_("Instance is not (soft-)deleted."),
+                         instance=db_instance)
 
     @manager.periodic_task
     def _reclaim_queued_deletes(self, context):
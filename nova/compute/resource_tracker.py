@@ -343,6 +343,22 @@ class ResourceTracker(object):
             self._update_usage_from_instance(self.compute_node, instance)
             self._update(context.elevated(), self.compute_node)
 
+    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    def update_usage_bulk(self, context, instances):
+        """Update the resource usage and stats after a change in several
+        instances, saving the compute node once
+        """
+        if self.disabled:
+            return
+
+        instances = [instance for instance in instances
+                     if instance['uuid'] in self.tracked_instances]
+        if not instances:
+            return
+        for instance in instances:
+            self._update_usage_from_instance(self.compute_node, instance)
+        self._update(context.elevated(), self.compute_node)
+
     @property
     def disabled(self):
         return self.compute_node is None
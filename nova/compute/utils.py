@@ -16,6 +16,7 @@
 
 """Compute-related Utilities and helpers."""
 
+import datetime
 import re
 import string
 import traceback
@@ -29,6 +30,7 @@ from nova.network import model as network_model
 from nova import notifications
 from nova.openstack.common import log
 from nova.openstack.common.notifier import api as notifier_api
+from nova.openstack.common import timeutils
 from nova import utils
 
 FLAGS = flags.FLAGS
@@ -220,3 +222,80 @@ def start_instance_usage_audit(context, begin, end, host, num_instances):
 def finish_instance_usage_audit(context, begin, end, host, errors, message):
     db.task_log_end_task(context, "instance_usage_audit", begin, end, host,
                          errors, message)
+
+
+def usage_hours(instance, period_start, period_stop):
+    """Return the hours an instance was running during a period."""
+    launched_at = instance['launched_at']
+    terminated_at = instance['terminated_at']
+    if terminated_at is not None:
+        if not isinstance(terminated_at, datetime.datetime):
+            terminated_at = timeutils.parse_strtime(terminated_at,
+                                                    "%Y-%m-%d %H:%M:%S.%f")
+
+    if launched_at is not None:
+        if not isinstance(launched_at, datetime.datetime):
+            launched_at = timeutils.parse_strtime(launched_at,
+                                                  "%Y-%m-%d %H:%M:%S.%f")
+
+    if terminated_at and terminated_at < period_start:
+        return 0
+    # nothing if it started after the usage report ended
+    if launched_at and launched_at > period_stop:
+        return 0
+    if launched_at:
+        # if instance launched after period_started, don't charge for first
+        start = max(launched_at, period_start)
+        if terminated_at:
+            # if instance stopped before period_stop, don't charge after
+            stop = min(period_stop, terminated_at)
+        else:
+            # instance is still running, so charge them up to current time
+            stop = period_stop
+        dt = stop - start
+        seconds = (dt.days * 3600 * 24 + dt.seconds +
+                   dt.microseconds / 1000000.0)
+
+        return seconds / 3600.0
+    else:
+        # instance hasn't launched, so no charge
+        return 0
+
+
+def roll_up_tenant_usage(context, period_beginning, period_ending):
+    """Store the usage of every tenant over a completed period.
+
+    Returns None if the period has already been rolled up.
+    """
+    instances = db.instance_get_active_by_window(context, period_beginning,
+                                                 period_ending)
+    flavors = {}
+    usages = {}
+    for instance in instances:
+        flavor_type = instance['instance_type_id']
+        if flavor_type not in flavors:
+            try:
+                flavors[flavor_type] = instance_types.get_instance_type(
+                        flavor_type, ctxt=context)
+            except exception.InstanceTypeNotFound:
+                # can't bill if there is no instance type
+                flavors[flavor_type] = None
+        flavor = flavors[flavor_type]
+        if flavor is None:
+            continue
+
+        hours = usage_hours(instance, period_beginning, period_ending)
+        usage = usages.get(instance['project_id'])
+        if usage is None:
+            usage = usages[instance['project_id']] = dict(
+                    instances=0, total_hours=0, total_local_gb_usage=0,
+                    total_vcpus_usage=0, total_memory_mb_usage=0)
+        usage['instances'] += 1
+        usage['total_hours'] += hours
+        usage['total_local_gb_usage'] += ((flavor['root_gb'] +
+                                           flavor['ephemeral_gb']) * hours)
+        usage['total_vcpus_usage'] += flavor['vcpus'] * hours
+        usage['total_memory_mb_usage'] += flavor['memory_mb'] * hours
+
+    return db.tenant_usage_rollup_create_safe(context, period_beginning,
+                                              period_ending, usages)
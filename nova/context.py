@@ -89,6 +89,10 @@ class RequestContext(object):
         self.user_name = user_name
         self.project_name = project_name
 
+        # NOTE: set by the API for the duration of a request, see
+        # RequestCache.  Contexts returned by elevated() share it.
+        self.request_cache = None
+
         if overwrite or not hasattr(local.store, 'context'):
             self.update_store()
 
@@ -144,6 +148,64 @@ class RequestContext(object):
         return context
 
 
+class RequestCache(object):
+    """Memoize the lookups done while processing one request.
+
+    Values are stored per kind (like 'image' or 'instance_type') and key.
+    Dicts are handed out as copies, so callers modifying what they get do
+    not change what later lookups return.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._values = {}
+
+    def get(self, kind, key, lookup, *args, **kwargs):
+        """Return the value for key, calling lookup only the first time.
+
+        Exceptions raised by lookup are not cached.
+        """
+        values = self._values.setdefault(kind, {})
+        try:
+            value = values[key]
+            self.hits += 1
+        except KeyError:
+            value = values[key] = lookup(*args, **kwargs)
+            self.misses += 1
+        if isinstance(value, dict):
+            value = copy.deepcopy(value)
+        return value
+
+    def invalidate(self, kind, key=None):
+        """Forget the value for key, or every value of kind."""
+        if key is None:
+            self._values.pop(kind, None)
+        else:
+            self._values.get(kind, {}).pop(key, None)
+
+
+def cached_lookup(context, kind, key, lookup, *args, **kwargs):
+    """Call lookup(*args, **kwargs) through the request cache of context.
+
+    The cached value is only reused by contexts with the same admin flag
+    and read_deleted setting, as those change what lookups return.  Without
+    a request cache lookup is always called.
+    """
+    cache = getattr(context, 'request_cache', None)
+    if cache is None:
+        return lookup(*args, **kwargs)
+    key = (key, context.is_admin, context.read_deleted)
+    return cache.get(kind, key, lookup, *args, **kwargs)
+
+
+def invalidate_cached(context, kind):
+    """Forget the values of kind cached by cached_lookup(), if any."""
+    cache = getattr(context, 'request_cache', None)
+    if cache is not None:
+        cache.invalidate(kind)
+
+
 def get_admin_context(read_deleted="no"):
     return RequestContext(user_id=None,
                           project_id=None,
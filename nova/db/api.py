@@ -38,6 +38,10 @@ these objects be simple dictionaries.
 :sql_connection:  string specifying the sqlalchemy connection to use, like:
                   `sqlite:///var/lib/nova/nova.sqlite`.
 
+:slave_connection:  string specifying the sqlalchemy connection of a read-only
+                    replica.  Functions taking a use_slave argument read from
+                    it when called with use_slave=True.
+
 :enable_new_services:  when adding a new service to the database, is it in the
                        pool of available hardware (Default: True)
 
@@ -193,9 +197,16 @@ def compute_node_get(context, compute_id):
     return IMPL.compute_node_get(context, compute_id)
 
 
-def compute_node_get_all(context):
-    """Get all computeNodes."""
-    return IMPL.compute_node_get_all(context)
+def compute_node_get_all(context, updated_since=None, use_slave=False):
+    """Get all computeNodes.
+
+    If updated_since is given, only return computeNodes (including
+    deleted ones) whose record changed, or whose service was deleted,
+    at or after that time.  Service heartbeats are not taken into
+    account.
+    """
+    return IMPL.compute_node_get_all(context, updated_since=updated_since,
+                                     use_slave=use_slave)
 
 
 def compute_node_search_by_hypervisor(context, hypervisor_match):
@@ -216,6 +227,19 @@ def compute_node_update(context, compute_id, values, prune_stats=False):
     return IMPL.compute_node_update(context, compute_id, values, prune_stats)
 
 
+def compute_node_claim_resources(context, compute_id, expected, memory_mb,
+                                 disk_gb, vcpus):
+    """Atomically consume resources from a computeNode.
+
+    The claim only succeeds if the free_ram_mb, free_disk_gb and
+    vcpus_used of the computeNode still match the expected dict.
+
+    :returns: True if the resources were claimed, False on conflict.
+    """
+    return IMPL.compute_node_claim_resources(context, compute_id, expected,
+                                             memory_mb, disk_gb, vcpus)
+
+
 def compute_node_get_by_host(context, host):
     return IMPL.compute_node_get_by_host(context, host)
 
@@ -492,6 +516,16 @@ def fixed_ips_by_virtual_interface(context, vif_id):
     return IMPL.fixed_ips_by_virtual_interface(context, vif_id)
 
 
+def fixed_ip_get_by_ip_filter(context, fixed_ip=None, ip=None):
+    """Get the fixed ips of instances which may match an ip filter.
+
+    Returns dicts of the instance_uuid, address and floating_ips addresses
+    of each fixed ip whose address is fixed_ip, or whose address or one of
+    whose floating ip addresses may match the ip regular expression.
+    """
+    return IMPL.fixed_ip_get_by_ip_filter(context, fixed_ip=fixed_ip, ip=ip)
+
+
 def fixed_ip_get_network(context, address):
     """Get a network for a fixed ip by address."""
     return IMPL.fixed_ip_get_network(context, address)
@@ -587,11 +621,14 @@ def instance_get_all(context, columns_to_join=None):
 
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
-                                sort_dir='desc', limit=None, marker=None):
+                                sort_dir='desc', limit=None, marker=None,
+                                columns_to_join=None, use_slave=False):
     """Get all instances that match all filters."""
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
                                             sort_dir, limit=limit,
-                                            marker=marker)
+                                            marker=marker,
+                                            columns_to_join=columns_to_join,
+                                            use_slave=use_slave)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None,
@@ -681,6 +718,19 @@ def instance_update_and_get_original(context, instance_uuid, values):
                                                  values)
 
 
+def instance_update_bulk(context, instance_uuids, values):
+    """Set the same properties on many instances in a single update.
+
+    If "expected_task_state" or "expected_vm_state" exist in values, only
+    the instances in one of the expected states are updated, the others
+    are skipped.
+
+    :returns: a list of (old_instance_ref, new_instance_ref) tuples for
+              the instances that were updated.
+    """
+    return IMPL.instance_update_bulk(context, instance_uuids, values)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
     return IMPL.instance_add_security_group(context, instance_id,
@@ -830,9 +880,14 @@ def network_get_all_by_uuids(context, network_uuids,
 # pylint: disable=C0103
 
 
-def network_get_associated_fixed_ips(context, network_id, host=None):
-    """Get all network's ips that have been associated."""
-    return IMPL.network_get_associated_fixed_ips(context, network_id, host)
+def network_get_associated_fixed_ips(context, network_id, host=None,
+                                     address=None):
+    """Get all network's ips that have been associated.
+
+    With address, only that ip is returned, if it has been associated.
+    """
+    return IMPL.network_get_associated_fixed_ips(context, network_id, host,
+                                                 address)
 
 
 def network_get_by_bridge(context, bridge):
@@ -984,9 +1039,10 @@ def quota_usage_get(context, project_id, resource):
     return IMPL.quota_usage_get(context, project_id, resource)
 
 
-def quota_usage_get_all_by_project(context, project_id):
+def quota_usage_get_all_by_project(context, project_id, use_slave=False):
     """Retrieve all usage associated with a given resource."""
-    return IMPL.quota_usage_get_all_by_project(context, project_id)
+    return IMPL.quota_usage_get_all_by_project(context, project_id,
+                                               use_slave=use_slave)
 
 
 def quota_usage_update(context, project_id, resource, in_use, reserved,
@@ -1036,6 +1092,17 @@ def quota_reserve(context, resources, quotas, deltas, expire,
                               until_refresh, max_age)
 
 
+def quota_reserve_delta(context, resources, quotas, deltas, expire,
+                        until_refresh, max_age):
+    """Check quotas and create reservations by guarded usage updates.
+
+    Falls back to quota_reserve() when a usage needs to be refreshed or
+    a delta is over quota.
+    """
+    return IMPL.quota_reserve_delta(context, resources, quotas, deltas,
+                                    expire, until_refresh, max_age)
+
+
 def reservation_commit(context, reservations):
     """Commit quota reservations."""
     return IMPL.reservation_commit(context, reservations)
@@ -1432,10 +1499,11 @@ def instance_type_create(context, values):
     return IMPL.instance_type_create(context, values)
 
 
-def instance_type_get_all(context, inactive=False, filters=None):
+def instance_type_get_all(context, inactive=False, filters=None,
+                          use_slave=False):
     """Get all instance types."""
     return IMPL.instance_type_get_all(
-        context, inactive=inactive, filters=filters)
+        context, inactive=inactive, filters=filters, use_slave=use_slave)
 
 
 def instance_type_get(context, id):
@@ -1920,3 +1988,41 @@ def task_log_get(context, task_name, period_beginning,
                  period_ending, host, state=None, session=None):
     return IMPL.task_log_get(context, task_name, period_beginning,
                  period_ending, host, state, session)
+
+
+####################
+
+
+def tenant_usage_rollup_create_safe(context, period_beginning, period_ending,
+                                    usages):
+    """Store the usages of the tenants over a completed period.
+
+    :param usages: dict of project ids to dicts of instances, total_hours,
+                   total_local_gb_usage, total_vcpus_usage and
+                   total_memory_mb_usage
+
+    Returns None if the period has already been rolled up.
+    """
+    return IMPL.tenant_usage_rollup_create_safe(context, period_beginning,
+                                                period_ending, usages)
+
+
+def tenant_usage_rollup_get_periods(context, begin, end):
+    """Get the (beginning, ending) of the periods rolled up in a window."""
+    return IMPL.tenant_usage_rollup_get_periods(context, begin, end)
+
+
+def tenant_usage_rollup_get_totals(context, begin, end, project_id=None):
+    """Get the usages of the tenants summed over the periods in a window."""
+    return IMPL.tenant_usage_rollup_get_totals(context, begin, end,
+                                               project_id=project_id)
+
+
+def tenant_usage_get_totals_by_window(context, begin, end, project_id=None):
+    """Get the usages of the tenants over a window, from the instances.
+
+    The usages are summed in the database rather than from each
+    instance, so that they are cheap to get for any window.
+    """
+    return IMPL.tenant_usage_get_totals_by_window(context, begin, end,
+                                                  project_id=project_id)
@@ -0,0 +1,247 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Counters of the SQL statements issued through the DB API.
+
+Statements are counted per scope, an API request or a periodic task run,
+and broken down by the nova.db.api function issuing them.  Statements run
+outside of nova.db.api, like lazy loads of relationships, are attributed
+to the nova function triggering them, which makes N+1 patterns stand out.
+
+The counters of each scope are logged when it ends and added to totals for
+the whole process, which are returned by get_stats().
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+from eventlet import corolocal
+
+from nova import flags
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+
+
+query_stats_opts = [
+    cfg.BoolOpt('sql_query_stats',
+                default=False,
+                help='Count the SQL statements, rows and time spent by each '
+                     'API request and periodic task'),
+    cfg.IntOpt('sql_query_stats_warn_statements',
+               default=100,
+               help='Log a warning when an API request or periodic task '
+                    'issues at least this many SQL statements, 0 disables'),
+    cfg.FloatOpt('sql_slow_query_time',
+                 default=0.0,
+                 help='Log SQL statements running for at least this many '
+                      'seconds, 0 disables'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(query_stats_opts)
+
+LOG = logging.getLogger(__name__)
+
+UNSCOPED = 'unscoped'
+
+_NOVA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_DB_API_FILE = os.path.join(_NOVA_DIR, 'db', 'api.py')
+_SKIP_PATHS = (os.path.join(_NOVA_DIR, 'db', 'query_stats.py'),
+               os.path.join(_NOVA_DIR, 'db', 'sqlalchemy'),
+               os.path.join(_NOVA_DIR, 'openstack'))
+
+_local = corolocal.local()
+_totals = {}
+
+
+class ScopeStats(object):
+    """Counters of the SQL statements issued within a scope."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.statements = 0
+        self.rows = 0
+        self.time = 0.0
+        self.functions = {}
+
+    def add(self, function, rows, elapsed):
+        self.statements += 1
+        self.rows += rows
+        self.time += elapsed
+        counters = self.functions.setdefault(function, [0, 0, 0.0])
+        counters[0] += 1
+        counters[1] += rows
+        counters[2] += elapsed
+
+    def merge(self, other):
+        self.count += 1
+        self.statements += other.statements
+        self.rows += other.rows
+        self.time += other.time
+        for function, (statements, rows, elapsed) in (
+                other.functions.iteritems()):
+            counters = self.functions.setdefault(function, [0, 0, 0.0])
+            counters[0] += statements
+            counters[1] += rows
+            counters[2] += elapsed
+
+    def to_dict(self):
+        functions = [dict(function=function, statements=statements,
+                          rows=rows, time=elapsed)
+                     for function, (statements, rows, elapsed) in
+                     self.functions.iteritems()]
+        functions.sort(key=lambda f: (-f['statements'], f['function']))
+        return dict(name=self.name, count=self.count,
+                    statements=self.statements, rows=self.rows,
+                    time=self.time, functions=functions)
+
+
+def _caller_function():
+    """Return the name of the function issuing the current statement.
+
+    This is the nova.db.api function on the stack or, for
+    statements run outside of the DB API, the innermost nova function.
+    """
+    frame = sys._getframe(1)
+    caller = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename == _DB_API_FILE:
+            return frame.f_code.co_name
+        if (caller is None and filename.startswith(_NOVA_DIR) and
+                not filename.startswith(_SKIP_PATHS)):
+            caller = '%s.%s' % (frame.f_globals.get('__name__'),
+                                frame.f_code.co_name)
+        frame = frame.f_back
+    return caller or 'unknown'
+
+
+def _add_totals(stats):
+    totals = _totals.get(stats.name)
+    if totals is None:
+        totals = _totals[stats.name] = ScopeStats(stats.name)
+    totals.merge(stats)
+
+
+@contextlib.contextmanager
+def scope(name):
+    """Count the statements issued by the block under name.
+
+    The scope ends with the block, unless it was detached within it.
+    """
+    if not FLAGS.sql_query_stats or getattr(_local, 'stats', None):
+        yield
+        return
+
+    stats = _local.stats = ScopeStats(name)
+    try:
+        yield
+    finally:
+        if getattr(_local, 'stats', None) is stats:
+            del _local.stats
+            finish(stats)
+
+
+def detach():
+    """Keep the current scope open after the end of its block.
+
+    Returns the scope, to be resumed by the code issuing its remaining
+    statements and then finished, or None when not in a scope.
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        del _local.stats
+    return stats
+
+
+@contextlib.contextmanager
+def resume(stats):
+    """Count the statements issued by the block in a detached scope."""
+    if stats is None or getattr(_local, 'stats', None):
+        yield
+        return
+
+    _local.stats = stats
+    try:
+        yield
+    finally:
+        del _local.stats
+
+
+def finish(stats):
+    """End a scope, logging its counters and adding them to the totals."""
+    _add_totals(stats)
+    if stats.statements:
+        msg = _("%(name)s issued %(statements)d SQL statements "
+                "returning %(rows)d rows in %(time).3f secs")
+        if (FLAGS.sql_query_stats_warn_statements and
+                stats.statements >= FLAGS.sql_query_stats_warn_statements):
+            LOG.warn(msg, stats.__dict__)
+        else:
+            LOG.debug(msg, stats.__dict__)
+
+
+def record(statement, rows, elapsed):
+    """Count a statement which returned rows in elapsed seconds."""
+    if not (FLAGS.sql_query_stats or FLAGS.sql_slow_query_time):
+        return
+
+    function = _caller_function()
+
+    if (FLAGS.sql_slow_query_time and
+            elapsed >= FLAGS.sql_slow_query_time):
+        LOG.warn(_("Slow SQL statement in %(function)s took %(elapsed).3f "
+                   "secs: %(statement)s"), locals())
+
+    if FLAGS.sql_query_stats:
+        stats = getattr(_local, 'stats', None)
+        if stats is not None:
+            stats.add(function, rows, elapsed)
+        else:
+            stats = ScopeStats(UNSCOPED)
+            stats.add(function, rows, elapsed)
+            _add_totals(stats)
+
+
+def get_stats():
+    """Return the totals of every scope seen by this process."""
+    return [_totals[name].to_dict() for name in sorted(_totals)]
+
+
+def reset_stats():
+    """Clear the totals of this process."""
+    _totals.clear()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_stats_start', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.time() - conn.info['query_stats_start'].pop()
+    # Drivers like sqlite3 do not report the rows returned by a SELECT.
+    rows = max(cursor.rowcount, 0)
+    record(statement, rows, elapsed)
+
+
+def dbapi_error(conn, cursor, statement, parameters, context, exception):
+    # The statement failed, so after_cursor_execute() won't be called.
+    conn.info['query_stats_start'].pop()
@@ -38,10 +38,11 @@ from nova.openstack.common import timeutils
 from nova import utils
 from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import not_
 from sqlalchemy import or_
+from sqlalchemy.orm import attributes
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
-from sqlalchemy.sql.expression import asc
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import literal_column
 from sqlalchemy.sql import func
@@ -195,8 +196,11 @@ def model_query(context, model, *args, **kwargs):
     :param project_only: if present and context is user-type, then restrict
             query to match the context's project_id. If set to 'allow_none',
             restriction includes project_id = None.
+    :param use_slave: if present and no session is given, read from the
+            slave_connection replica when one is configured.
     """
-    session = kwargs.get('session') or get_session()
+    session = kwargs.get('session') or get_session(
+            slave_session=kwargs.get('use_slave', False))
     read_deleted = kwargs.get('read_deleted') or context.read_deleted
     project_only = kwargs.get('project_only', False)
 
@@ -500,10 +504,26 @@ def compute_node_get(context, compute_id, session=None):
 
 
 @require_admin_context
-def compute_node_get_all(context, session=None):
-    return model_query(context, models.ComputeNode, session=session).\
+def compute_node_get_all(context, session=None, updated_since=None,
+                         use_slave=False):
+    if updated_since is None:
+        return model_query(context, models.ComputeNode, session=session,
+                           use_slave=use_slave).\
+                options(joinedload('service')).\
+                options(joinedload('stats')).\
+                all()
+
+    # NOTE: deleted nodes are returned too, so callers keeping a cache
+    # of compute nodes can notice removals.
+    return model_query(context, models.ComputeNode, session=session,
+                       read_deleted="yes", use_slave=use_slave).\
+            join(models.ComputeNode.service).\
             options(joinedload('service')).\
             options(joinedload('stats')).\
+            filter(or_(models.ComputeNode.created_at >= updated_since,
+                       models.ComputeNode.updated_at >= updated_since,
+                       models.ComputeNode.deleted_at >= updated_since,
+                       models.Service.deleted_at >= updated_since)).\
             all()
 
 
@@ -583,6 +603,9 @@ def _update_stats(context, new_stats, compute_id, session, prune_stats=False):
 def compute_node_update(context, compute_id, values, prune_stats=False):
     """Updates the ComputeNode record with the most recent data"""
     stats = values.pop('stats', {})
+    # Always bump updated_at, even if only the stats changed, so that
+    # consumers polling for changed nodes notice the update.
+    values['updated_at'] = timeutils.utcnow()
 
     session = get_session()
     with session.begin(subtransactions=True):
@@ -592,6 +615,29 @@ def compute_node_update(context, compute_id, values, prune_stats=False):
     return compute_ref
 
 
+@require_admin_context
+def compute_node_claim_resources(context, compute_id, expected, memory_mb,
+                                 disk_gb, vcpus):
+    node = models.ComputeNode
+    session = get_session()
+    with session.begin():
+        count = model_query(context, node, session=session).\
+                filter_by(id=compute_id).\
+                filter_by(free_ram_mb=expected['free_ram_mb']).\
+                filter_by(free_disk_gb=expected['free_disk_gb']).\
+                filter_by(vcpus_used=expected['vcpus_used']).\
+                update({'free_ram_mb': node.free_ram_mb - memory_mb,
+                        'memory_mb_used': node.memory_mb_used + memory_mb,
+                        'free_disk_gb': node.free_disk_gb - disk_gb,
+                        'local_gb_used': node.local_gb_used + disk_gb,
+                        'disk_available_least':
+                                node.disk_available_least - disk_gb,
+                        'vcpus_used': node.vcpus_used + vcpus,
+                        'updated_at': timeutils.utcnow()},
+                       synchronize_session=False)
+    return count == 1
+
+
 def compute_node_get_by_host(context, host):
     """Get all capacity entries for the given host."""
     session = get_session()
@@ -1248,6 +1294,67 @@ def fixed_ips_by_virtual_interface(context, vif_id):
     return result
 
 
+@require_context
+def fixed_ip_get_by_ip_filter(context, fixed_ip=None, ip=None):
+    """Return the fixed ips of instances which may match the filters.
+
+    A fixed ip is returned when its address is fixed_ip, or when its
+    address or one of its floating ip addresses starts with the literal
+    prefix of the ip regular expression, so that the lookup can use the
+    address indexes.  The regular expression itself is not applied.
+    """
+    if fixed_ip is None and ip is None:
+        return []
+
+    session = get_session()
+    floating_join = and_(models.FloatingIp.fixed_ip_id == models.FixedIp.id,
+                         models.FloatingIp.deleted == False)
+
+    def _query():
+        return session.query(models.FixedIp.id,
+                             models.FixedIp.instance_uuid,
+                             models.FixedIp.address,
+                             models.FloatingIp.address).\
+                       outerjoin((models.FloatingIp, floating_join)).\
+                       filter(models.FixedIp.deleted == False).\
+                       filter(models.FixedIp.instance_uuid != None).\
+                       filter(models.FixedIp.virtual_interface_id != None)
+
+    prefix = None
+    if ip is not None:
+        prefix = _regex_to_like_prefix(ip)
+
+    if ip is not None and prefix is None:
+        rows = _query().all()
+    else:
+        # NOTE: The matches on the fixed and on the floating addresses are
+        #       separate queries, an OR across the two tables would keep
+        #       the database from using either address index.
+        address_filters = []
+        if fixed_ip is not None:
+            address_filters.append(models.FixedIp.address == fixed_ip)
+        if prefix is not None:
+            address_filters.append(models.FixedIp.address.like(prefix,
+                                                               escape='\\'))
+        rows = _query().filter(or_(*address_filters)).all()
+        if prefix is not None:
+            rows += _query().\
+                    filter(models.FloatingIp.address.like(prefix,
+                                                          escape='\\')).\
+                    all()
+
+    fixed_ips = {}
+    for fixed_ip_id, instance_uuid, address, floating_address in rows:
+        result = fixed_ips.setdefault(fixed_ip_id,
+                                      {'instance_uuid': instance_uuid,
+                                       'address': address,
+                                       'floating_ips': []})
+        if (floating_address is not None and
+                floating_address not in result['floating_ips']):
+            result['floating_ips'].append(floating_address)
+    return [fixed_ips[fixed_ip_id] for fixed_ip_id in sorted(fixed_ips)]
+
+
 @require_admin_context
 def fixed_ip_get_network(context, address):
     fixed_ip_ref = fixed_ip_get_by_address(context, address)
@@ -1538,20 +1645,27 @@ def instance_get_all(context, columns_to_join=None):
 
 @require_context
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
-                                limit=None, marker=None):
+                                limit=None, marker=None,
+                                columns_to_join=None, use_slave=False):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise.
 
-    sort_fn = {'desc': desc, 'asc': asc}
+    Instances are paged by the sort key followed by (created_at, id), the
+    rows after the marker instance are selected with a range condition on
+    those columns instead of an offset.  columns_to_join lists the
+    relationships to load along with the instances, it defaults to
+    info_cache, security_groups, metadata and instance_type and can be
+    shortened by callers that do not use them."""
 
-    session = get_session()
-    query_prefix = session.query(models.Instance).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
-            order_by(sort_fn[sort_dir](getattr(models.Instance, sort_key)))
+    if columns_to_join is None:
+        columns_to_join = ['info_cache', 'security_groups',
+                           'metadata', 'instance_type']
+
+    session = get_session(slave_session=use_slave)
+    query_prefix = session.query(models.Instance)
+    for column in columns_to_join:
+        query_prefix = query_prefix.options(joinedload(column))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1594,25 +1708,139 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     query_prefix = regex_filter(query_prefix, models.Instance, filters)
 
     # paginate query
+    sort_keys = [sort_key]
+    for key in ('created_at', 'id'):
+        if key != sort_key:
+            sort_keys.append(key)
     if marker is not None:
-        try:
-            marker = instance_get_by_uuid(context, marker, session=session)
-        except exception.InstanceNotFound as e:
-            raise exception.MarkerNotFound(marker)
+        marker = _instance_get_marker(context, marker, sort_keys,
+                                      session=session)
     query_prefix = paginate_query(query_prefix, models.Instance, limit,
-                           [sort_key, 'created_at', 'id'],
-                           marker=marker,
-                           sort_dir=sort_dir)
+                                  sort_keys,
+                                  marker=marker,
+                                  sort_dir=sort_dir)
 
     instances = query_prefix.all()
     return instances
 
 
+def _instance_get_marker(context, marker, sort_keys, session=None):
+    """Return the sort key values of the marker instance.
+
+    Only the columns paged on are loaded, the marker does not need the
+    joins of a full instance.
+    """
+    try:
+        columns = [getattr(models.Instance, key) for key in sort_keys]
+    except AttributeError:
+        raise exception.InvalidSortKey()
+    result = model_query(context, models.Instance, session=session,
+                         project_only=True).\
+                filter_by(uuid=marker).\
+                with_entities(*columns).\
+                first()
+
+    if not result:
+        raise exception.MarkerNotFound(marker)
+
+    return result
+
+
+# Regular expression characters that a literal match can not contain
+_REGEX_SPECIAL_CHARS = '.^$*+?{}[]|()'
+
+
+def _regex_to_literal(pattern):
+    """Return the literal that an anchored regular expression matches.
+
+    Returns (literal, exact) when pattern is '^literal$', matching exactly
+    literal, or '^literal', matching the strings starting with literal.
+    Returns None for any other pattern.
+    """
+    if not pattern.startswith('^'):
+        return None
+    pattern = pattern[1:]
+    exact = pattern.endswith('$') and not pattern.endswith('\\$')
+    if exact:
+        pattern = pattern[:-1]
+
+    literal = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            # \d, \w and friends are character classes, not literals
+            if char.isalnum():
+                return None
+            literal.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in _REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            literal.append(char)
+    if escaped:
+        return None
+    return ''.join(literal), exact
+
+
+def _like_escape(literal):
+    """Escape the LIKE wildcards in literal, for use with escape='\\'."""
+    return literal.replace('\\', '\\\\').replace('%', '\\%').\
+            replace('_', '\\_')
+
+
+def _regex_to_like_prefix(pattern):
+    """Return a LIKE pattern matching a superset of what pattern matches.
+
+    pattern is matched at the start of the string like re.match does.
+    Its leading literal characters, with '.' as the single character
+    wildcard, become the prefix of the LIKE pattern.  Returns None when
+    pattern has no such prefix, or has alternatives, so that every string
+    may match.
+    """
+    if '|' in pattern:
+        return None
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                break
+            i += 1
+            atom = _like_escape(pattern[i])
+        elif char == '.':
+            atom = '_'
+        elif char in _REGEX_SPECIAL_CHARS:
+            break
+        else:
+            atom = _like_escape(char)
+        i += 1
+        # A quantified character may be repeated or left out
+        if i < len(pattern) and pattern[i] in '*+?{':
+            break
+        prefix.append(atom)
+
+    if not prefix:
+        return None
+    return ''.join(prefix) + '%'
+
+
 def regex_filter(query, model, filters):
     """Applies regular expression filtering to a query.
 
     Returns the updated query.
 
+    Anchored expressions without any special characters, like '^name$'
+    or '^name', are also applied as an equality or a LIKE prefix match so
+    that the database can use an index on the column.  The regular
+    expression is still applied to the rows matched, as equality and
+    LIKE ignore case with the default collations of MySQL and SQLite.
+
     :param query: query to apply filters to
     :param model: model object the query applies to
     :param filters: dictionary of filters with regex values
@@ -1633,8 +1861,16 @@ def regex_filter(query, model, filters):
             continue
         if 'property' == type(column_attr).__name__:
             continue
-        query = query.filter(column_attr.op(db_regexp_op)(
-                                    str(filters[filter_name])))
+        value = str(filters[filter_name])
+        match = _regex_to_literal(value)
+        if match is not None:
+            literal, exact = match
+            if exact:
+                query = query.filter(column_attr == literal)
+            else:
+                query = query.filter(column_attr.like(
+                        _like_escape(literal) + '%', escape='\\'))
+        query = query.filter(column_attr.op(db_regexp_op)(value))
     return query
 
 
@@ -1857,6 +2093,81 @@ def _instance_update(context, instance_uuid, values, copy_old_instance=False):
     return (old_instance_ref, instance_ref)
 
 
+def _state_filter(column, states):
+    """Return a criterion matching rows where column is one of states."""
+    if not isinstance(states, (tuple, list, set)):
+        states = (states,)
+    criteria = []
+    values = [state for state in states if state is not None]
+    if values:
+        criteria.append(column.in_(values))
+    if None in states:
+        criteria.append(column == None)
+    return or_(*criteria)
+
+
+@require_context
+def instance_update_bulk(context, instance_uuids, values):
+    """Set the given properties on many instances with one UPDATE.
+
+    If "expected_task_state" or "expected_vm_state" exist in values, only
+    the instances whose state matches are updated.  Instances that moved
+    on to another state, or were deleted, are skipped rather than raising
+    UnexpectedTaskStateError or NotFound.
+
+    Only instance columns can be set, not metadata or system_metadata.
+
+    :returns: a list of (old_instance_ref, new_instance_ref) tuples for
+              the instances that were updated.
+    """
+    if not instance_uuids:
+        return []
+
+    values = values.copy()
+    expected = {}
+    for key in ('task_state', 'vm_state'):
+        if 'expected_%s' % key in values:
+            # they are not db columns so always pop out
+            expected[key] = values.pop('expected_%s' % key)
+    values['updated_at'] = timeutils.utcnow()
+
+    session = get_session()
+    with session.begin():
+        # Lock the matching rows first, so they keep the expected states
+        # until they are updated.
+        query = model_query(context, models.Instance, session=session,
+                            project_only=True).\
+                    filter(models.Instance.uuid.in_(instance_uuids))
+        for key, states in expected.iteritems():
+            query = query.filter(_state_filter(getattr(models.Instance, key),
+                                               states))
+        instance_ids = [row.id for row in query.
+                        with_entities(models.Instance.id).
+                        with_lockmode('update').
+                        all()]
+        if not instance_ids:
+            return []
+
+        instance_refs = _build_instance_get(context, session=session).\
+                            filter(models.Instance.id.in_(instance_ids)).\
+                            all()
+
+        session.query(models.Instance).\
+                filter(models.Instance.id.in_(instance_ids)).\
+                update(values, synchronize_session=False)
+
+        results = []
+        for instance_ref in instance_refs:
+            old_instance_ref = copy.copy(instance_ref)
+            # The rows are already updated, only refresh the loaded
+            # objects without marking them dirty.
+            for key, value in values.iteritems():
+                attributes.set_committed_value(instance_ref, key, value)
+            results.append((old_instance_ref, instance_ref))
+
+    return results
+
+
 def instance_add_security_group(context, instance_uuid, security_group_id):
     """Associate the given security group with the given instance"""
     session = get_session()
@@ -2193,7 +2504,8 @@ def network_get_all_by_uuids(context, network_uuids,
 
 
 @require_admin_context
-def network_get_associated_fixed_ips(context, network_id, host=None):
+def network_get_associated_fixed_ips(context, network_id, host=None,
+                                     address=None):
     # FIXME(sirp): since this returns fixed_ips, this would be better named
     # fixed_ip_get_all_by_network.
     # NOTE(vish): The ugly joins here are to solve a performance issue and
@@ -2222,6 +2534,8 @@ def network_get_associated_fixed_ips(context, network_id, host=None):
                           filter(models.FixedIp.virtual_interface_id != None)
     if host:
         query = query.filter(models.Instance.host == host)
+    if address:
+        query = query.filter(models.FixedIp.address == address)
     result = query.all()
     data = []
     for datum in result:
@@ -2523,10 +2837,11 @@ def quota_usage_get(context, project_id, resource, session=None):
 
 
 @require_context
-def quota_usage_get_all_by_project(context, project_id):
+def quota_usage_get_all_by_project(context, project_id, use_slave=False):
     authorize_project_context(context, project_id)
 
-    rows = model_query(context, models.QuotaUsage, read_deleted="no").\
+    rows = model_query(context, models.QuotaUsage, read_deleted="no",
+                       use_slave=use_slave).\
                    filter_by(project_id=project_id).\
                    all()
 
@@ -2785,51 +3100,166 @@ def quota_reserve(context, resources, quotas, deltas, expire,
     return reservations
 
 
+class _QuotaUsageDrift(Exception):
+    """A guarded quota usage update did not match its usage row."""
+    pass
+
+
+@require_context
+def quota_reserve_delta(context, resources, quotas, deltas, expire,
+                        until_refresh, max_age):
+    # NOTE: Unlike quota_reserve(), the usages of the project are neither
+    #       locked nor loaded.  Each delta is applied by a single UPDATE
+    #       which only matches the usage row if it stays within quota and
+    #       needs no refresh, so only the rows being changed are locked.
+    #       Anything else, from a missing usage to an over quota request,
+    #       falls back to quota_reserve() to refresh and report it.
+    elevated = context.elevated()
+    session = get_session()
+    try:
+        with session.begin():
+            rows = model_query(context, models.QuotaUsage, session=session,
+                               read_deleted="no").\
+                           filter_by(project_id=context.project_id).\
+                           filter(models.QuotaUsage.resource.in_(
+                                  deltas.keys())).\
+                           with_entities(models.QuotaUsage.resource,
+                                         models.QuotaUsage.id).\
+                           all()
+            usage_ids = dict(rows)
+            if len(usage_ids) != len(deltas):
+                raise _QuotaUsageDrift()
+
+            now = timeutils.utcnow()
+            # Update the usages in id order, as _get_quota_usages() locks
+            # them, to avoid deadlocks.
+            for resource in sorted(deltas, key=usage_ids.get):
+                delta = deltas[resource]
+                usage = models.QuotaUsage
+                values = {'until_refresh': usage.until_refresh - 1,
+                          'updated_at': now}
+                query = model_query(context, usage, session=session,
+                                    read_deleted="no").\
+                                filter_by(id=usage_ids[resource]).\
+                                filter(usage.in_use >= 0).\
+                                filter(or_(usage.until_refresh == None,
+                                           usage.until_refresh > 1))
+                if max_age:
+                    query = query.filter(usage.updated_at >= now -
+                            datetime.timedelta(seconds=max_age))
+                if delta < 0:
+                    query = query.filter(usage.in_use + delta >= 0)
+                else:
+                    if quotas[resource] >= 0:
+                        query = query.filter(usage.in_use + usage.reserved +
+                                             delta <= quotas[resource])
+                    values['reserved'] = usage.reserved + delta
+
+                if not query.update(values, synchronize_session=False):
+                    raise _QuotaUsageDrift()
+
+            reservations = []
+            for resource, delta in deltas.items():
+                reservation = reservation_create(elevated,
+                                                 str(utils.gen_uuid()),
+                                                 {'id': usage_ids[resource]},
+                                                 context.project_id,
+                                                 resource, delta, expire,
+                                                 session=session)
+                reservations.append(reservation.uuid)
+    except _QuotaUsageDrift:
+        return quota_reserve(context, resources, quotas, deltas, expire,
+                             until_refresh, max_age)
+
+    return reservations
+
+
+def _quota_usages_lock(context, session, usage_ids=None):
+    """Lock the quota usages of the project, or the given usages."""
+
+    query = model_query(context, models.QuotaUsage, read_deleted="no",
+                        session=session)
+    if usage_ids is None:
+        query = query.filter_by(project_id=context.project_id)
+    else:
+        query = query.filter(models.QuotaUsage.id.in_(usage_ids))
+    return query.with_entities(models.QuotaUsage.id).\
+                 order_by(models.QuotaUsage.id).\
+                 with_lockmode('update').\
+                 all()
+
+
 def _quota_reservations(session, context, reservations):
-    """Return the relevant reservations."""
+    """Return the id, usage_id and delta of the relevant reservations."""
 
     # Get the listed reservations
     return model_query(context, models.Reservation,
                        read_deleted="no",
                        session=session).\
                    filter(models.Reservation.uuid.in_(reservations)).\
+                   with_entities(models.Reservation.id,
+                                 models.Reservation.usage_id,
+                                 models.Reservation.delta).\
                    with_lockmode('update').\
                    all()
 
 
+def _quota_reservations_release(context, session, rows, commit):
+    """Delete reservations, releasing their deltas from the usages.
+
+    The reservations are given as (id, usage_id, delta) rows.  Committed
+    deltas are added to the usages in use, and any positive delta is
+    removed from the reserved amount.  The usages have to be locked.
+    """
+
+    if not rows:
+        return
+
+    reserved = collections.defaultdict(int)
+    in_use = collections.defaultdict(int)
+    for reservation_id, usage_id, delta in rows:
+        if delta >= 0:
+            reserved[usage_id] += delta
+        if commit:
+            in_use[usage_id] += delta
+
+    for usage_id in sorted(set(reserved) | set(in_use)):
+        values = {}
+        if reserved.get(usage_id):
+            values['reserved'] = (models.QuotaUsage.reserved -
+                                  reserved[usage_id])
+        if in_use.get(usage_id):
+            values['in_use'] = models.QuotaUsage.in_use + in_use[usage_id]
+        if values:
+            model_query(context, models.QuotaUsage, read_deleted="no",
+                        session=session).\
+                    filter_by(id=usage_id).\
+                    update(values, synchronize_session=False)
+
+    model_query(context, models.Reservation, read_deleted="no",
+                session=session).\
+            filter(models.Reservation.id.in_([row[0] for row in rows])).\
+            update({'deleted': True,
+                    'deleted_at': timeutils.utcnow()},
+                   synchronize_session=False)
+
+
 @require_context
 def reservation_commit(context, reservations):
     session = get_session()
     with session.begin():
-        usages = _get_quota_usages(context, session)
-
-        for reservation in _quota_reservations(session, context, reservations):
-            usage = usages[reservation.resource]
-            if reservation.delta >= 0:
-                usage.reserved -= reservation.delta
-            usage.in_use += reservation.delta
-
-            reservation.delete(session=session)
-
-        for usage in usages.values():
-            usage.save(session=session)
+        _quota_usages_lock(context, session)
+        rows = _quota_reservations(session, context, reservations)
+        _quota_reservations_release(context, session, rows, commit=True)
 
 
 @require_context
 def reservation_rollback(context, reservations):
     session = get_session()
     with session.begin():
-        usages = _get_quota_usages(context, session)
-
-        for reservation in _quota_reservations(session, context, reservations):
-            usage = usages[reservation.resource]
-            if reservation.delta >= 0:
-                usage.reserved -= reservation.delta
-
-            reservation.delete(session=session)
-
-        for usage in usages.values():
-            usage.save(session=session)
+        _quota_usages_lock(context, session)
+        rows = _quota_reservations(session, context, reservations)
+        _quota_reservations_release(context, session, rows, commit=False)
 
 
 @require_admin_context
@@ -2862,22 +3292,45 @@ def quota_destroy_all_by_project(context, project_id):
 
 
 @require_admin_context
-def reservation_expire(context):
-    session = get_session()
-    with session.begin():
-        current_time = timeutils.utcnow()
-        results = model_query(context, models.Reservation, session=session,
-                              read_deleted="no").\
-                          filter(models.Reservation.expire < current_time).\
-                          all()
+def reservation_expire(context, batch_size=1000):
+    current_time = timeutils.utcnow()
 
-        if results:
-            for reservation in results:
-                if reservation.delta >= 0:
-                    reservation.usage.reserved -= reservation.delta
-                    reservation.usage.save(session=session)
+    # NOTE: Expired reservations are taken in expire order from the
+    #       reservations_deleted_expire_idx index, a batch per
+    #       transaction, so the cost follows the number of expired
+    #       reservations rather than the size of the table.
+    while True:
+        session = get_session()
+        with session.begin():
+            query = model_query(context, models.Reservation,
+                                session=session, read_deleted="no").\
+                            filter(models.Reservation.expire < current_time)
+            rows = query.with_entities(models.Reservation.id,
+                                       models.Reservation.usage_id).\
+                         order_by(models.Reservation.expire).\
+                         limit(batch_size).\
+                         all()
+            if not rows:
+                return
+            found = len(rows)
+
+            # The usages are locked before the reservations, as in
+            # quota_reserve(), and the reservations are read again in
+            # case they were committed or rolled back meanwhile.
+            _quota_usages_lock(context, session,
+                               set(row[1] for row in rows))
+            rows = query.filter(models.Reservation.id.in_(
+                                [row[0] for row in rows])).\
+                         with_entities(models.Reservation.id,
+                                       models.Reservation.usage_id,
+                                       models.Reservation.delta).\
+                         with_lockmode('update').\
+                         all()
+            _quota_reservations_release(context, session, rows,
+                                        commit=False)
 
-                reservation.delete(session=session)
+        if found < batch_size:
+            return
 
 
 ###################
@@ -3916,14 +4369,16 @@ def _dict_with_extra_specs(inst_type_query):
     return inst_type_dict
 
 
-def _instance_type_get_query(context, session=None, read_deleted=None):
+def _instance_type_get_query(context, session=None, read_deleted=None,
+                             use_slave=False):
     return model_query(context, models.InstanceTypes, session=session,
-                       read_deleted=read_deleted).\
+                       read_deleted=read_deleted, use_slave=use_slave).\
                      options(joinedload('extra_specs'))
 
 
 @require_context
-def instance_type_get_all(context, inactive=False, filters=None):
+def instance_type_get_all(context, inactive=False, filters=None,
+                          use_slave=False):
     """
     Returns all instance types.
     """
@@ -3935,7 +4390,8 @@ def instance_type_get_all(context, inactive=False, filters=None):
     # database.
     read_deleted = "yes" if inactive else "no"
 
-    query = _instance_type_get_query(context, read_deleted=read_deleted)
+    query = _instance_type_get_query(context, read_deleted=read_deleted,
+                                     use_slave=use_slave)
 
     if 'min_memory_mb' in filters:
         query = query.filter(
@@ -5275,3 +5731,155 @@ def task_log_end_task(context, task_name,
         task.errors = errors
         task.save(session=session)
     return task
+
+
+###################
+
+
+_TENANT_USAGE_COUNTERS = ('total_hours', 'total_local_gb_usage',
+                          'total_vcpus_usage', 'total_memory_mb_usage')
+
+
+@require_admin_context
+def tenant_usage_rollup_create_safe(context, period_beginning, period_ending,
+                                    usages):
+    totals = dict((counter, 0) for counter in _TENANT_USAGE_COUNTERS)
+    totals['instances'] = 0
+    for usage in usages.values():
+        for counter in totals:
+            totals[counter] += usage[counter]
+
+    session = get_session()
+    try:
+        with session.begin():
+            rolled_up = model_query(context, models.TenantUsageRollup,
+                                    session=session).\
+                                filter_by(project_id='').\
+                                filter_by(period_beginning=period_beginning).\
+                                first()
+            if rolled_up:
+                return None
+
+            # The totals row goes first, so that a concurrent roll up of
+            # the same period fails on it.
+            for project_id, usage in [('', totals)] + usages.items():
+                rollup_ref = models.TenantUsageRollup()
+                rollup_ref.update(usage)
+                rollup_ref.project_id = project_id
+                rollup_ref.period_beginning = period_beginning
+                rollup_ref.period_ending = period_ending
+                session.add(rollup_ref)
+            session.flush()
+    except exception.DBError as e:
+        if not isinstance(e.inner_exception, IntegrityError):
+            raise
+        return None
+
+    return totals
+
+
+@require_admin_context
+def tenant_usage_rollup_get_periods(context, begin, end):
+    rollup = models.TenantUsageRollup
+    return model_query(context, rollup).\
+                    with_entities(rollup.period_beginning,
+                                  rollup.period_ending).\
+                    filter_by(project_id='').\
+                    filter(rollup.period_beginning >= begin).\
+                    filter(rollup.period_ending <= end).\
+                    order_by(rollup.period_beginning).\
+                    all()
+
+
+@require_admin_context
+def tenant_usage_rollup_get_totals(context, begin, end, project_id=None):
+    rollup = models.TenantUsageRollup
+    columns = [func.sum(getattr(rollup, counter))
+               for counter in _TENANT_USAGE_COUNTERS]
+    query = model_query(context, rollup).\
+                    with_entities(rollup.project_id, *columns).\
+                    filter(rollup.project_id != '').\
+                    filter(rollup.period_beginning >= begin).\
+                    filter(rollup.period_ending <= end)
+    if project_id:
+        query = query.filter_by(project_id=project_id)
+    query = query.group_by(rollup.project_id)
+
+    totals = []
+    for row in query.all():
+        usage = dict(zip(_TENANT_USAGE_COUNTERS, row[1:]))
+        usage['tenant_id'] = row[0]
+        totals.append(usage)
+    return totals
+
+
+def _usage_hours(start, stop):
+    delta = stop - start
+    seconds = (delta.days * 3600 * 24 + delta.seconds +
+               delta.microseconds / 1000000.0)
+    return seconds / 3600.0
+
+
+@require_admin_context
+def tenant_usage_get_totals_by_window(context, begin, end, project_id=None):
+    instance = models.Instance
+    instance_type = models.InstanceTypes
+    local_gb = instance_type.root_gb + instance_type.ephemeral_gb
+    # Instances whose flavor was deleted are not billed
+    query = model_query(context, instance, read_deleted="yes").\
+                    join(instance_type,
+                         instance.instance_type_id == instance_type.id).\
+                    filter(instance_type.deleted == False).\
+                    filter(instance.launched_at != None).\
+                    filter(instance.launched_at < end).\
+                    filter(or_(instance.terminated_at == None,
+                               instance.terminated_at > begin))
+    if project_id:
+        query = query.filter(instance.project_id == project_id)
+
+    running = and_(instance.launched_at <= begin,
+                   or_(instance.terminated_at == None,
+                       instance.terminated_at >= end))
+
+    totals = {}
+
+    def add(tenant_id, hours, instances, memory_mb, vcpus, local_gb):
+        usage = totals.get(tenant_id)
+        if usage is None:
+            usage = totals[tenant_id] = dict(
+                    (counter, 0) for counter in _TENANT_USAGE_COUNTERS)
+            usage['tenant_id'] = tenant_id
+        # SUM() of integers is a Decimal on MySQL
+        usage['total_hours'] += int(instances) * hours
+        usage['total_local_gb_usage'] += int(local_gb or 0) * hours
+        usage['total_vcpus_usage'] += int(vcpus or 0) * hours
+        usage['total_memory_mb_usage'] += int(memory_mb or 0) * hours
+
+    # The instances running over the whole window, usually most of
+    # them, are summed per project.
+    window_hours = _usage_hours(begin, end)
+    for row in query.filter(running).\
+                     with_entities(instance.project_id,
+                                   func.count(instance.id),
+                                   func.sum(instance_type.memory_mb),
+                                   func.sum(instance_type.vcpus),
+                                   func.sum(local_gb)).\
+                     group_by(instance.project_id).\
+                     all():
+        add(row[0], window_hours, *row[1:])
+
+    # The ones started or terminated within it are billed one by one.
+    for row in query.filter(not_(running)).\
+                     with_entities(instance.project_id,
+                                   instance.launched_at,
+                                   instance.terminated_at,
+                                   instance_type.memory_mb,
+                                   instance_type.vcpus,
+                                   local_gb).\
+                     all():
+        launched_at, terminated_at = row[1:3]
+        start = max(launched_at, begin)
+        stop = min(terminated_at, end) if terminated_at else end
+        add(row[0], _usage_hours(start, stop), 1, *row[3:])
+
+    return totals.values()
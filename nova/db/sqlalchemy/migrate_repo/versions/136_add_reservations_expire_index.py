@@ -0,0 +1,57 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+from sqlalchemy.exc import IntegrityError
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    t = Table('reservations', meta, autoload=True)
+
+    # Based on the expiry queue in reservation_expire
+    # from: nova/db/sqlalchemy/api.py
+    i = Index('reservations_deleted_expire_idx',
+              t.c.deleted, t.c.expire)
+    try:
+        i.create(migrate_engine)
+    except IntegrityError:
+        pass
+
+    # Based on the lookups by uuid in reservation_commit and
+    # reservation_rollback from: nova/db/sqlalchemy/api.py
+    i = Index('reservations_uuid_idx', t.c.uuid)
+    try:
+        i.create(migrate_engine)
+    except IntegrityError:
+        pass
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    t = Table('reservations', meta, autoload=True)
+
+    i = Index('reservations_deleted_expire_idx',
+              t.c.deleted, t.c.expire)
+    i.drop(migrate_engine)
+
+    i = Index('reservations_uuid_idx', t.c.uuid)
+    i.drop(migrate_engine)
@@ -0,0 +1,74 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, Integer
+from sqlalchemy import MetaData, String, Table
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    # create new table
+    tenant_usage_rollups = Table('tenant_usage_rollups', meta,
+            Column('created_at', DateTime(timezone=False)),
+            Column('updated_at', DateTime(timezone=False)),
+            Column('deleted_at', DateTime(timezone=False)),
+            Column('deleted',
+                    Boolean(create_constraint=True, name=None)),
+            Column('id', Integer(),
+                    primary_key=True,
+                    nullable=False,
+                    autoincrement=True),
+            Column('project_id', String(255), nullable=False),
+            Column('period_beginning', DateTime(timezone=False),
+                   nullable=False),
+            Column('period_ending', DateTime(timezone=False),
+                   nullable=False),
+            Column('instances', Integer(), nullable=False),
+            # Double precision, a MySQL FLOAT loses the low digits of
+            # large usages and of their sums
+            Column('total_hours', Float(53), nullable=False),
+            Column('total_local_gb_usage', Float(53), nullable=False),
+            Column('total_vcpus_usage', Float(53), nullable=False),
+            Column('total_memory_mb_usage', Float(53), nullable=False),
+            )
+    try:
+        tenant_usage_rollups.create()
+    except Exception:
+        meta.drop_all(tables=[tenant_usage_rollups])
+        raise
+
+    if migrate_engine.name == "mysql":
+        migrate_engine.execute("ALTER TABLE tenant_usage_rollups "
+                "Engine=InnoDB")
+
+    # A period is rolled up at most once, see
+    # tenant_usage_rollup_create_safe from: nova/db/sqlalchemy/api.py
+    i = Index('tenant_usage_rollups_period_project_idx',
+              tenant_usage_rollups.c.period_beginning,
+              tenant_usage_rollups.c.project_id,
+              unique=True)
+    i.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    tenant_usage_rollups = Table('tenant_usage_rollups', meta, autoload=True)
+    tenant_usage_rollups.drop()
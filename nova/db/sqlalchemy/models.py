@@ -1018,3 +1018,21 @@ class TaskLog(BASE, NovaBase):
     message = Column(String(255), nullable=False)
     task_items = Column(Integer(), default=0)
     errors = Column(Integer(), default=0)
+
+
+class TenantUsageRollup(BASE, NovaBase):
+    """Usage of a tenant over a completed period, usually an hour.
+
+    The row with an empty project_id holds the totals of all the tenants
+    and marks the period as rolled up.
+    """
+    __tablename__ = 'tenant_usage_rollups'
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
+    project_id = Column(String(255), nullable=False)
+    period_beginning = Column(DateTime, nullable=False)
+    period_ending = Column(DateTime, nullable=False)
+    instances = Column(Integer, nullable=False, default=0)
+    total_hours = Column(Float(53), nullable=False, default=0)
+    total_local_gb_usage = Column(Float(53), nullable=False, default=0)
+    total_vcpus_usage = Column(Float(53), nullable=False, default=0)
+    total_memory_mb_usage = Column(Float(53), nullable=False, default=0)
@@ -78,6 +78,11 @@ core_opts = [
                default='sqlite:///$state_path/$sqlite_db',
                help='The SQLAlchemy connection string used to connect to the '
                     'database'),
+    cfg.StrOpt('slave_connection',
+               default=None,
+               help='The SQLAlchemy connection string used to connect to a '
+                    'read-only replica of the database.  Read-only queries '
+                    'that tolerate stale data are sent to it when set'),
     cfg.StrOpt('api_paste_config',
                default="api-paste.ini",
                help='File name for the paste.deploy config for nova-api'),
@@ -20,8 +20,10 @@
 from __future__ import absolute_import
 
 import copy
+import httplib
 import itertools
 import random
+import socket
 import sys
 import time
 import urlparse
@@ -29,15 +31,39 @@ import urlparse
 import glanceclient
 import glanceclient.exc
 
+from nova import context as nova_context
 from nova import exception
 from nova import flags
+from nova.openstack.common import cfg
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 
 
+glance_opts = [
+    cfg.IntOpt('glance_metadata_cache_size',
+               default=1000,
+               help='Number of image metadata lookups to keep in memory, '
+                    '0 disables the cache'),
+    cfg.IntOpt('glance_metadata_cache_ttl',
+               default=60,
+               help='Seconds to keep the metadata of active images'),
+    cfg.IntOpt('glance_metadata_cache_negative_ttl',
+               default=5,
+               help='Seconds to remember that an image was not found'),
+    cfg.IntOpt('glance_connection_pool_size',
+               default=10,
+               help='Number of connections to keep open to each glance api '
+                    'server, 0 opens a connection per call'),
+    cfg.IntOpt('glance_api_server_retry_interval',
+               default=30,
+               help='Seconds to skip a glance api server after failing to '
+                    'reach it, while other servers are available'),
+    ]
+
 LOG = logging.getLogger(__name__)
 FLAGS = flags.FLAGS
+FLAGS.register_opts(glance_opts)
 
 
 def _parse_image_ref(image_href):
@@ -67,15 +93,169 @@ def _create_glance_client(context, host, port, use_ssl, version=1):
     if FLAGS.auth_strategy == 'keystone':
         params['token'] = context.auth_token
     endpoint = '%s://%s:%s' % (scheme, host, port)
-    return glanceclient.Client(str(version), endpoint, **params)
+    client = glanceclient.Client(str(version), endpoint, **params)
 
+    # NOTE: glanceclient opens a new connection for every request, share
+    # keep-alive connections between the clients of this process instead.
+    http_client = getattr(client, 'http_client', client)
+    if (FLAGS.glance_connection_pool_size > 0 and
+            hasattr(http_client, 'connection_params')):
+        pool = _get_connection_pool(http_client.connection_params)
+        http_client.get_connection = pool.get
+    return client
 
-def get_api_servers():
-    """
-    Shuffle a list of FLAGS.glance_api_servers and return an iterator
-    that will cycle through the list, looping around to the beginning
-    if necessary.
+
+class _PooledConnection(object):
+    """An HTTP connection which is reused once its response is read.
+
+    Idempotent requests sent over a reused connection are sent again over
+    a new one when the server closed the connection while it was idle,
+    unless their body was a stream.
     """
+
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.busy = True
+        self.reused = False
+        self._request = None
+        self._response = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def is_idle(self):
+        if self.busy:
+            return False
+        response = self._response
+        if response is not None:
+            if not response.isclosed():
+                return False
+            if response.length:
+                # NOTE: the response was closed before all of its body
+                # was read, the rest of which is still on the way.
+                self.conn.close()
+            self._response = None
+        return True
+
+    def _can_resend(self):
+        method, url, body, headers = self._request
+        return (self.reused and method in self.IDEMPOTENT_METHODS and
+                (body is None or isinstance(body, basestring)))
+
+    def _failed(self):
+        self.busy = False
+        self.conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        self._request = (method, url, body, headers or {})
+        try:
+            self.conn.request(*self._request)
+        except (socket.error, httplib.HTTPException):
+            if not self._can_resend():
+                self._failed()
+                raise
+            self.conn.close()
+            self._send_again()
+
+    def _send_again(self):
+        self.reused = False
+        try:
+            self.conn.request(*self._request)
+        except Exception:
+            self._failed()
+            raise
+
+    def getresponse(self):
+        try:
+            response = self.conn.getresponse()
+        except (socket.error, httplib.HTTPException):
+            if not self._can_resend():
+                self._failed()
+                raise
+            self.conn.close()
+            self._send_again()
+            try:
+                response = self.conn.getresponse()
+            except Exception:
+                self._failed()
+                raise
+        except Exception:
+            self._failed()
+            raise
+
+        self.busy = False
+        self.reused = True
+        self._response = response
+        return response
+
+
+class _ConnectionPool(object):
+    """The connections opened to one glance api server."""
+
+    def __init__(self, conn_class, args, kwargs):
+        self.conn_class = conn_class
+        self.args = args
+        self.kwargs = kwargs
+        self.connections = []
+
+    def get(self):
+        """Return an idle connection, or a new one if none is idle."""
+        for pooled in self.connections:
+            if pooled.is_idle():
+                pooled.busy = True
+                return pooled
+
+        try:
+            conn = self.conn_class(*self.args, **self.kwargs)
+        except httplib.InvalidURL:
+            raise glanceclient.exc.InvalidEndpoint()
+        pooled = _PooledConnection(conn)
+        self.connections.append(pooled)
+
+        # NOTE: connections whose response is never read, like image
+        # downloads given up on, are forgotten as new ones get opened.
+        while len(self.connections) > FLAGS.glance_connection_pool_size:
+            oldest = self.connections.pop(0)
+            if oldest.is_idle():
+                oldest.close()
+        return pooled
+
+
+_connection_pools = {}
+
+
+def _get_connection_pool(connection_params):
+    conn_class, args, kwargs = connection_params
+    key = (conn_class, tuple(args), tuple(sorted(kwargs.items())))
+    pool = _connection_pools.get(key)
+    if pool is None:
+        pool = _connection_pools[key] = _ConnectionPool(conn_class, args,
+                                                        kwargs)
+    return pool
+
+
+# NOTE: the time glance api servers were last found unreachable at
+_failed_api_servers = {}
+
+
+def _api_server_failed(api_server):
+    _failed_api_servers[api_server] = timeutils.utcnow_ts()
+
+
+def _api_server_is_up(api_server):
+    failed_at = _failed_api_servers.get(api_server)
+    return (failed_at is None or timeutils.utcnow_ts() - failed_at >=
+            FLAGS.glance_api_server_retry_interval)
+
+
+def _any_api_server_up():
+    return any(_api_server_is_up(api_server)
+               for api_server in _parse_api_servers())
+
+
+def _parse_api_servers():
     api_servers = []
     for api_server in FLAGS.glance_api_servers:
         if '//' not in api_server:
@@ -85,6 +265,16 @@ def get_api_servers():
         host = o.netloc.split(':', 1)[0]
         use_ssl = (o.scheme == 'https')
         api_servers.append((host, port, use_ssl))
+    return api_servers
+
+
+def get_api_servers():
+    """
+    Shuffle a list of FLAGS.glance_api_servers and return an iterator
+    that will cycle through the list, looping around to the beginning
+    if necessary.
+    """
+    api_servers = _parse_api_servers()
     random.shuffle(api_servers)
     return itertools.cycle(api_servers)
 
@@ -113,10 +303,17 @@ class GlanceClientWrapper(object):
                                      self.use_ssl, self.version)
 
     def _create_onetime_client(self, context, version):
-        """Create a client that will be used for one call."""
+        """Create a client that will be used for one call.
+
+        Servers which recently failed are skipped, unless they all did.
+        """
         if self.api_servers is None:
             self.api_servers = get_api_servers()
-        self.host, self.port, self.use_ssl = self.api_servers.next()
+        for i in xrange(len(FLAGS.glance_api_servers)):
+            api_server = self.api_servers.next()
+            if _api_server_is_up(api_server):
+                break
+        self.host, self.port, self.use_ssl = api_server
         return _create_glance_client(context,
                                      self.host, self.port,
                                      self.use_ssl, version)
@@ -135,10 +332,15 @@ class GlanceClientWrapper(object):
             client = self.client or self._create_onetime_client(context,
                                                                 version)
             try:
-                return getattr(client.images, method)(*args, **kwargs)
+                if callable(method):
+                    result = method(client.images, *args, **kwargs)
+                else:
+                    result = getattr(client.images, method)(*args, **kwargs)
             except retry_excs as e:
                 host = self.host
                 port = self.port
+                if self.client is None:
+                    _api_server_failed((host, port, self.use_ssl))
                 extra = "retrying"
                 error_msg = _("Error contacting glance server "
                         "'%(host)s:%(port)s' for '%(method)s', %(extra)s.")
@@ -148,7 +350,119 @@ class GlanceClientWrapper(object):
                     raise exception.GlanceConnectionFailed(
                             host=host, port=port, reason=str(e))
                 LOG.exception(error_msg, locals())
-                time.sleep(1)
+                # NOTE: fail over to the next server right away if there
+                # is one left to try.
+                if self.client is not None or not _any_api_server_up():
+                    time.sleep(1)
+            else:
+                if self.client is None:
+                    _failed_api_servers.pop((self.host, self.port,
+                                             self.use_ssl), None)
+                return result
+
+
+class ImageMetaCache(object):
+    """Least recently used cache of image metadata, whose entries expire.
+
+    Metadata is kept per image and visibility scope: public images are
+    shared by every context, other images and not found lookups are only
+    seen by contexts of the same project and user, or by admins.  Only
+    active images are cached, as the metadata of others is about to change.
+    """
+
+    PREV, NEXT, KEY, EXPIRES, VALUE = range(5)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._entries = {}
+        # NOTE: entries are kept in a circular doubly linked list, most
+        # recently used first, to find the one to evict in constant time.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _scope(context):
+        if context.is_admin:
+            return 'admin'
+        return (context.project_id, context.user_id)
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _push(self, link):
+        root = self._root
+        link[self.PREV] = root
+        link[self.NEXT] = root[self.NEXT]
+        root[self.NEXT][self.PREV] = link
+        root[self.NEXT] = link
+
+    def _pop(self, key):
+        link = self._entries.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+
+    def _get(self, key):
+        link = self._entries.get(key)
+        if link is None:
+            raise KeyError(key)
+        if link[self.EXPIRES] <= timeutils.utcnow_ts():
+            self._pop(key)
+            raise KeyError(key)
+        self._unlink(link)
+        self._push(link)
+        return link[self.VALUE]
+
+    def get(self, context, image_key):
+        """Return a copy of the cached metadata of an image.
+
+        :returns: the image metadata, or None if the image was not found
+        :raises: KeyError if nothing is cached for the image
+        """
+        try:
+            value = self._get((image_key, self._scope(context)))
+        except KeyError:
+            value = self._get((image_key, None))
+        return copy.deepcopy(value)
+
+    def put(self, context, image_key, image_meta):
+        """Cache the metadata of an image, None if it was not found."""
+        size = FLAGS.glance_metadata_cache_size
+        if image_meta is None:
+            ttl = FLAGS.glance_metadata_cache_negative_ttl
+            scope = self._scope(context)
+        else:
+            if image_meta.get('status') != 'active':
+                return
+            ttl = FLAGS.glance_metadata_cache_ttl
+            scope = None if image_meta.get('is_public') else \
+                    self._scope(context)
+        if size <= 0 or ttl <= 0:
+            return
+
+        key = (image_key, scope)
+        self._pop(key)
+        link = [None, None, key, timeutils.utcnow_ts() + ttl,
+                copy.deepcopy(image_meta)]
+        self._push(link)
+        self._entries[key] = link
+
+        while len(self._entries) > size:
+            self._pop(self._root[self.PREV][self.KEY])
+
+    def invalidate(self, image_key):
+        """Forget what is cached for an image, in every scope."""
+        for key in self._entries.keys():
+            if key[0] == image_key:
+                self._pop(key)
+
+
+_image_cache = ImageMetaCache()
 
 
 class GlanceImageService(object):
@@ -168,7 +482,10 @@ class GlanceImageService(object):
         _images = []
         for image in images:
             if self._is_image_available(context, image):
-                _images.append(self._translate_from_glance(image))
+                image_meta = self._translate_from_glance(image)
+                _image_cache.put(context, self._cache_key(image_meta['id']),
+                                 image_meta)
+                _images.append(image_meta)
 
         return _images
 
@@ -189,15 +506,42 @@ class GlanceImageService(object):
 
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
+        return nova_context.cached_lookup(context, 'image',
+                                          self._cache_key(image_id),
+                                          self._show, context, image_id)
+
+    def _cache_key(self, image_id):
+        # NOTE: services made by get_remote_image_service() talk to the
+        # glance server of the image href rather than the configured ones.
+        if getattr(self._client, 'client', None) is not None:
+            return (self._client.host, self._client.port, image_id)
+        return image_id
+
+    def _show(self, context, image_id):
+        cache_key = self._cache_key(image_id)
+        try:
+            image_meta = _image_cache.get(context, cache_key)
+        except KeyError:
+            pass
+        else:
+            if image_meta is None:
+                raise exception.ImageNotFound(image_id=image_id)
+            return image_meta
+
         try:
             image = self._client.call(context, 1, 'get', image_id)
+        except glanceclient.exc.NotFound:
+            _image_cache.put(context, cache_key, None)
+            _reraise_translated_image_exception(image_id)
         except Exception:
             _reraise_translated_image_exception(image_id)
 
         if not self._is_image_available(context, image):
+            _image_cache.put(context, cache_key, None)
             raise exception.ImageNotFound(image_id=image_id)
 
         base_image_meta = self._translate_from_glance(image)
+        _image_cache.put(context, cache_key, base_image_meta)
         return base_image_meta
 
     def get_location(self, context, image_id):
@@ -224,6 +568,24 @@ class GlanceImageService(object):
         for chunk in image_chunks:
             data.write(chunk)
 
+    def download_range(self, context, image_id, data, start, end=None):
+        """Writes the bytes of an image from start to end, included.
+
+        :returns: False if glance sent the whole image instead of the range,
+                  none of which is written then
+        """
+        try:
+            image_chunks = self._client.call(context, 1, _image_data_range,
+                                             image_id, start, end)
+        except Exception:
+            _reraise_translated_image_exception(image_id)
+
+        if image_chunks is None:
+            return False
+        for chunk in image_chunks:
+            data.write(chunk)
+        return True
+
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
         sent_service_image_meta = self._translate_to_glance(image_meta)
@@ -252,6 +614,8 @@ class GlanceImageService(object):
         except Exception:
             _reraise_translated_image_exception(image_id)
         else:
+            nova_context.invalidate_cached(context, 'image')
+            _image_cache.invalidate(self._cache_key(image_id))
             return self._translate_from_glance(image_meta)
 
     def delete(self, context, image_id):
@@ -265,6 +629,9 @@ class GlanceImageService(object):
             self._client.call(context, 1, 'delete', image_id)
         except glanceclient.exc.NotFound:
             raise exception.ImageNotFound(image_id=image_id)
+        finally:
+            nova_context.invalidate_cached(context, 'image')
+            _image_cache.invalidate(self._cache_key(image_id))
         return True
 
     @staticmethod
@@ -311,6 +678,24 @@ class GlanceImageService(object):
         return str(user_id) == str(context.user_id)
 
 
+def _image_data_range(images, image_id, start, end=None):
+    """Get the bytes of an image from start to end with a Range request.
+
+    :returns: an iterator over the bytes, or None if the server does not
+              serve ranges
+    """
+    if end is None:
+        byte_range = 'bytes=%d-' % start
+    else:
+        byte_range = 'bytes=%d-%d' % (start, end)
+    resp, body = images.api.raw_request('GET', '/v1/images/%s' % image_id,
+                                        headers={'Range': byte_range})
+    if resp.status != httplib.PARTIAL_CONTENT:
+        resp.close()
+        return None
+    return body
+
+
 def _convert_timestamps_to_datetimes(image_meta):
     """Returns image with timestamp fields converted to datetime objects."""
     for attr in ['created_at', 'updated_at', 'deleted_at']:
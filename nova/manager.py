@@ -56,6 +56,7 @@ This module provides Manager, a base class for managers.
 import eventlet
 
 from nova.db import base
+from nova.db import query_stats
 from nova import flags
 from nova.openstack.common import log as logging
 from nova.openstack.common.plugin import pluginmanager
@@ -172,7 +173,8 @@ class Manager(base.Base):
             LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
 
             try:
-                task(self, context)
+                with query_stats.scope(full_task_name):
+                    task(self, context)
                 # NOTE(tiantian): After finished a task, allow manager to
                 # do other work (report_state, processing AMPQ request etc.)
                 eventlet.sleep(0)
@@ -24,6 +24,8 @@ import inspect
 import netaddr
 import os
 
+from eventlet import greenthread
+
 from nova import db
 from nova import exception
 from nova import flags
@@ -83,6 +85,12 @@ linux_net_opts = [
                 default=False,
                 help='Use single default gateway. Only first nic of vm will '
                      'get default gateway from dhcp server'),
+    cfg.FloatOpt('dhcp_reload_delay',
+                 default=0.5,
+                 help='Seconds to wait after a dhcp host is added or removed '
+                      'before reloading dnsmasq, so that the hosts changed '
+                      'in the meantime are reloaded at once. 0 reloads '
+                      'right away'),
     ]
 
 FLAGS = flags.FLAGS
@@ -141,6 +149,10 @@ class IptablesTable(object):
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
+        # The rule lines of the wrapped chains by full name, and the
+        # wrapped chains changed since they were last built
+        self._chain_rules = {}
+        self._dirty_chains = set()
 
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
@@ -156,6 +168,7 @@ class IptablesTable(object):
         """
         if wrap:
             self.chains.add(name)
+            self._dirty_chains.add(name)
         else:
             self.unwrapped_chains.add(name)
 
@@ -182,6 +195,8 @@ class IptablesTable(object):
         # so we keep a list of them to be iterated over in apply()
         if not wrap:
             self.remove_chains.add(name)
+        else:
+            self._dirty_chains.add(name)
         chain_set.remove(name)
         if not wrap:
             self.remove_rules += filter(lambda r: r.chain == name, self.rules)
@@ -195,6 +210,8 @@ class IptablesTable(object):
         if not wrap:
             self.remove_rules += filter(lambda r: jump_snippet in r.rule,
                                         self.rules)
+        self._dirty_chains.update(r.chain for r in self.rules
+                                  if r.wrap and jump_snippet in r.rule)
         self.rules = filter(lambda r: jump_snippet not in r.rule, self.rules)
 
     def add_rule(self, chain, rule, wrap=True, top=False):
@@ -215,6 +232,8 @@ class IptablesTable(object):
             rule = ' '.join(map(self._wrap_target_chain, rule.split(' ')))
 
         self.rules.append(IptablesRule(chain, rule, wrap, top))
+        if wrap:
+            self._dirty_chains.add(chain)
 
     def _wrap_target_chain(self, s):
         if s.startswith('$'):
@@ -233,6 +252,8 @@ class IptablesTable(object):
             self.rules.remove(IptablesRule(chain, rule, wrap, top))
             if not wrap:
                 self.remove_rules.append(IptablesRule(chain, rule, wrap, top))
+            else:
+                self._dirty_chains.add(chain)
         except ValueError:
             LOG.warn(_('Tried to remove rule that was not there:'
                        ' %(chain)r %(rule)r %(wrap)r %(top)r'),
@@ -241,10 +262,57 @@ class IptablesTable(object):
 
     def empty_chain(self, chain, wrap=True):
         """Remove all rules from a chain."""
-        chained_rules = [rule for rule in self.rules
-                              if rule.chain == chain and rule.wrap == wrap]
-        for rule in chained_rules:
-            self.rules.remove(rule)
+        self.rules = [rule for rule in self.rules
+                      if rule.chain != chain or rule.wrap != wrap]
+        if wrap:
+            self._dirty_chains.add(chain)
+
+    def wrapped_chain_rules(self):
+        """Return the rule lines of each wrapped chain by its full name.
+
+        Top rules come first and of identical rules only the last one is
+        kept, as in the table built by IptablesManager._modify_rules.
+        Only the chains changed since the last call are built again.
+
+        """
+        if self._dirty_chains:
+            chain_rules = dict((name, ([], [])) for name in
+                               self._dirty_chains & self.chains)
+            for rule in self.rules:
+                if rule.wrap and rule.chain in chain_rules:
+                    top_lines, lines = chain_rules[rule.chain]
+                    if rule.top:
+                        top_lines.append(str(rule))
+                    else:
+                        lines.append(str(rule))
+
+            for name in self._dirty_chains - self.chains:
+                self._chain_rules.pop('%s-%s' % (binary_name, name), None)
+            for name, (top_lines, lines) in chain_rules.iteritems():
+                seen_lines = set()
+                unique_lines = []
+                for line in reversed(top_lines + lines):
+                    if line not in seen_lines:
+                        seen_lines.add(line)
+                        unique_lines.append(line)
+                unique_lines.reverse()
+                self._chain_rules['%s-%s' % (binary_name, name)] = \
+                        tuple(unique_lines)
+            self._dirty_chains.clear()
+        return dict(self._chain_rules)
+
+    def unwrapped_state(self):
+        """Return the unwrapped chains and the rules of unwrapped chains."""
+        return (frozenset(self.unwrapped_chains),
+                tuple((str(rule), rule.top) for rule in self.rules
+                      if not rule.wrap))
+
+
+def _jump_target(words):
+    """Return the chain a rule split into words jumps to, if any."""
+    if '-j' in words[:-1]:
+        return words[words.index('-j') + 1]
+    return None
 
 
 class IptablesManager(object):
@@ -282,6 +350,10 @@ class IptablesManager(object):
 
         self.iptables_apply_deferred = False
 
+        # The unwrapped chains and rules, and the rules of each wrapped
+        # chain, of every table as last applied, by command and table name
+        self._applied = {}
+
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
         # of FORWARD and OUTPUT.
@@ -352,6 +424,10 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Once a table has been applied, later applies only rewrite the
+        wrapped chains which changed since, as long as the unwrapped
+        chains and rules are unchanged and still in place.
+
         """
         s = [('iptables', self.ipv4)]
         if FLAGS.use_ipv6:
@@ -364,13 +440,118 @@ class IptablesManager(object):
                                                    run_as_root=True,
                                                    attempts=5)
                 current_lines = current_table.split('\n')
-                new_filter = self._modify_rules(current_lines,
-                                                tables[table])
-                self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
-                             process_input='\n'.join(new_filter),
-                             attempts=5)
+                state = (tables[table].unwrapped_state(),
+                         tables[table].wrapped_chain_rules())
+                if not self._apply_changed_chains(cmd, table, tables[table],
+                                                  state, current_lines):
+                    new_filter = self._modify_rules(current_lines,
+                                                    tables[table])
+                    self.execute('%s-restore' % (cmd,), '-c',
+                                 run_as_root=True,
+                                 process_input='\n'.join(new_filter),
+                                 attempts=5)
+                self._applied[(cmd, table)] = state
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _apply_changed_chains(self, cmd, table_name, table, state,
+                              current_lines):
+        """Rewrite the wrapped chains changed since the last apply.
+
+        Returns False, without touching the table, when it has to be
+        rebuilt as a whole instead: on its first apply, when unwrapped
+        chains or rules were added or removed since, or when the chains
+        and jumps of the last apply are no longer in place.
+
+        """
+        applied = self._applied.get((cmd, table_name))
+        if (applied is None or applied[0] != state[0] or
+                table.remove_rules or table.remove_chains):
+            return False
+
+        applied_chains = applied[1]
+        chains = state[1]
+        prefix = '%s-' % (binary_name,)
+        rule_counts, jumps = self._parse_table(current_lines, prefix)
+
+        # iptables-save does not print rules as we wrote them, so only the
+        # number of rules in our chains and the jumps to them are checked.
+        for name, rules in applied_chains.iteritems():
+            if rule_counts.get(name) != len(rules):
+                return False
+        for name in table.unwrapped_chains:
+            if name not in rule_counts:
+                return False
+
+        our_jumps = set()
+        for rule in table.rules:
+            if not rule.wrap:
+                target = _jump_target(rule.rule.split())
+                if target is not None:
+                    our_jumps.add((rule.chain, target))
+        if not our_jumps.issubset(jumps):
+            return False
+        for jump in jumps:
+            if jump[1].startswith(prefix) and jump not in our_jumps:
+                return False
+
+        changed = [name for name in sorted(chains)
+                   if chains[name] != applied_chains.get(name)]
+        removed = [name for name in sorted(rule_counts)
+                   if name.startswith(prefix) and name not in chains]
+        if not changed and not removed:
+            return True
+
+        # Declaring a chain flushes it when restoring with --noflush,
+        # the chains which are not declared are left untouched.
+        new_filter = ['*%s' % (table_name,)]
+        new_filter += [':%s - [0:0]' % (name,) for name in changed + removed]
+        for name in changed:
+            new_filter.extend(chains[name])
+        new_filter += ['-X %s' % (name,) for name in removed]
+        new_filter += ['COMMIT', '']
+        try:
+            self.execute('%s-restore' % (cmd,), '-c', '--noflush',
+                         run_as_root=True,
+                         process_input='\n'.join(new_filter),
+                         attempts=5)
+        except exception.ProcessExecutionError:
+            LOG.warn(_('Failed to rewrite the changed chains of the '
+                       '%(table_name)s table, rebuilding it'), locals())
+            return False
+        LOG.debug(_('Rewrote %(changed)d and removed %(removed)d chains of '
+                    'the %(table_name)s table'),
+                  {'changed': len(changed), 'removed': len(removed),
+                   'table_name': table_name})
+        return True
+
+    @staticmethod
+    def _parse_table(lines, prefix):
+        """Return the rule counts by chain and the jumps of a saved table.
+
+        Only the jumps of the chains not named with prefix are returned.
+
+        """
+        rule_counts = {}
+        jumps = set()
+        for line in lines:
+            if line.startswith(':'):
+                rule_counts.setdefault(line[1:].split(' ', 1)[0], 0)
+                continue
+            # ignore [packet:byte] counts at beginning of rules
+            if line.startswith('['):
+                words = line.split(' ', 3)[1:]
+            else:
+                words = line.split(' ', 2)
+            if len(words) < 2 or words[0] != '-A':
+                continue
+            chain = words[1]
+            rule_counts[chain] = rule_counts.get(chain, 0) + 1
+            if not chain.startswith(prefix):
+                target = _jump_target(line.split())
+                if target is not None:
+                    jumps.add((chain, target))
+        return rule_counts, jumps
+
     def _modify_rules(self, current_lines, table, binary=None):
         unwrapped_chains = table.unwrapped_chains
         chains = table.chains
@@ -451,6 +632,10 @@ class IptablesManager(object):
                 seen_lines.add(line)
                 return True
 
+        # ignore [packet:byte] counts at beginning of rules
+        remove_rule_strs = set(str(rule).split(' ', 1)[1].strip()
+                               for rule in remove_rules)
+
         def _weed_out_removes(line):
             # We need to find exact matches here
             if line.startswith(':'):
@@ -459,23 +644,17 @@ class IptablesManager(object):
                 line = line.split(':')[1]
                 line = line.split('- [')[0]
                 line = line.strip()
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
+                if line in remove_chains:
+                    remove_chains.remove(line)
+                    return False
             elif line.startswith('['):
                 # it's a rule
                 # ignore [packet:byte] counts at beginning of lines
                 line = line.split(']', 1)[1]
                 line = line.strip()
-                for rule in remove_rules:
-                    # ignore [packet:byte] counts at beginning of rules
-                    rule_str = str(rule)
-                    rule_str = rule_str.split(' ', 1)[1]
-                    rule_str = rule_str.strip()
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                if line in remove_rule_strs:
+                    remove_rule_strs.remove(line)
+                    return False
 
             # Leave it alone
             return True
@@ -490,12 +669,57 @@ class IptablesManager(object):
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
         return new_filter
 
 
+class IpsetManager(object):
+    """Wrapper for ipset.
+
+    Keeps sets of addresses, to be matched by iptables rules with
+    '-m set --match-set <name> src', holding the addresses last given to
+    update_set.  Only the addresses added or removed since are passed to
+    ipset.
+
+    """
+
+    def __init__(self, execute=None):
+        if not execute:
+            self.execute = _execute
+        else:
+            self.execute = execute
+
+        # The addresses of each set as last updated, by set name
+        self.sets = {}
+
+    def update_set(self, name, addresses, family='inet'):
+        """Create set name if needed and make it hold exactly addresses."""
+        addresses = frozenset(addresses)
+        current = self.sets.get(name)
+        commands = []
+        if current is None:
+            # Drop anything left in the set by a previous run
+            commands += ['create %s hash:ip family %s' % (name, family),
+                         'flush %s' % (name,)]
+            current = frozenset()
+        commands += ['add %s %s' % (name, address)
+                     for address in sorted(addresses - current)]
+        commands += ['del %s %s' % (name, address)
+                     for address in sorted(current - addresses)]
+        if commands:
+            self.execute('ipset', '-exist', 'restore',
+                         process_input='\n'.join(commands) + '\n',
+                         run_as_root=True)
+        self.sets[name] = addresses
+
+    def destroy_set(self, name):
+        """Destroy set name, which no iptables rule may match anymore."""
+        if self.sets.pop(name, None) is not None:
+            self.execute('ipset', 'destroy', name, run_as_root=True,
+                         check_exit_code=False)
+
+
 # NOTE(jkoelker) This is just a nice little stub point since mocking
 #                builtins with mox is a nightmare
 def write_to_file(file, data, mode='w'):
@@ -694,30 +918,124 @@ def initialize_gateway_device(dev, network_ref):
                  'dev', dev, run_as_root=True)
 
 
-def get_dhcp_leases(context, network_ref):
-    """Return a network's hosts config in dnsmasq leasefile format."""
-    hosts = []
+class DhcpHosts(object):
+    """The dhcp hosts of a network, as written to its dnsmasq files.
+
+    The hosts are kept in memory between updates, so that a fixed ip
+    being leased or released only adds or removes its own entry.
+
+    """
+
+    def __init__(self):
+        # The network_get_associated_fixed_ips data of each host, by address
+        self.hosts = {}
+        # The vif of each instance offered a default gateway, by uuid
+        self.default_gw_vifs = {}
+
+    def load(self, data):
+        """Replace all of the hosts."""
+        self.hosts = dict((datum['address'], datum) for datum in data)
+        instance_uuids = set(datum['instance_uuid'] for datum in data)
+        for instance_uuid in self.default_gw_vifs.keys():
+            if instance_uuid not in instance_uuids:
+                del self.default_gw_vifs[instance_uuid]
+
+    def add(self, datum):
+        """Add or replace the host of an address, return if it changed."""
+        if self.hosts.get(datum['address']) == datum:
+            return False
+        self.hosts[datum['address']] = datum
+        return True
+
+    def remove(self, address):
+        """Remove the host of an address, return if there was one."""
+        datum = self.hosts.pop(address, None)
+        if datum is None:
+            return False
+        instance_uuid = datum['instance_uuid']
+        if not any(other['instance_uuid'] == instance_uuid
+                   for other in self.hosts.itervalues()):
+            self.default_gw_vifs.pop(instance_uuid, None)
+        return True
+
+    def _sorted_hosts(self):
+        return sorted(self.hosts.itervalues(),
+                      key=lambda datum: (datum['vif_id'], datum['address']))
+
+    def hosts_text(self):
+        """Get the hosts config in dhcp-host format."""
+        return '\n'.join(_host_dhcp(datum) for datum in self._sorted_hosts())
+
+    def opts_text(self, context):
+        """Get the hosts config in dhcp-opts format.
+
+        The vifs of an instance are only looked up the first time one of
+        its addresses is seen.
+        """
+        opts = []
+        for datum in self._sorted_hosts():
+            instance_uuid = datum['instance_uuid']
+            if instance_uuid not in self.default_gw_vifs:
+                vifs = db.virtual_interface_get_by_instance(context,
+                                                            instance_uuid)
+                if not vifs:
+                    continue
+                #offer a default gateway to the first virtual interface
+                self.default_gw_vifs[instance_uuid] = vifs[0]['id']
+            # we don't want default gateway for this fixed ip
+            if self.default_gw_vifs[instance_uuid] != datum['vif_id']:
+                opts.append(_host_dhcp_opts(datum))
+        return '\n'.join(opts)
+
+    def write(self, context, dev):
+        """Rewrite the dnsmasq files of dev."""
+        _write_dhcp_file(_dhcp_file(dev, 'conf'), self.hosts_text())
+        if FLAGS.use_single_default_gateway:
+            # NOTE(vish): this will have serious performance implications if
+            #             we are not in multi_host mode.
+            _write_dhcp_file(_dhcp_file(dev, 'opts'),
+                             self.opts_text(context))
+
+
+# The dhcp hosts last written for each device
+_dhcp_hosts = {}
+
+# The network of each device waiting for dnsmasq to be reloaded
+_dhcp_reloads = {}
+
+
+def _get_associated_fixed_ips(context, network_ref, address=None):
     host = None
     if network_ref['multi_host']:
         host = FLAGS.host
-    for data in db.network_get_associated_fixed_ips(context,
-                                                    network_ref['id'],
-                                                    host=host):
+    return db.network_get_associated_fixed_ips(context,
+                                               network_ref['id'],
+                                               host=host,
+                                               address=address)
+
+
+def _write_dhcp_file(path, data):
+    """Replace a dnsmasq file at once, so it is never read half written."""
+    tmp_path = '%s.tmp' % path
+    write_to_file(tmp_path, data)
+    # Make sure dnsmasq can actually read it (it setuid()s to "nobody")
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, path)
+
+
+def get_dhcp_leases(context, network_ref):
+    """Return a network's hosts config in dnsmasq leasefile format."""
+    hosts = []
+    for data in _get_associated_fixed_ips(context, network_ref):
         hosts.append(_host_lease(data))
     return '\n'.join(hosts)
 
 
 def get_dhcp_hosts(context, network_ref):
     """Get network's hosts config in dhcp-host format."""
-    hosts = []
-    host = None
-    if network_ref['multi_host']:
-        host = FLAGS.host
-    for data in db.network_get_associated_fixed_ips(context,
-                                                    network_ref['id'],
-                                                    host=host):
-        hosts.append(_host_dhcp(data))
-    return '\n'.join(hosts)
+    hosts = DhcpHosts()
+    hosts.load(_get_associated_fixed_ips(context, network_ref))
+    return hosts.hosts_text()
 
 
 def _add_dnsmasq_accept_rules(dev):
@@ -734,30 +1052,9 @@ def _add_dnsmasq_accept_rules(dev):
 
 def get_dhcp_opts(context, network_ref):
     """Get network's hosts config in dhcp-opts format."""
-    hosts = []
-    host = None
-    if network_ref['multi_host']:
-        host = FLAGS.host
-    data = db.network_get_associated_fixed_ips(context,
-                                               network_ref['id'],
-                                               host=host)
-
-    if data:
-        instance_set = set([datum['instance_uuid'] for datum in data])
-        default_gw_vif = {}
-        for instance_uuid in instance_set:
-            vifs = db.virtual_interface_get_by_instance(context,
-                                                        instance_uuid)
-            if vifs:
-                #offer a default gateway to the first virtual interface
-                default_gw_vif[instance_uuid] = vifs[0]['id']
-
-        for datum in data:
-            if instance_uuid in default_gw_vif:
-                # we don't want default gateway for this fixed ip
-                if default_gw_vif[instance_uuid] != datum['vif_id']:
-                    hosts.append(_host_dhcp_opts(datum))
-    return '\n'.join(hosts)
+    hosts = DhcpHosts()
+    hosts.load(_get_associated_fixed_ips(context, network_ref))
+    return hosts.opts_text(context)
 
 
 def release_dhcp(dev, address, mac_address):
@@ -765,11 +1062,66 @@ def release_dhcp(dev, address, mac_address):
 
 
 def update_dhcp(context, dev, network_ref):
-    conffile = _dhcp_file(dev, 'conf')
-    write_to_file(conffile, get_dhcp_hosts(context, network_ref))
+    """Rewrite all of the dhcp hosts of a network and (re)start dnsmasq."""
+    hosts = _dhcp_hosts.setdefault(dev, DhcpHosts())
+    hosts.load(_get_associated_fixed_ips(context, network_ref))
+    hosts.write(context, dev)
     restart_dhcp(context, dev, network_ref)
 
 
+def add_dhcp_host(context, dev, network_ref, address):
+    """Add the dhcp host of a fixed ip that has been allocated.
+
+    Only the fixed ip is looked up, the other hosts are the ones last
+    written for the network.
+    """
+    hosts = _dhcp_hosts.get(dev)
+    if hosts is None:
+        update_dhcp(context, dev, network_ref)
+        return
+    changed = False
+    for datum in _get_associated_fixed_ips(context, network_ref,
+                                           address=address):
+        changed = hosts.add(datum) or changed
+    if changed:
+        hosts.write(context, dev)
+        reload_dhcp(context, dev, network_ref)
+
+
+def remove_dhcp_host(context, dev, network_ref, address):
+    """Remove the dhcp host of a fixed ip that is being deallocated."""
+    hosts = _dhcp_hosts.get(dev)
+    if hosts is None:
+        update_dhcp(context, dev, network_ref)
+        return
+    if hosts.remove(address):
+        hosts.write(context, dev)
+        reload_dhcp(context, dev, network_ref)
+
+
+def reload_dhcp(context, dev, network_ref):
+    """Reload dnsmasq once the hosts changed within dhcp_reload_delay are.
+
+    The reload is run in a greenthread, unless dhcp_reload_delay is 0.
+    """
+    if FLAGS.dhcp_reload_delay <= 0:
+        restart_dhcp(context, dev, network_ref)
+        return
+    scheduled = dev in _dhcp_reloads
+    _dhcp_reloads[dev] = network_ref
+    if not scheduled:
+        greenthread.spawn_after(FLAGS.dhcp_reload_delay,
+                                _do_reload_dhcp, context, dev)
+
+
+def _do_reload_dhcp(context, dev):
+    network_ref = _dhcp_reloads.pop(dev)
+    try:
+        restart_dhcp(context, dev, network_ref)
+    except Exception:
+        LOG.exception(_('Error reloading dnsmasq for %s'), dev)
+
+
 def update_dhcp_hostfile_with_text(dev, hosts_text):
     conffile = _dhcp_file(dev, 'conf')
     write_to_file(conffile, hosts_text)
@@ -801,16 +1153,6 @@ def restart_dhcp(context, dev, network_ref):
     """
     conffile = _dhcp_file(dev, 'conf')
 
-    if FLAGS.use_single_default_gateway:
-        # NOTE(vish): this will have serious performance implications if we
-        #             are not in multi_host mode.
-        optsfile = _dhcp_file(dev, 'opts')
-        write_to_file(optsfile, get_dhcp_opts(context, network_ref))
-        os.chmod(optsfile, 0644)
-
-    # Make sure dnsmasq can actually read it (it setuid()s to "nobody")
-    os.chmod(conffile, 0644)
-
     pid = _dnsmasq_pid_for(dev)
 
     # if dnsmasq is already running, then tell it to reload
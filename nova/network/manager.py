@@ -892,53 +892,67 @@ class NetworkManager(manager.SchedulerDependentManager):
     @wrap_check_policy
     def get_instance_uuids_by_ip_filter(self, context, filters):
         fixed_ip_filter = filters.get('fixed_ip')
-        ip_filter = re.compile(str(filters.get('ip')))
-        ipv6_filter = re.compile(str(filters.get('ip6')))
+        ip_filter = None
+        if filters.get('ip') is not None:
+            ip_filter = re.compile(str(filters['ip']))
+        results = []
+
+        if fixed_ip_filter is not None or ip_filter is not None:
+            # NOTE: The database narrows the fixed ips down by address
+            #       prefix, the expression is then matched here.
+            fixed_ips = self.db.fixed_ip_get_by_ip_filter(context,
+                    fixed_ip=fixed_ip_filter,
+                    ip=ip_filter and ip_filter.pattern)
+            for fixed_ip in fixed_ips:
+                if fixed_ip['address'] == fixed_ip_filter:
+                    results.append({'instance_uuid': fixed_ip['instance_uuid'],
+                                    'ip': fixed_ip['address']})
+                    continue
+                if ip_filter is None:
+                    continue
+                if ip_filter.match(fixed_ip['address']):
+                    results.append({'instance_uuid': fixed_ip['instance_uuid'],
+                                    'ip': fixed_ip['address']})
+                    continue
+                for floating_address in fixed_ip['floating_ips']:
+                    if ip_filter.match(floating_address):
+                        results.append(
+                                {'instance_uuid': fixed_ip['instance_uuid'],
+                                 'ip': floating_address})
 
-        # NOTE(jkoelker) Should probably figure out a better way to do
-        #                this. But for now it "works", this could suck on
-        #                large installs.
+        if filters.get('ip6') is not None:
+            results.extend(self._get_instance_uuids_by_ipv6_filter(context,
+                    re.compile(str(filters['ip6']))))
 
+        return results
+
+    def _get_instance_uuids_by_ipv6_filter(self, context, ipv6_filter):
+        # NOTE: IPv6 addresses are derived from the network and the mac
+        #       address rather than stored, so every vif is checked. Each
+        #       network is only looked up once.
         vifs = self.db.virtual_interface_get_all(context)
+        networks = {}
         results = []
 
         for vif in vifs:
             if vif['instance_uuid'] is None:
                 continue
 
-            network = self._get_network_by_id(context, vif['network_id'])
-            fixed_ipv6 = None
-            if network['cidr_v6'] is not None:
-                fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
-                                            vif['address'],
-                                            context.project_id)
+            network_id = vif['network_id']
+            if network_id not in networks:
+                networks[network_id] = self._get_network_by_id(context,
+                                                               network_id)
+            network = networks[network_id]
+            if network['cidr_v6'] is None:
+                continue
 
-            if fixed_ipv6 and ipv6_filter.match(fixed_ipv6):
+            fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
+                                        vif['address'],
+                                        context.project_id)
+            if ipv6_filter.match(fixed_ipv6):
                 results.append({'instance_uuid': vif['instance_uuid'],
                                 'ip': fixed_ipv6})
 
-            vif_id = vif['id']
-            fixed_ips = self.db.fixed_ips_by_virtual_interface(context,
-                                                               vif_id)
-            for fixed_ip in fixed_ips:
-                if not fixed_ip or not fixed_ip['address']:
-                    continue
-                if fixed_ip['address'] == fixed_ip_filter:
-                    results.append({'instance_uuid': vif['instance_uuid'],
-                                    'ip': fixed_ip['address']})
-                    continue
-                if ip_filter.match(fixed_ip['address']):
-                    results.append({'instance_uuid': vif['instance_uuid'],
-                                    'ip': fixed_ip['address']})
-                    continue
-                for floating_ip in fixed_ip.get('floating_ips', []):
-                    if not floating_ip or not floating_ip['address']:
-                        continue
-                    if ip_filter.match(floating_ip['address']):
-                        results.append({'instance_uuid': vif['instance_uuid'],
-                                        'ip': floating_ip['address']})
-                        continue
-
         return results
 
     def _get_networks_for_instance(self, context, instance_id, project_id,
@@ -1281,7 +1295,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             self.instance_dns_manager.create_entry(uuid, address,
                                                    "A",
                                                    self.instance_dns_domain)
-        self._setup_network_on_host(context, network)
+        self._setup_network_on_host(context, network, address=address)
         return address
 
     def deallocate_fixed_ip(self, context, address, host=None):
@@ -1302,7 +1316,7 @@ class NetworkManager(manager.SchedulerDependentManager):
                                                       self.instance_dns_domain)
 
         network = self._get_network_by_id(context, fixed_ip_ref['network_id'])
-        self._teardown_network_on_host(context, network)
+        self._teardown_network_on_host(context, network, address=address)
 
         if FLAGS.force_dhcp_release:
             dev = self.driver.get_dev(network)
@@ -1677,12 +1691,19 @@ class NetworkManager(manager.SchedulerDependentManager):
         network = self.db.network_get(context, network_id)
         call_func(context, network)
 
-    def _setup_network_on_host(self, context, network):
-        """Sets up network on this host."""
+    def _setup_network_on_host(self, context, network, address=None):
+        """Sets up network on this host.
+
+        With address, only that fixed ip has been allocated since the
+        network was last set up.
+        """
         raise NotImplementedError()
 
-    def _teardown_network_on_host(self, context, network):
-        """Sets up network on this host."""
+    def _teardown_network_on_host(self, context, network, address=None):
+        """Sets up network on this host.
+
+        With address, only that fixed ip is being deallocated.
+        """
         raise NotImplementedError()
 
     @wrap_check_policy
@@ -1836,7 +1857,7 @@ class FlatManager(NetworkManager):
         super(FlatManager, self).deallocate_fixed_ip(context, address)
         self.db.fixed_ip_disassociate(context, address)
 
-    def _setup_network_on_host(self, context, network):
+    def _setup_network_on_host(self, context, network, address=None):
         """Setup Network on this host."""
         # NOTE(tr3buchet): this does not need to happen on every ip
         # allocation, this functionality makes more sense in create_network
@@ -1845,7 +1866,7 @@ class FlatManager(NetworkManager):
         net['injected'] = FLAGS.flat_injected
         self.db.network_update(context, network['id'], net)
 
-    def _teardown_network_on_host(self, context, network):
+    def _teardown_network_on_host(self, context, network, address=None):
         """Tear down network on this host."""
         pass
 
@@ -1900,7 +1921,7 @@ class FlatDHCPManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
         super(FlatDHCPManager, self).init_host()
         self.init_host_floating_ips()
 
-    def _setup_network_on_host(self, context, network):
+    def _setup_network_on_host(self, context, network, address=None):
         """Sets up network on this host."""
         network['dhcp_server'] = self._get_dhcp_ip(context, network)
 
@@ -1908,18 +1929,24 @@ class FlatDHCPManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
 
         if not FLAGS.fake_network:
             dev = self.driver.get_dev(network)
-            self.driver.update_dhcp(context, dev, network)
+            if address:
+                self.driver.add_dhcp_host(context, dev, network, address)
+            else:
+                self.driver.update_dhcp(context, dev, network)
             if(FLAGS.use_ipv6):
                 self.driver.update_ra(context, dev, network)
                 gateway = utils.get_my_linklocal(dev)
                 self.db.network_update(context, network['id'],
                                        {'gateway_v6': gateway})
 
-    def _teardown_network_on_host(self, context, network):
+    def _teardown_network_on_host(self, context, network, address=None):
         if not FLAGS.fake_network:
             network['dhcp_server'] = self._get_dhcp_ip(context, network)
             dev = self.driver.get_dev(network)
-            self.driver.update_dhcp(context, dev, network)
+            if address:
+                self.driver.remove_dhcp_host(context, dev, network, address)
+            else:
+                self.driver.update_dhcp(context, dev, network)
 
     def _get_network_dict(self, network):
         """Returns the dict representing necessary and meta network fields"""
@@ -1996,7 +2023,7 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
         values = {'allocated': True,
                   'virtual_interface_id': vif['id']}
         self.db.fixed_ip_update(context, address, values)
-        self._setup_network_on_host(context, network)
+        self._setup_network_on_host(context, network, address=address)
         return address
 
     @wrap_check_policy
@@ -2054,7 +2081,7 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
         return NetworkManager.create_networks(
             self, context, vpn=True, **kwargs)
 
-    def _setup_network_on_host(self, context, network):
+    def _setup_network_on_host(self, context, network, address=None):
         """Sets up network on this host."""
         if not network['vpn_public_address']:
             net = {}
@@ -2076,18 +2103,24 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
                     network['vpn_private_address'])
         if not FLAGS.fake_network:
             dev = self.driver.get_dev(network)
-            self.driver.update_dhcp(context, dev, network)
+            if address:
+                self.driver.add_dhcp_host(context, dev, network, address)
+            else:
+                self.driver.update_dhcp(context, dev, network)
             if(FLAGS.use_ipv6):
                 self.driver.update_ra(context, dev, network)
                 gateway = utils.get_my_linklocal(dev)
                 self.db.network_update(context, network['id'],
                                        {'gateway_v6': gateway})
 
-    def _teardown_network_on_host(self, context, network):
+    def _teardown_network_on_host(self, context, network, address=None):
         if not FLAGS.fake_network:
             network['dhcp_server'] = self._get_dhcp_ip(context, network)
             dev = self.driver.get_dev(network)
-            self.driver.update_dhcp(context, dev, network)
+            if address:
+                self.driver.remove_dhcp_host(context, dev, network, address)
+            else:
+                self.driver.update_dhcp(context, dev, network)
 
     def _get_network_dict(self, network):
         """Returns the dict representing necessary and meta network fields"""
@@ -83,6 +83,10 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default='nova.quota.DbQuotaDriver',
                help='default driver to use for quota checks'),
+    cfg.IntOpt('quota_cache_ttl',
+               default=30,
+               help='number of seconds quota limits are cached by the '
+                    'CachedDbQuotaDriver'),
     ]
 
 FLAGS = flags.FLAGS
@@ -170,7 +174,7 @@ class DbQuotaDriver(object):
         project_quotas = db.quota_get_all_by_project(context, project_id)
         if usages:
             project_usages = db.quota_usage_get_all_by_project(context,
-                                                               project_id)
+                    project_id, use_slave=True)
 
         # Get the quotas for the appropriate class.  If the project ID
         # matches the one in the context, we use the quota_class from
@@ -235,7 +239,20 @@ class DbQuotaDriver(object):
             raise exception.QuotaResourceUnknown(unknown=sorted(unknown))
 
         # Grab and return the quotas (without usages)
-        quotas = self.get_project_quotas(context, sub_resources,
+        limits = self._get_limits(context, sub_resources)
+
+        return dict((k, limits[k]) for k in sub_resources)
+
+    def _get_limits(self, context, resources):
+        """
+        Retrieve the quota limits of the given resources which apply
+        to the current context.
+
+        :param context: The request context, for access checks.
+        :param resources: A dictionary of the resources.
+        """
+
+        quotas = self.get_project_quotas(context, resources,
                                          context.project_id,
                                          context.quota_class, usages=False)
 
@@ -334,6 +351,12 @@ class DbQuotaDriver(object):
         #            which means access to the session.  Since the
         #            session isn't available outside the DBAPI, we
         #            have to do the work there.
+        return self._quota_reserve(context, resources, quotas, deltas,
+                                   expire)
+
+    def _quota_reserve(self, context, resources, quotas, deltas, expire):
+        """Create the reservations in the database."""
+
         return db.quota_reserve(context, resources, quotas, deltas, expire,
                                 FLAGS.until_refresh, FLAGS.max_age)
 
@@ -379,6 +402,97 @@ class DbQuotaDriver(object):
 
         db.reservation_expire(context)
 
+    def invalidate(self, context, project_id=None, quota_class=None):
+        """Forget any cached quota limits.
+
+        This driver does not cache limits.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class which changed.
+        """
+
+        pass
+
+
+class CachedDbQuotaDriver(DbQuotaDriver):
+    """
+    Driver caching the quota limits of each project, and reserving
+    resources with guarded updates of the usages instead of locking
+    all the usages of the project.
+
+    Limits are cached for --quota_cache_ttl seconds.  Changes made
+    through the quota extensions are seen at once by the process
+    making them, other processes see them when their cache expires.
+    """
+
+    def __init__(self):
+        self._limits = {}
+
+    def _get_limits(self, context, resources):
+        """
+        Retrieve the quota limits of the given resources which apply
+        to the current context, from the cache if they are fresh.
+
+        :param context: The request context, for access checks.
+        :param resources: A dictionary of the resources.
+        """
+
+        key = (context.project_id, context.quota_class)
+        now = timeutils.utcnow()
+        expires, limits = self._limits.get(key, (now, {}))
+        if expires <= now:
+            expires = now + datetime.timedelta(seconds=FLAGS.quota_cache_ttl)
+            limits = {}
+        missing = dict((k, v) for k, v in resources.items()
+                       if k not in limits)
+        if missing:
+            limits = dict(limits)
+            limits.update(super(CachedDbQuotaDriver, self)._get_limits(
+                    context, missing))
+            self._limits[key] = (expires, limits)
+
+        return limits
+
+    def _quota_reserve(self, context, resources, quotas, deltas, expire):
+        """Create the reservations by guarded usage updates."""
+
+        return db.quota_reserve_delta(context, resources, quotas, deltas,
+                                      expire, FLAGS.until_refresh,
+                                      FLAGS.max_age)
+
+    def destroy_all_by_project(self, context, project_id):
+        """
+        Destroy all quotas, usages, and reservations associated with a
+        project.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project being deleted.
+        """
+
+        super(CachedDbQuotaDriver, self).destroy_all_by_project(context,
+                                                                project_id)
+        self.invalidate(context, project_id=project_id)
+
+    def invalidate(self, context, project_id=None, quota_class=None):
+        """Forget cached quota limits.
+
+        Without a project ID or quota class, all limits are forgotten.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class which changed.
+        """
+
+        if project_id is None and quota_class is None:
+            self._limits.clear()
+            return
+
+        for key in self._limits.keys():
+            if key[0] == project_id or (quota_class is not None and
+                                        key[1] == quota_class):
+                del self._limits[key]
+
 
 class BaseResource(object):
     """Describe a single resource for quota checking."""
@@ -756,6 +870,17 @@ class QuotaEngine(object):
 
         self._driver.expire(context)
 
+    def invalidate(self, context, project_id=None, quota_class=None):
+        """Forget quota limits cached by the driver.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class which changed.
+        """
+
+        self._driver.invalidate(context, project_id=project_id,
+                                quota_class=quota_class)
+
     @property
     def resources(self):
         return sorted(self._resources.keys())
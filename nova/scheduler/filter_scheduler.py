@@ -19,19 +19,43 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
 import operator
 
 from nova import exception
 from nova import flags
+from nova.openstack.common import cfg
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova.openstack.common.notifier import api as notifier
 from nova.scheduler import driver
+from nova.scheduler import host_columns
 from nova.scheduler import least_cost
 from nova.scheduler import scheduler_options
 
 
+filter_scheduler_opts = [
+    cfg.BoolOpt('scheduler_batch_placement',
+                default=False,
+                help='Filter and weigh the hosts only once for requests '
+                     'of several instances, and afterwards re-evaluate '
+                     'only the host chosen for the previous instance. '
+                     'This assumes host filters and cost functions '
+                     'only depend on the host being evaluated.'),
+    cfg.BoolOpt('scheduler_claim_resources',
+                default=False,
+                help='Claim the resources of each selected instance on the '
+                     'compute node record, so that concurrent schedulers '
+                     'notice each other\'s placements when selecting '
+                     'hosts rather than at the compute host.'),
+    cfg.IntOpt('scheduler_max_claim_conflicts',
+               default=10,
+               help='Number of resource claim conflicts tolerated for a '
+                    'request before hosts are selected without claiming'),
+    ]
+
 FLAGS = flags.FLAGS
+FLAGS.register_opts(filter_scheduler_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -259,12 +283,23 @@ class FilterScheduler(driver.Scheduler):
         # are being scanned in a filter or weighing function.
         hosts = unfiltered_hosts_dict.itervalues()
 
-        selected_hosts = []
         if instance_uuids:
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
-        for num in xrange(num_instances):
+
+        if FLAGS.scheduler_batch_placement and num_instances > 1:
+            return self._schedule_batch(elevated, hosts, num_instances,
+                    cost_functions, filter_properties, instance_properties)
+
+        if self.host_manager.use_host_columns():
+            return self._schedule_host_columns(elevated, hosts,
+                    num_instances, cost_functions, filter_properties,
+                    instance_properties)
+
+        selected_hosts = []
+        num_conflicts = 0
+        while len(selected_hosts) < num_instances:
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.filter_hosts(hosts,
                     filter_properties)
@@ -283,6 +318,10 @@ class FilterScheduler(driver.Scheduler):
             weighted_host = least_cost.weighted_sum(cost_functions,
                     hosts, filter_properties)
             LOG.debug(_("Weighted %(weighted_host)s") % locals())
+            if not self._claim_resources(elevated, weighted_host.host_state,
+                    instance_properties, num_conflicts):
+                num_conflicts += 1
+                continue
             selected_hosts.append(weighted_host)
 
             # Now consume the resources so the filter/weights
@@ -293,6 +332,115 @@ class FilterScheduler(driver.Scheduler):
         selected_hosts.sort(key=operator.attrgetter('weight'))
         return selected_hosts
 
+    def _claim_resources(self, context, host_state, instance_properties,
+                         num_conflicts):
+        """Claim the instance resources on the chosen host if
+        scheduler_claim_resources is set.
+
+        Returns False if another scheduler changed the host since it was
+        read.  The host state has then been refreshed and the host needs
+        to be filtered and weighed again.
+        """
+        if not FLAGS.scheduler_claim_resources:
+            return True
+        if num_conflicts >= FLAGS.scheduler_max_claim_conflicts:
+            # Leave conflicts to the compute host claim and rescheduling.
+            return True
+        return self.host_manager.claim_resources(context, host_state,
+                                                 instance_properties)
+
+    def _schedule_host_columns(self, context, hosts, num_instances,
+                               cost_functions, filter_properties,
+                               instance_properties):
+        """Same as the selection loop of _schedule(), but filtering and
+        weighing all hosts at once with array operations.
+        """
+        columns = host_columns.HostColumns(hosts)
+
+        selected_hosts = []
+        num_conflicts = 0
+        while len(selected_hosts) < num_instances:
+            columns = self.host_manager.filter_host_columns(columns,
+                    filter_properties)
+            if not len(columns):
+                # Can't get any more locally.
+                break
+
+            weighted_host = least_cost.weighted_sum_columns(cost_functions,
+                    columns, filter_properties)
+            LOG.debug(_("Weighted %(weighted_host)s") % locals())
+            if not self._claim_resources(context, weighted_host.host_state,
+                    instance_properties, num_conflicts):
+                num_conflicts += 1
+                columns.update_row(weighted_host.host_state)
+                continue
+            selected_hosts.append(weighted_host)
+
+            # Now consume the resources so the filter/weights
+            # will change for the next instance.
+            columns.consume_from_instance(weighted_host.host_state,
+                    instance_properties)
+
+        selected_hosts.sort(key=operator.attrgetter('weight'))
+        return selected_hosts
+
+    def _schedule_batch(self, context, hosts, num_instances, cost_functions,
+                        filter_properties, instance_properties):
+        """Select hosts for several instances, filtering and weighing
+        all hosts only once.
+
+        The weighed hosts are kept in a heap.  Once a host is chosen and
+        resources are consumed from it, only that host is filtered and
+        weighed again before going back into the heap, since no other
+        host changed.  Ties are broken by the original host order, so the
+        result is the same as re-filtering every host for each instance.
+        """
+        if self.host_manager.use_host_columns():
+            columns = self.host_manager.filter_host_columns(
+                    host_columns.HostColumns(hosts), filter_properties)
+            scores = least_cost.weigh_host_columns(cost_functions, columns,
+                    filter_properties)
+            heap = [(float(score), i, host_state) for i, (score, host_state)
+                    in enumerate(zip(scores, columns.host_states))]
+        else:
+            hosts = self.host_manager.filter_hosts(hosts, filter_properties)
+            heap = [(least_cost.weigh_host(cost_functions, host_state,
+                                           filter_properties), i, host_state)
+                    for i, host_state in enumerate(hosts)]
+        heapq.heapify(heap)
+        LOG.debug(_("Filtered %(num_hosts)d hosts for %(num_instances)d "
+                    "instances"), {'num_hosts': len(heap),
+                                   'num_instances': num_instances})
+
+        selected_hosts = []
+        num_conflicts = 0
+        while len(selected_hosts) < num_instances:
+            if not heap:
+                # Can't get any more locally.
+                break
+
+            weight, i, host_state = heapq.heappop(heap)
+            weighted_host = least_cost.WeightedHost(weight,
+                    host_state=host_state)
+            LOG.debug(_("Weighted %(weighted_host)s") % locals())
+            if self._claim_resources(context, host_state,
+                                     instance_properties, num_conflicts):
+                selected_hosts.append(weighted_host)
+                # Now consume the resources and check whether the host
+                # can take another instance.
+                host_state.consume_from_instance(instance_properties)
+            else:
+                num_conflicts += 1
+
+            if self.host_manager.filter_hosts([host_state],
+                                              filter_properties):
+                weight = least_cost.weigh_host(cost_functions, host_state,
+                                               filter_properties)
+                heapq.heappush(heap, (weight, i, host_state))
+
+        selected_hosts.sort(key=operator.attrgetter('weight'))
+        return selected_hosts
+
     def get_cost_functions(self, topic=None):
         """Returns a list of tuples containing weights and cost functions to
         use for weighing hosts
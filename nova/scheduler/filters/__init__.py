@@ -25,7 +25,13 @@ from nova.openstack.common import importutils
 
 
 class BaseHostFilter(object):
-    """Base class for host filters."""
+    """Base class for host filters.
+
+    Filters may also implement filter_columns(host_columns,
+    filter_properties), which takes a nova.scheduler.host_columns.HostColumns
+    and returns a boolean mask of the passing hosts.  It is used instead of
+    host_passes() when the scheduler filters hosts in columnar form.
+    """
 
     def host_passes(self, host_state, filter_properties):
         raise NotImplementedError()
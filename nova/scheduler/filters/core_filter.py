@@ -54,3 +54,27 @@ class CoreFilter(filters.BaseHostFilter):
             host_state.limits['vcpu'] = vcpus_total
 
         return (vcpus_total - host_state.vcpus_used) >= instance_vcpus
+
+    def filter_columns(self, host_columns, filter_properties):
+        """Return a mask of the hosts with sufficient CPU cores.
+
+        Host columns are only built for compute hosts, so the topic
+        check done by host_passes() is not needed here.
+        """
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return host_columns.all_hosts()
+
+        unset = host_columns.vcpus_total == 0
+        if unset.any():
+            # Fail safe
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+
+        instance_vcpus = instance_type['vcpus']
+        vcpus_total = host_columns.vcpus_total * FLAGS.cpu_allocation_ratio
+
+        for i, host_state in host_columns.selected(vcpus_total > 0):
+            host_state.limits['vcpu'] = float(vcpus_total[i])
+
+        passes = (vcpus_total - host_columns.vcpus_used) >= instance_vcpus
+        return passes | unset
@@ -52,3 +52,21 @@ class DiskFilter(filters.BaseHostFilter):
         disk_gb_limit = disk_mb_limit / 1024
         host_state.limits['disk_gb'] = disk_gb_limit
         return True
+
+    def filter_columns(self, host_columns, filter_properties):
+        """Return a mask of the hosts with sufficient usable disk."""
+        instance_type = filter_properties.get('instance_type')
+        requested_disk = 1024 * (instance_type['root_gb'] +
+                                 instance_type['ephemeral_gb'])
+
+        free_disk_mb = host_columns.free_disk_mb
+        total_usable_disk_mb = host_columns.total_usable_disk_gb * 1024
+
+        disk_mb_limit = total_usable_disk_mb * FLAGS.disk_allocation_ratio
+        used_disk_mb = total_usable_disk_mb - free_disk_mb
+        usable_disk_mb = disk_mb_limit - used_disk_mb
+        passes = usable_disk_mb >= requested_disk
+
+        for i, host_state in host_columns.selected(passes):
+            host_state.limits['disk_gb'] = float(disk_mb_limit[i] / 1024)
+        return passes
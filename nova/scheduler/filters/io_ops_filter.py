@@ -42,3 +42,7 @@ class IoOpsFilter(filters.BaseHostFilter):
             LOG.debug(_("%(host_state)s fails I/O ops check: Max IOs per host "
                         "is set to %(max_io_ops)s"), locals())
         return passes
+
+    def filter_columns(self, host_columns, filter_properties):
+        """Return a mask of the hosts under the I/O operations limit."""
+        return host_columns.num_io_ops < FLAGS.max_io_ops_per_host
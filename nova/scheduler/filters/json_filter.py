@@ -20,10 +20,17 @@ from nova.openstack.common import jsonutils
 from nova.scheduler import filters
 
 
+# Number of compiled queries kept by JsonFilter
+MAX_COMPILED_QUERIES = 100
+
+
 class JsonFilter(filters.BaseHostFilter):
     """Host Filter to allow simple JSON-based grammar for
     selecting hosts.
     """
+    # Compiled queries by query string, shared by all instances
+    _compiled_queries = {}
+
     def _op_compare(self, args, op):
         """Returns True if the specified operator can successfully
         compare the first item in the args with all the rest. Will
@@ -86,11 +93,14 @@ class JsonFilter(filters.BaseHostFilter):
         'and': _and,
     }
 
-    def _parse_string(self, string, host_state):
+    def _compile_string(self, string):
         """Strings prefixed with $ are capability lookups in the
         form '$variable' where 'variable' is an attribute in the
         HostState class.  If $variable is a dictionary, you may
         use: $variable.dictkey
+
+        Returns a function of the host state for lookups, the string
+        itself otherwise, or None for empty strings.
         """
         if not string:
             return None
@@ -98,31 +108,58 @@ class JsonFilter(filters.BaseHostFilter):
             return string
 
         path = string[1:].split(".")
-        obj = getattr(host_state, path[0], None)
-        if obj is None:
-            return None
-        for item in path[1:]:
-            obj = obj.get(item, None)
+
+        def lookup(host_state):
+            obj = getattr(host_state, path[0], None)
             if obj is None:
                 return None
-        return obj
-
-    def _process_filter(self, query, host_state):
-        """Recursively parse the query structure."""
+            for item in path[1:]:
+                obj = obj.get(item, None)
+                if obj is None:
+                    return None
+            return obj
+        return lookup
+
+    def _compile_filter(self, query):
+        """Recursively compile the query structure into a function
+        of the host state.
+        """
         if not query:
-            return True
+            return lambda host_state: True
         cmd = query[0]
         method = self.commands[cmd]
-        cooked_args = []
+        # (is_lookup, value) pairs, arguments that are None are dropped
+        args = []
         for arg in query[1:]:
             if isinstance(arg, list):
-                arg = self._process_filter(arg, host_state)
+                arg = self._compile_filter(arg)
             elif isinstance(arg, basestring):
-                arg = self._parse_string(arg, host_state)
+                arg = self._compile_string(arg)
             if arg is not None:
+                args.append((callable(arg), arg))
+
+        def process_filter(host_state):
+            cooked_args = []
+            for is_lookup, arg in args:
+                if is_lookup:
+                    arg = arg(host_state)
+                    if arg is None:
+                        continue
                 cooked_args.append(arg)
-        result = method(self, cooked_args)
-        return result
+            return method(self, cooked_args)
+        return process_filter
+
+    def _get_compiled_query(self, query):
+        """Return the compiled function for a query string, compiling
+        it on first use.
+        """
+        compiled = self._compiled_queries.get(query)
+        if compiled is None:
+            if len(self._compiled_queries) >= MAX_COMPILED_QUERIES:
+                self._compiled_queries.clear()
+            compiled = self._compile_filter(jsonutils.loads(query))
+            self._compiled_queries[query] = compiled
+        return compiled
 
     def host_passes(self, host_state, filter_properties):
         """Return a list of hosts that can fulfill the requirements
@@ -138,7 +175,7 @@ class JsonFilter(filters.BaseHostFilter):
         # NOTE(comstud): Not checking capabilities or service for
         # enabled/disabled so that a provided json filter can decide
 
-        result = self._process_filter(jsonutils.loads(query), host_state)
+        result = self._get_compiled_query(query)(host_state)
         if isinstance(result, list):
             # If any succeeded, include the host
             result = any(result)
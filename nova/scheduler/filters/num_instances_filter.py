@@ -40,3 +40,7 @@ class NumInstancesFilter(filters.BaseHostFilter):
                         "instances per host is set to %(max_instances)s"),
                         locals())
         return passes
+
+    def filter_columns(self, host_columns, filter_properties):
+        """Return a mask of the hosts under the instance limit."""
+        return host_columns.num_instances < FLAGS.max_instances_per_host
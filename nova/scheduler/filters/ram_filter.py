@@ -51,3 +51,19 @@ class RamFilter(filters.BaseHostFilter):
         # save oversubscription limit for compute node to test against:
         host_state.limits['memory_mb'] = memory_mb_limit
         return True
+
+    def filter_columns(self, host_columns, filter_properties):
+        """Return a mask of the hosts with sufficient available RAM."""
+        instance_type = filter_properties.get('instance_type')
+        requested_ram = instance_type['memory_mb']
+        free_ram_mb = host_columns.free_ram_mb
+        total_usable_ram_mb = host_columns.total_usable_ram_mb
+
+        memory_mb_limit = total_usable_ram_mb * FLAGS.ram_allocation_ratio
+        used_ram_mb = total_usable_ram_mb - free_ram_mb
+        usable_ram = memory_mb_limit - used_ram_mb
+        passes = usable_ram >= requested_ram
+
+        for i, host_state in host_columns.selected(passes):
+            host_state.limits['memory_mb'] = float(memory_mb_limit[i])
+        return passes
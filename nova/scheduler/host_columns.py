@@ -0,0 +1,112 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Columnar view of host states, used to filter and weigh large numbers of
+hosts with array operations instead of per host Python calls.
+
+numpy is optional; when it is not installed, is_available() returns False
+and the scheduler keeps using the per host code paths.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# HostState attributes that are tracked as columns
+COLUMNS = ('free_ram_mb', 'total_usable_ram_mb', 'free_disk_mb',
+           'total_usable_disk_gb', 'vcpus_total', 'vcpus_used',
+           'num_io_ops', 'num_instances')
+
+
+def is_available():
+    """Return whether columnar filtering can be used."""
+    return numpy is not None
+
+
+class HostColumns(object):
+    """A list of HostStates along with one array per tracked attribute.
+
+    Row i of every array describes host_states[i].
+    """
+
+    def __init__(self, host_states, columns=None):
+        self.host_states = list(host_states)
+        self._positions = None
+        if columns is not None:
+            self.columns = columns
+            return
+        self.columns = {}
+        for name in COLUMNS:
+            self.columns[name] = numpy.array(
+                    [getattr(host_state, name, 0) or 0
+                     for host_state in self.host_states],
+                    dtype=numpy.float64)
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['columns'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def all_hosts(self):
+        """Return a mask that selects every host."""
+        return numpy.ones(len(self.host_states), dtype=bool)
+
+    def mask_from(self, predicate):
+        """Return a mask of the hosts for which predicate is true."""
+        return numpy.fromiter((bool(predicate(host_state))
+                               for host_state in self.host_states),
+                              dtype=bool, count=len(self.host_states))
+
+    def host_mask(self, hosts):
+        """Return a mask selecting the hosts named in hosts."""
+        hosts = set(hosts)
+        return self.mask_from(lambda host_state: host_state.host in hosts)
+
+    def subset(self, mask):
+        """Return a new HostColumns with only the rows selected by mask."""
+        indexes = numpy.flatnonzero(mask)
+        host_states = [self.host_states[i] for i in indexes]
+        columns = dict((name, column[indexes])
+                       for name, column in self.columns.iteritems())
+        return HostColumns(host_states, columns=columns)
+
+    def selected(self, mask):
+        """Return (index, host_state) pairs for the rows selected by mask."""
+        return [(i, self.host_states[i]) for i in numpy.flatnonzero(mask)]
+
+    def position(self, host_state):
+        """Return the row of host_state."""
+        if self._positions is None:
+            self._positions = dict((id(hs), i)
+                                   for i, hs in enumerate(self.host_states))
+        return self._positions[id(host_state)]
+
+    def update_row(self, host_state):
+        """Refresh the row of host_state from its attributes."""
+        i = self.position(host_state)
+        for name, column in self.columns.iteritems():
+            column[i] = getattr(host_state, name, 0) or 0
+
+    def consume_from_instance(self, host_state, instance):
+        """Consume instance resources on host_state and refresh its row."""
+        host_state.consume_from_instance(instance)
+        self.update_row(host_state)
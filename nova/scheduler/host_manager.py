@@ -17,6 +17,7 @@
 Manage hosts in the current zone.
 """
 
+import datetime
 import UserDict
 
 from nova.compute import task_states
@@ -28,6 +29,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.scheduler import filters
+from nova.scheduler import host_columns
 
 host_manager_opts = [
     cfg.MultiStrOpt('scheduler_available_filters',
@@ -47,6 +49,25 @@ host_manager_opts = [
                   ],
                 help='Which filter class names to use for filtering hosts '
                       'when not specified in the request.'),
+    cfg.BoolOpt('scheduler_use_host_columns',
+                default=False,
+                help='Filter and weigh hosts with array operations over '
+                     'columns of host state. Requires numpy.'),
+    cfg.IntOpt('scheduler_host_state_refresh_interval',
+               default=5,
+               help='Number of seconds the CachingHostManager may serve '
+                    'cached host states before fetching the compute nodes '
+                    'that changed since its last refresh'),
+    cfg.IntOpt('scheduler_host_state_resync_interval',
+               default=300,
+               help='Number of seconds between full resyncs of the '
+                    'CachingHostManager host state cache'),
+    cfg.IntOpt('scheduler_host_state_refresh_margin',
+               default=5,
+               help='Number of seconds each incremental refresh of the '
+                    'CachingHostManager looks back before its previous '
+                    'refresh, for compute nodes whose clocks lag or whose '
+                    'updates committed late'),
     ]
 
 FLAGS = flags.FLAGS
@@ -96,15 +117,8 @@ class HostState(object):
     def __init__(self, host, topic, capabilities=None, service=None):
         self.host = host
         self.topic = topic
+        self.update_capabilities(capabilities, service)
 
-        # Read-only capability dicts
-
-        if capabilities is None:
-            capabilities = {}
-        self.capabilities = ReadOnlyDict(capabilities.get(topic, None))
-        if service is None:
-            service = {}
-        self.service = ReadOnlyDict(service)
         # Mutable available resources.
         # These will change as resources are virtually "consumed".
         self.total_usable_disk_gb = 0
@@ -113,11 +127,6 @@ class HostState(object):
         self.free_disk_mb = 0
         self.vcpus_total = 0
         self.vcpus_used = 0
-        # Valid vm types on this host: 'pv', 'hvm' or 'all'
-        if 'allowed_vm_type' in self.capabilities:
-            self.allowed_vm_type = self.capabilities['allowed_vm_type']
-        else:
-            self.allowed_vm_type = 'all'
 
         # Additional host information from the compute node stats:
         self.vm_states = {}
@@ -130,8 +139,36 @@ class HostState(object):
         # Resource oversubscription values for the compute host:
         self.limits = {}
 
+        # Last update time of the compute_node this state was built from
+        self.updated_at = None
+
+        # The compute_node id and resource values last read from or
+        # claimed in the database, used to detect concurrent changes
+        # when claiming resources.
+        self.compute_node_id = None
+        self.claim_baseline = None
+
+    def update_capabilities(self, capabilities=None, service=None):
+        """Update the read-only capability and service dicts."""
+        if capabilities is None:
+            capabilities = {}
+        self.capabilities = ReadOnlyDict(capabilities.get(self.topic, None))
+        if service is None:
+            service = {}
+        self.service = ReadOnlyDict(service)
+        # Valid vm types on this host: 'pv', 'hvm' or 'all'
+        if 'allowed_vm_type' in self.capabilities:
+            self.allowed_vm_type = self.capabilities['allowed_vm_type']
+        else:
+            self.allowed_vm_type = 'all'
+
     def update_from_compute_node(self, compute):
         """Update information about a host from its compute_node info."""
+        self.updated_at = compute.get('updated_at')
+        self.compute_node_id = compute.get('id')
+        self.claim_baseline = dict(free_ram_mb=compute['free_ram_mb'],
+                                   free_disk_gb=compute.get('free_disk_gb'),
+                                   vcpus_used=compute['vcpus_used'])
         all_ram_mb = compute['memory_mb']
 
         # Assume virtual size is all consumed by instances if use qcow2 disk.
@@ -152,6 +189,13 @@ class HostState(object):
         stats = compute.get('stats', [])
         statmap = self._statmap(stats)
 
+        # Forget anything previously consumed, the compute node
+        # info is authoritative.
+        self.vm_states = {}
+        self.task_states = {}
+        self.num_instances_by_project = {}
+        self.num_instances_by_os_type = {}
+
         # Track number of instances on host
         self.num_instances = int(statmap.get('num_instances', 0))
 
@@ -273,11 +317,11 @@ class HostManager(object):
         self.filter_classes = filters.get_filter_classes(
                 FLAGS.scheduler_available_filters)
 
-    def _choose_host_filters(self, filters):
+    def _choose_host_filter_objects(self, filters):
         """Since the caller may specify which filters to use we need
         to have an authoritative list of what is permissible. This
         function checks the filter names against a predefined set
-        of acceptable filters.
+        of acceptable filters and returns instances of them.
         """
         if filters is None:
             filters = FLAGS.scheduler_default_filters
@@ -290,12 +334,7 @@ class HostManager(object):
             for cls in self.filter_classes:
                 if cls.__name__ == filter_name:
                     found_class = True
-                    filter_instance = cls()
-                    # Get the filter function
-                    filter_func = getattr(filter_instance,
-                            'host_passes', None)
-                    if filter_func:
-                        good_filters.append(filter_func)
+                    good_filters.append(cls())
                     break
             if not found_class:
                 bad_filters.append(filter_name)
@@ -304,6 +343,21 @@ class HostManager(object):
             raise exception.SchedulerHostFilterNotFound(filter_name=msg)
         return good_filters
 
+    def _choose_host_filters(self, filters):
+        """Return the host_passes functions of the filters to use."""
+        good_filters = []
+        for filter_instance in self._choose_host_filter_objects(filters):
+            # Get the filter function
+            filter_func = getattr(filter_instance, 'host_passes', None)
+            if filter_func:
+                good_filters.append(filter_func)
+        return good_filters
+
+    def use_host_columns(self):
+        """Return whether hosts should be filtered in columnar form."""
+        return (FLAGS.scheduler_use_host_columns and
+                host_columns.is_available())
+
     def filter_hosts(self, hosts, filter_properties, filters=None):
         """Filter hosts and return only ones passing all filters"""
         filtered_hosts = []
@@ -313,6 +367,83 @@ class HostManager(object):
                 filtered_hosts.append(host)
         return filtered_hosts
 
+    def filter_host_columns(self, columns, filter_properties, filters=None):
+        """Filter a HostColumns and return a HostColumns of only the
+        hosts passing all filters.
+
+        Filters implementing filter_columns() are applied to all hosts at
+        once, the remaining filters are run per host on the survivors.
+        """
+        mask = columns.all_hosts()
+        ignore_hosts = filter_properties.get('ignore_hosts', [])
+        if ignore_hosts:
+            mask &= ~columns.host_mask(ignore_hosts)
+
+        force_hosts = filter_properties.get('force_hosts', [])
+        if force_hosts:
+            return columns.subset(mask & columns.host_mask(force_hosts))
+
+        filter_fns = []
+        for filter_instance in self._choose_host_filter_objects(filters):
+            filter_columns = getattr(filter_instance, 'filter_columns', None)
+            if filter_columns:
+                mask &= filter_columns(columns, filter_properties)
+                continue
+            filter_func = getattr(filter_instance, 'host_passes', None)
+            if filter_func:
+                filter_fns.append(filter_func)
+
+        columns = columns.subset(mask)
+        if filter_fns:
+            mask = columns.mask_from(lambda host_state: all(
+                    filter_fn(host_state, filter_properties)
+                    for filter_fn in filter_fns))
+            columns = columns.subset(mask)
+        LOG.debug(_("%(num_hosts)d hosts passed column filters"),
+                  {'num_hosts': len(columns)})
+        return columns
+
+    def claim_resources(self, context, host_state, instance):
+        """Claim the resources of an instance on the compute node of
+        host_state in the database.
+
+        The claim fails if the compute node changed since host_state was
+        read, e.g. because another scheduler placed an instance on it.
+        host_state is then refreshed from the database.
+
+        :returns: True if the resources were claimed, False on conflict.
+        """
+        baseline = host_state.claim_baseline
+        if baseline is None:
+            # Not built from a compute node, nothing to claim against.
+            return True
+
+        memory_mb = instance['memory_mb']
+        disk_gb = instance['root_gb'] + instance['ephemeral_gb']
+        vcpus = instance['vcpus']
+        if db.compute_node_claim_resources(context,
+                host_state.compute_node_id, baseline,
+                memory_mb, disk_gb, vcpus):
+            free_disk_gb = baseline['free_disk_gb']
+            if free_disk_gb is not None:
+                free_disk_gb -= disk_gb
+            host_state.claim_baseline = dict(
+                    free_ram_mb=baseline['free_ram_mb'] - memory_mb,
+                    free_disk_gb=free_disk_gb,
+                    vcpus_used=baseline['vcpus_used'] + vcpus)
+            return True
+
+        LOG.debug(_("Resource claim conflict on %(host)s, refreshing its "
+                    "state"), {'host': host_state.host})
+        try:
+            compute = db.compute_node_get(context, host_state.compute_node_id)
+        except exception.ComputeHostNotFound:
+            LOG.warn(_("Compute node for %(host)s is gone"),
+                     {'host': host_state.host})
+            return False
+        host_state.update_from_compute_node(compute)
+        return False
+
     def update_service_capabilities(self, service_name, host, capabilities):
         """Update the per-service capabilities based on this notification."""
         LOG.debug(_("Received %(service_name)s service update from "
@@ -359,3 +490,119 @@ class HostManager(object):
             host_state_map[host] = host_state
 
         return host_state_map
+
+
+class CachingHostManager(HostManager):
+    """HostManager that keeps HostStates between scheduling requests.
+
+    Rather than rebuilding every HostState from the database for each
+    request, host states are cached and only the compute nodes that
+    changed since the last refresh are fetched.  Cached states are
+    served for at most scheduler_host_state_refresh_interval seconds
+    and a full resync happens every scheduler_host_state_resync_interval
+    seconds to recover from anything the incremental updates missed.
+
+    Resources consumed from a cached host state stay consumed until the
+    compute node reports updated usage, so back to back requests see
+    each other's placements.
+    """
+
+    def __init__(self):
+        super(CachingHostManager, self).__init__()
+        self.host_state_map = {}
+        # { <compute node id> : <host> }
+        self.compute_node_hosts = {}
+        self.last_refresh = None
+        self.last_resync = None
+
+    def update_service_capabilities(self, service_name, host, capabilities):
+        """Update the per-service capabilities based on this notification
+        and push them into the cached host state.
+        """
+        super(CachingHostManager, self).update_service_capabilities(
+                service_name, host, capabilities)
+        host_state = self.host_state_map.get(host)
+        if host_state is not None and host_state.topic == service_name:
+            host_state.update_capabilities(self.service_states[host],
+                                           dict(host_state.service))
+
+    def _update_host_state(self, compute, topic):
+        service = compute['service']
+        if not service:
+            LOG.warn(_("No service for compute ID %s") % compute['id'])
+            return
+        host = service['host']
+        old_host = self.compute_node_hosts.get(compute['id'])
+        if old_host is not None and old_host != host:
+            self.host_state_map.pop(old_host, None)
+        if compute.get('deleted') or service.get('deleted'):
+            self.compute_node_hosts.pop(compute['id'], None)
+            self.host_state_map.pop(host, None)
+            return
+
+        capabilities = self.service_states.get(host, None)
+        host_state = self.host_state_map.get(host)
+        if host_state is None:
+            host_state = self.host_state_cls(host, topic,
+                    capabilities=capabilities,
+                    service=dict(service.iteritems()))
+            self.host_state_map[host] = host_state
+        else:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+            if (host_state.updated_at is not None and
+                    host_state.updated_at == compute.get('updated_at')):
+                # Only the service heartbeat changed.
+                return
+        self.compute_node_hosts[compute['id']] = host
+        host_state.update_from_compute_node(compute)
+
+    def _resync(self, context, topic, now):
+        LOG.debug(_("Resyncing all cached host states"))
+        self.host_state_map = {}
+        self.compute_node_hosts = {}
+        for compute in db.compute_node_get_all(context):
+            self._update_host_state(compute, topic)
+        self.last_refresh = self.last_resync = now
+
+    def _refresh(self, context, topic, now):
+        # NOTE: updated_at is stamped by the clock of each compute host,
+        # and an update may commit after a later one was read, so the
+        # windows of consecutive refreshes overlap.
+        updated_since = self.last_refresh - datetime.timedelta(
+                seconds=FLAGS.scheduler_host_state_refresh_margin)
+        compute_nodes = db.compute_node_get_all(context,
+                updated_since=updated_since)
+        for compute in compute_nodes:
+            self._update_host_state(compute, topic)
+
+        # Service heartbeats and enabling or disabling a service don't
+        # touch the compute nodes, so the services are refreshed apart.
+        for service in db.service_get_all_by_topic(context, topic):
+            host_state = self.host_state_map.get(service['host'])
+            if host_state is not None:
+                host_state.update_capabilities(
+                        self.service_states.get(service['host']),
+                        dict(service.iteritems()))
+        self.last_refresh = now
+
+    def get_all_host_states(self, context, topic):
+        """Returns a dict of all the hosts the HostManager knows about,
+        served from the cache when it is fresh enough.
+        """
+        if topic != 'compute':
+            raise NotImplementedError(_(
+                "host_manager only implemented for 'compute'"))
+
+        # NOTE: take the timestamp before querying so that changes
+        # committed while the query runs are picked up next time.
+        now = timeutils.utcnow()
+        if (self.last_resync is None or timeutils.is_older_than(
+                self.last_resync,
+                FLAGS.scheduler_host_state_resync_interval)):
+            self._resync(context, topic, now)
+        elif timeutils.is_older_than(self.last_refresh,
+                FLAGS.scheduler_host_state_refresh_interval):
+            self._refresh(context, topic, now)
+
+        return dict(self.host_state_map)
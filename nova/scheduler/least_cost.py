@@ -25,6 +25,7 @@ is then selected for provisioning.
 from nova import flags
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
+from nova.scheduler import host_columns
 
 
 LOG = logging.getLogger(__name__)
@@ -78,6 +79,13 @@ def noop_cost_fn(host_state, weighing_properties):
     return 1
 
 
+def _noop_cost_columns(columns, weighing_properties):
+    return host_columns.numpy.ones(len(columns))
+
+
+noop_cost_fn.columns_fn = _noop_cost_columns
+
+
 def compute_fill_first_cost_fn(host_state, weighing_properties):
     """More free ram = higher weight. So servers with less free
     ram will be preferred.
@@ -89,6 +97,19 @@ def compute_fill_first_cost_fn(host_state, weighing_properties):
     return host_state.free_ram_mb
 
 
+def _compute_fill_first_cost_columns(columns, weighing_properties):
+    return columns.free_ram_mb
+
+
+compute_fill_first_cost_fn.columns_fn = _compute_fill_first_cost_columns
+
+
+def weigh_host(weighted_fns, host_state, weighing_properties):
+    """Return the weighted sum of the cost functions for one host."""
+    return sum(weight * fn(host_state, weighing_properties)
+               for weight, fn in weighted_fns)
+
+
 def weighted_sum(weighted_fns, host_states, weighing_properties):
     """Use the weighted-sum method to compute a score for an array of objects.
 
@@ -109,9 +130,41 @@ def weighted_sum(weighted_fns, host_states, weighing_properties):
 
     min_score, best_host = None, None
     for host_state in host_states:
-        score = sum(weight * fn(host_state, weighing_properties)
-                    for weight, fn in weighted_fns)
+        score = weigh_host(weighted_fns, host_state, weighing_properties)
         if min_score is None or score < min_score:
             min_score, best_host = score, host_state
 
     return WeightedHost(min_score, host_state=best_host)
+
+
+def weigh_host_columns(weighted_fns, columns, weighing_properties):
+    """Return an array of the weighted sums for every host of a HostColumns.
+
+    Cost functions with a columns_fn attribute are evaluated for all hosts
+    at once, others are called per host.
+    """
+    numpy = host_columns.numpy
+    scores = numpy.zeros(len(columns))
+    for weight, fn in weighted_fns:
+        columns_fn = getattr(fn, 'columns_fn', None)
+        if columns_fn:
+            costs = columns_fn(columns, weighing_properties)
+        else:
+            costs = numpy.array([fn(host_state, weighing_properties)
+                                 for host_state in columns.host_states],
+                                dtype=numpy.float64)
+        scores += weight * costs
+    return scores
+
+
+def weighted_sum_columns(weighted_fns, columns, weighing_properties):
+    """Columnar version of weighted_sum() taking a HostColumns.
+
+    :returns: a single WeightedHost object which represents the best
+              candidate.
+    """
+    scores = weigh_host_columns(weighted_fns, columns, weighing_properties)
+    # argmin() returns the first of equal scores, like weighted_sum()
+    best = scores.argmin()
+    return WeightedHost(float(scores[best]),
+                        host_state=columns.host_states[best])
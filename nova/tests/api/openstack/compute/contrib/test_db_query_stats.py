@@ -0,0 +1,67 @@
+# Copyright (c) 2012 OpenStack, LLC
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nova.api.openstack import compute
+from nova.db import query_stats
+from nova.openstack.common import jsonutils
+from nova import test
+from nova.tests.api.openstack import fakes
+
+
+class DbQueryStatsTest(test.TestCase):
+
+    def setUp(self):
+        super(DbQueryStatsTest, self).setUp()
+        self.flags(sql_query_stats=True)
+        query_stats.reset_stats()
+        self.addCleanup(query_stats.reset_stats)
+        self.router = compute.APIRouter()
+
+    def _get_stats(self):
+        req = fakes.HTTPRequest.blank('/fake/os-db-query-stats')
+        res = req.get_response(self.router)
+        self.assertEqual(200, res.status_int)
+        return jsonutils.loads(res.body)['db_query_stats']
+
+    def test_index(self):
+        self.assertEqual([], self._get_stats())
+        stats = self._get_stats()
+        self.assertEqual(1, len(stats))
+        self.assertEqual('nova.api.openstack.compute.contrib.'
+                         'db_query_stats.DbQueryStatsController.index',
+                         stats[0]['name'])
+        self.assertEqual(1, stats[0]['count'])
+
+    def test_index_names_scopes_after_methods(self):
+        req = fakes.HTTPRequest.blank('/fake/os-hypervisors')
+        req.get_response(self.router)
+        req = fakes.HTTPRequest.blank('/fake/flavors/detail')
+        req.get_response(self.router)
+        names = [s['name'] for s in self._get_stats()]
+        self.assertEqual(['nova.api.openstack.compute.contrib.hypervisors.'
+                          'HypervisorsController.index',
+                          'nova.api.openstack.compute.flavors.'
+                          'Controller.detail'], names)
+
+    def test_reset(self):
+        self._get_stats()
+        req = fakes.HTTPRequest.blank('/fake/os-db-query-stats/reset')
+        req.method = 'POST'
+        res = req.get_response(self.router)
+        self.assertEqual(202, res.status_int)
+        names = [s['name'] for s in self._get_stats()]
+        self.assertEqual(['nova.api.openstack.compute.contrib.'
+                          'db_query_stats.DbQueryStatsController.reset'],
+                         names)
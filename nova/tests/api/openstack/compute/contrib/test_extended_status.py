@@ -96,6 +96,10 @@ class ExtendedStatusTest(test.TestCase):
                                     power_state='power-%s' % (i + 1),
                                     task_state='task-%s' % (i + 1))
 
+    def test_detail_streamed(self):
+        self.flags(osapi_stream_lists=True)
+        self.test_detail()
+
     def test_no_instance_passthrough_404(self):
 
         def fake_compute_get(*args, **kwargs):
@@ -22,7 +22,9 @@ import webob
 
 from nova.api.openstack.compute.contrib import simple_tenant_usage
 from nova.compute import api
+from nova.compute import utils as compute_utils
 from nova import context
+from nova import db
 from nova import flags
 from nova.openstack.common import jsonutils
 from nova.openstack.common import policy as common_policy
@@ -77,6 +79,25 @@ def fake_instance_get_active_by_window(self, context, begin, end, project_id):
                                          for x in xrange(TENANTS * SERVERS)]
 
 
+def fake_tenant_usage_get_totals_by_window(context, begin, end,
+                                           project_id=None, start=START,
+                                           stop=STOP):
+    totals = {}
+    for x in xrange(TENANTS * SERVERS):
+        instance = get_fake_db_instance(start, stop, x,
+                                        "faketenant_%s" % (x / SERVERS))
+        hours = compute_utils.usage_hours(instance, begin, end)
+        usage = totals.setdefault(instance['project_id'], dict(
+                tenant_id=instance['project_id'], total_hours=0,
+                total_local_gb_usage=0, total_vcpus_usage=0,
+                total_memory_mb_usage=0))
+        usage['total_hours'] += hours
+        usage['total_local_gb_usage'] += (ROOT_GB + EPHEMERAL_GB) * hours
+        usage['total_vcpus_usage'] += VCPUS * hours
+        usage['total_memory_mb_usage'] += MEMORY_MB * hours
+    return totals.values()
+
+
 class SimpleTenantUsageTest(test.TestCase):
     def setUp(self):
         super(SimpleTenantUsageTest, self).setUp()
@@ -84,6 +105,8 @@ class SimpleTenantUsageTest(test.TestCase):
                        fake_instance_type_get)
         self.stubs.Set(api.API, "get_active_by_window",
                        fake_instance_get_active_by_window)
+        self.stubs.Set(db, "tenant_usage_get_totals_by_window",
+                       fake_tenant_usage_get_totals_by_window)
         self.admin_context = context.RequestContext('fakeadmin_0',
                                                     'faketenant_0',
                                                     is_admin=True)
@@ -121,6 +144,39 @@ class SimpleTenantUsageTest(test.TestCase):
     def test_verify_index(self):
         self._test_verify_index(START, STOP)
 
+    def test_verify_index_from_rollups(self):
+        hour = datetime.timedelta(hours=1)
+        # Edges of a quarter and three quarters of an hour add up exactly
+        stop = NOW.replace(minute=0, second=0, microsecond=0) - 3 * hour / 4
+        start = stop - HOURS * hour
+        rolled_up_start = start + hour / 4
+        rolled_up_stop = rolled_up_start + (HOURS - 1) * hour
+        usage = dict(instances=SERVERS, total_hours=SERVERS,
+                     total_local_gb_usage=SERVERS * (ROOT_GB + EPHEMERAL_GB),
+                     total_vcpus_usage=SERVERS * VCPUS,
+                     total_memory_mb_usage=SERVERS * MEMORY_MB)
+        period_beginning = rolled_up_start
+        while period_beginning < rolled_up_stop:
+            db.tenant_usage_rollup_create_safe(
+                    self.admin_context, period_beginning,
+                    period_beginning + hour,
+                    dict(('faketenant_%s' % x, usage)
+                         for x in xrange(TENANTS)))
+            period_beginning += hour
+
+        windows = []
+
+        def fake_get_totals_by_window(context, begin, end, project_id=None):
+            windows.append((begin, end))
+            return fake_tenant_usage_get_totals_by_window(
+                    context, begin, end, project_id, start, stop)
+
+        self.stubs.Set(db, "tenant_usage_get_totals_by_window",
+                       fake_get_totals_by_window)
+        self._test_verify_index(start, stop)
+        self.assertEqual(windows, [(start, rolled_up_start),
+                                   (rolled_up_stop, stop)])
+
     def test_verify_index_future_end_time(self):
         future = NOW + datetime.timedelta(hours=HOURS)
         self._test_verify_index(START, future)
@@ -27,6 +27,7 @@ import webob
 from nova.api.openstack.compute import limits
 from nova.api.openstack.compute import views
 from nova.api.openstack import xmlutil
+from nova.common import memorycache
 import nova.context
 from nova.openstack.common import jsonutils
 from nova import test
@@ -52,6 +53,7 @@ class BaseLimitTestSuite(test.TestCase):
         super(BaseLimitTestSuite, self).setUp()
         self.time = 0.0
         self.stubs.Set(limits.Limit, "_get_time", self._get_time)
+        self.stubs.Set(limits.BucketLimiter, "_get_time", self._get_time)
         self.absolute_limits = {}
 
         def stub_get_project_quotas(context, project_id, usages=True):
@@ -620,6 +622,114 @@ class LimiterTest(BaseLimitTestSuite):
         self.assertEqual(expected, results)
 
 
+class BucketLimiterTest(LimiterTest):
+    """
+    Tests for the `limits.BucketLimiter` class with in-process buckets.
+    """
+
+    def setUp(self):
+        """Run before each test."""
+        super(BucketLimiterTest, self).setUp()
+        userlimits = {'user:user3': ''}
+        self.backend = self._make_backend()
+        self.limiter = limits.BucketLimiter(TEST_LIMITS, self.backend,
+                                            **userlimits)
+
+    def _make_backend(self):
+        return limits.LocalBucketBackend()
+
+    def test_user_limit(self):
+        """
+        Test user-specific limits.
+        """
+        self.assertEqual(self.limiter.user_limits['user3'], [])
+
+    def test_shared_backend(self):
+        """
+        Ensure limiters sharing a backend enforce the limits together.
+        """
+        other = limits.BucketLimiter(TEST_LIMITS, self.backend)
+        results = []
+        for x in xrange(6):
+            results.append(self.limiter.check_for_delay("PUT", "/a")[0])
+            results.append(other.check_for_delay("PUT", "/a")[0])
+        self.assertEqual([None] * 10 + [6.0] * 2, results)
+
+    def test_get_limits(self):
+        """
+        Ensure the remaining requests are computed from the buckets.
+        """
+        list(self._check(4, "PUT", "/servers"))
+        limits_by_uri = dict((limit['URI'], limit)
+                             for limit in self.limiter.get_limits()
+                             if limit['verb'] == 'PUT')
+        self.assertEqual(limits_by_uri['*']['remaining'], 6)
+        self.assertEqual(limits_by_uri['/servers']['remaining'], 1)
+        self.assertEqual(limits_by_uri['/servers']['resetTime'], 0)
+
+        list(self._check(1, "PUT", "/servers"))
+        limits_by_uri = dict((limit['URI'], limit)
+                             for limit in self.limiter.get_limits()
+                             if limit['verb'] == 'PUT')
+        self.assertEqual(limits_by_uri['/servers']['remaining'], 0)
+        self.assertEqual(limits_by_uri['/servers']['resetTime'], 12)
+
+
+class MemcacheBucketLimiterTest(BucketLimiterTest):
+    """
+    Tests for the `limits.BucketLimiter` class with buckets in memcached.
+    """
+
+    def _make_backend(self):
+        return limits.MemcacheBucketBackend(memorycache.Client())
+
+    def test_concurrent_update(self):
+        """
+        Ensure an update racing with another one is retried.
+        """
+        client = self.backend.client
+        self.limiter.check_for_delay("PUT", "/a")
+        real_gets = client.gets
+
+        def racing_gets(key):
+            value = real_gets(key)
+            if not racing_gets.raced:
+                racing_gets.raced = True
+                client.set(key, value)
+            return value
+
+        racing_gets.raced = False
+        self.stubs.Set(client, 'gets', racing_gets)
+        self.limiter.check_for_delay("PUT", "/a")
+        self.assertTrue(racing_gets.raced)
+
+        expected = [None] * 8 + [6.0]
+        results = list(self._check(9, "PUT", "/anything"))
+        self.assertEqual(expected, results)
+
+    def test_cas_without_gets(self):
+        """
+        Ensure cas only stores a value read by gets.
+        """
+        client = self.backend.client
+        client.set('key', '1')
+        self.assertFalse(client.cas('key', '2'))
+        self.assertEqual('1', client.gets('key'))
+        self.assertTrue(client.cas('key', '2'))
+        self.assertEqual('2', client.get('key'))
+
+    def test_cas_ids_forgotten(self):
+        """
+        Ensure the client forgets its cas ids before each bucket update.
+        """
+        client = self.backend.client
+        self.limiter.check_for_delay("PUT", "/a", "user1")
+        client.gets('unrelated')
+        client.cas_ids['unrelated'] = (0, '1')
+        self.limiter.check_for_delay("PUT", "/a", "user2")
+        self.assertFalse('unrelated' in client.cas_ids)
+
+
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
     Tests for `limits.WsgiLimiter` class.
@@ -1,10 +1,14 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
 import inspect
+import mox
 import webob
 
+from nova.api import openstack as openstack_api
 from nova.api.openstack import wsgi
+from nova.db import query_stats
 from nova import exception
+from nova.openstack.common import jsonutils
 from nova import test
 from nova.tests.api.openstack import fakes
 
@@ -141,6 +145,90 @@ class JSONDictSerializerTest(test.TestCase):
         result = result.replace('\n', '').replace(' ', '')
         self.assertEqual(result, expected_json)
 
+    def test_stream(self):
+        built = []
+
+        def builder(obj):
+            built.append(obj)
+            return dict(id=obj)
+
+        items = wsgi.ItemStream(range(3), builder)
+        items.add_hook(lambda item: item.update(name='n%d' % item['id']))
+        input_dict = dict(servers=items, servers_links=[dict(rel='next')])
+        serializer = wsgi.JSONDictSerializer()
+        chunks = serializer.stream(input_dict)
+        self.assertEqual(built, [])
+
+        result = ''.join(chunks)
+        self.assertEqual(built, [0, 1, 2])
+        expected = dict(servers=[dict(id=0, name='n0'), dict(id=1, name='n1'),
+                                 dict(id=2, name='n2')],
+                        servers_links=[dict(rel='next')])
+        self.assertEqual(jsonutils.loads(result), expected)
+
+    def test_stream_chunks(self):
+        self.stubs.Set(wsgi, 'STREAM_CHUNK_SIZE', 10)
+        items = wsgi.ItemStream(range(20), lambda obj: dict(id=obj))
+        serializer = wsgi.JSONDictSerializer()
+        chunks = list(serializer.stream(dict(servers=items)))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), serializer.serialize(
+                dict(servers=[dict(id=i) for i in range(20)])))
+
+
+class ItemStreamTest(test.TestCase):
+    def test_materialize(self):
+        built = []
+
+        def builder(obj):
+            built.append(obj)
+            return dict(id=obj)
+
+        items = wsgi.ItemStream(range(2), builder)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(built, [])
+
+        self.assertEqual(items, [dict(id=0), dict(id=1)])
+        items[0]['name'] = 'foo'
+        self.assertEqual(list(items.stream()),
+                         [dict(id=0, name='foo'), dict(id=1)])
+        self.assertEqual(built, [0, 1])
+
+    def test_hook_after_materialize(self):
+        items = wsgi.ItemStream(range(2), lambda obj: dict(id=obj))
+        items.materialize()
+        items.add_hook(lambda item: item.update(name='foo'))
+        self.assertEqual(items, [dict(id=0, name='foo'),
+                                 dict(id=1, name='foo')])
+
+    def test_start(self):
+        built = []
+
+        def builder(obj):
+            built.append(obj)
+            return dict(id=obj)
+
+        items = wsgi.ItemStream(range(3), builder)
+        items.start()
+        self.assertEqual(built, [0])
+        items.add_hook(lambda item: item.update(name='foo'))
+        stream = items.stream()
+        self.assertEqual(stream.next(), dict(id=0, name='foo'))
+        self.assertEqual(built, [0])
+        self.assertEqual(list(stream), [dict(id=1, name='foo'),
+                                        dict(id=2, name='foo')])
+        self.assertEqual(built, [0, 1, 2])
+
+    def test_build_items(self):
+        builder = lambda obj: dict(id=obj)
+        self.assertEqual(wsgi.build_items(range(2), builder),
+                         [dict(id=0), dict(id=1)])
+
+        self.flags(osapi_stream_lists=True)
+        items = wsgi.build_items(range(2), builder)
+        self.assertTrue(isinstance(items, wsgi.ItemStream))
+        self.assertEqual(items, [dict(id=0), dict(id=1)])
+
 
 class TextDeserializerTest(test.TestCase):
     def test_dispatch_default(self):
@@ -224,6 +312,71 @@ class ResourceTest(test.TestCase):
         response = req.get_response(app)
         self.assertEqual(response.status_int, 403)
 
+    def test_resource_item_stream_hook_error(self):
+        class Controller(object):
+            def index(self, req):
+                items = wsgi.ItemStream(range(2), lambda obj: dict(id=obj))
+                robj = wsgi.ResponseObject(dict(servers=items))
+                robj.extend_items('servers', self._hook)
+                return robj
+
+            def _hook(self, item):
+                raise exception.NotAuthorized()
+
+        req = webob.Request.blank('/tests')
+        app = openstack_api.FaultWrapper(fakes.TestRouter(Controller()))
+        response = req.get_response(app)
+        self.assertEqual(response.status_int, 403)
+        self.assertTrue('forbidden' in jsonutils.loads(response.body))
+
+    def test_resource_item_stream_late_error(self):
+        class Controller(object):
+            def index(self, req):
+                items = wsgi.ItemStream(range(2), lambda obj: dict(id=obj))
+                robj = wsgi.ResponseObject(dict(servers=items))
+                robj.extend_items('servers', self._hook)
+                return robj
+
+            def _hook(self, item):
+                if item['id']:
+                    raise exception.NotAuthorized()
+
+        self.mox.StubOutWithMock(wsgi.LOG, 'exception')
+        wsgi.LOG.exception(mox.IgnoreArg(), 'http://localhost/tests')
+        self.mox.ReplayAll()
+
+        req = webob.Request.blank('/tests')
+        app = openstack_api.FaultWrapper(fakes.TestRouter(Controller()))
+        response = req.get_response(app)
+        self.assertEqual(response.status_int, 200)
+        self.assertRaises(exception.NotAuthorized, list, response.app_iter)
+
+    def test_resource_item_stream_query_stats(self):
+        finished = []
+
+        class Controller(object):
+            def index(self, req):
+                items = wsgi.ItemStream(range(2), self._builder)
+                return wsgi.ResponseObject(dict(servers=items))
+
+            def _builder(self, obj):
+                query_stats.record('SELECT 1', 1, 0.0)
+                return dict(id=obj)
+
+        self.flags(sql_query_stats=True)
+        self.stubs.Set(query_stats, 'finish', finished.append)
+        req = webob.Request.blank('/tests')
+        app = fakes.TestRouter(Controller())
+        body = req.get_response(app).app_iter
+        self.assertEqual(finished, [])
+
+        self.assertEqual(jsonutils.loads(''.join(body)),
+                         dict(servers=[dict(id=0), dict(id=1)]))
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0].statements, 2)
+        body.close()
+        self.assertEqual(len(finished), 1)
+
     def test_dispatch(self):
         class Controller(object):
             def index(self, req, pants=None):
@@ -862,6 +1015,33 @@ class ResponseObjectTest(test.TestCase):
             self.assertEqual(response.status_int, 202)
             self.assertEqual(response.body, mtype)
 
+    def test_serialize_item_stream(self):
+        def make_response_object():
+            items = wsgi.ItemStream(range(2), lambda obj: dict(id=obj))
+            robj = wsgi.ResponseObject(dict(servers=items))
+            robj.extend_items('servers',
+                              lambda item: item.update(name='foo'))
+            return robj
+
+        expected = dict(servers=[dict(id=0, name='foo'),
+                                 dict(id=1, name='foo')])
+        request = wsgi.Request.blank('/tests/123')
+
+        robj = make_response_object()
+        response = robj.serialize(request, 'application/json',
+                                  dict(json=wsgi.JSONDictSerializer))
+        self.assertEqual(response.content_length, None)
+        self.assertEqual(jsonutils.loads(response.body), expected)
+
+        class XMLSerializer(object):
+            def serialize(self, obj):
+                return repr(obj['servers'].__class__)
+
+        robj = make_response_object()
+        response = robj.serialize(request, 'application/xml',
+                                  dict(xml=XMLSerializer))
+        self.assertEqual(response.body, repr(list))
+
 
 class ValidBodyTest(test.TestCase):
 
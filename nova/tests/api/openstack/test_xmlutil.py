@@ -587,7 +587,7 @@ class TemplateTest(test.TestCase):
         slave = xmlutil.SlaveTemplate(elem, 3, 3)
         self.assertEqual(slave.apply(master), True)
 
-    def test__serialize(self):
+    def test_compiled_render(self):
         # Our test object to serialize
         obj = {
             'test': {
@@ -627,9 +627,7 @@ class TemplateTest(test.TestCase):
         master.attach(slave)
 
         # Try serializing our object
-        siblings = master._siblings()
-        nsmap = master._nsmap()
-        result = master._serialize(None, obj, siblings, nsmap)
+        result = master.compile().render(None, obj, master._nsmap())
 
         # Now we get to manually walk the element tree...
         self.assertEqual(result.tag, 'test')
@@ -652,6 +650,72 @@ class TemplateTest(test.TestCase):
                          str(obj['test']['image']['id']))
         self.assertEqual(result[idx].text, obj['test']['image']['name'])
 
+    def _make_master(self):
+        root = xmlutil.TemplateElement('test', selector='test',
+                                       name='name', missing='missing')
+        value = xmlutil.SubTemplateElement(root, 'value', selector='values')
+        value.text = xmlutil.Selector()
+        xmlutil.SubTemplateElement(root, 'empty', selector='empty')
+        attrs = xmlutil.SubTemplateElement(root, 'attrs', selector='attrs')
+        xmlutil.SubTemplateElement(attrs, lambda obj: 'attr_%s' % obj[0],
+                                   selector=xmlutil.get_items, value=1)
+        master = xmlutil.MasterTemplate(root, 1, nsmap=dict(f='foo'))
+
+        root_slave = xmlutil.TemplateElement('test', selector='test',
+                                             name='slave_name')
+        image = xmlutil.SubTemplateElement(root_slave, 'image',
+                                           selector='image', id='id')
+        image.text = xmlutil.Selector('name')
+        master.attach(xmlutil.SlaveTemplate(root_slave, 1,
+                                            nsmap=dict(b='bar')))
+        return master
+
+    def test_make_tree_with_patches(self):
+        obj = {
+            'test': {
+                'name': 'foobar',
+                'slave_name': 'slave_foobar',
+                'values': [1, 2, 3, 4],
+                'empty': None,
+                'attrs': {'a': 1, 'b': 2},
+                'image': {'name': 'image_foobar', 'id': 42},
+                },
+            }
+        master = self._make_master()
+
+        result = master.make_tree(obj)
+
+        expected = ('<test xmlns:b="bar" xmlns:f="foo" name="slave_foobar">'
+                    '<value>1</value><value>2</value><value>3</value>'
+                    '<value>4</value><attrs><attr_a value="1"/>'
+                    '<attr_b value="2"/></attrs>'
+                    '<image id="42">image_foobar</image></test>')
+        self.assertEqual(etree.tostring(result), expected)
+        self.assertEqual(result.get('name'), 'slave_foobar')
+        self.assertEqual(result.get('missing'), None)
+
+    def test_compile_cached(self):
+        master = self._make_master()
+        compiled = master.compile()
+
+        # Copies of the template share the compiled template...
+        self.assertTrue(master.copy().compile() is compiled)
+
+        # ...but not templates with other slaves
+        master.slaves = []
+        self.assertFalse(master.compile() is compiled)
+
+    def test_compile_invalidated(self):
+        master = self._make_master()
+        compiled = master.compile()
+
+        new = xmlutil.SubTemplateElement(master.root, 'new', selector='new')
+        new.text = xmlutil.Selector()
+
+        self.assertFalse(master.compile() is compiled)
+        result = master.make_tree({'test': {'new': 'value'}})
+        self.assertEqual(result.find('new').text, 'value')
+
 
 class MasterTemplateBuilder(xmlutil.TemplateBuilder):
     def construct(self):
@@ -2265,6 +2265,51 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(task_states.STOPPING, instances[0]['task_state'])
 
+    def test_sync_power_states_bulk_update(self):
+        ctxt = context.get_admin_context()
+        vm_power_states = {}
+        for vm_power_state in (power_state.SHUTDOWN, power_state.SHUTDOWN,
+                               power_state.CRASHED, power_state.RUNNING):
+            instance = self._create_fake_instance(
+                    {'host': self.compute.host,
+                     'vm_state': vm_states.STOPPED,
+                     'power_state': power_state.RUNNING})
+            vm_power_states[instance['uuid']] = vm_power_state
+        busy = self._create_fake_instance(
+                {'host': self.compute.host,
+                 'vm_state': vm_states.STOPPED,
+                 'task_state': task_states.REBOOTING,
+                 'power_state': power_state.RUNNING})
+        vm_power_states[busy['uuid']] = power_state.SHUTDOWN
+
+        def fake_get_info(instance):
+            return {'state': vm_power_states[instance['uuid']]}
+
+        self.stubs.Set(self.compute.driver, 'get_info', fake_get_info)
+        self.stubs.Set(self.compute.driver, 'get_num_instances',
+                       lambda: len(vm_power_states))
+
+        update_calls = []
+        orig_instance_update_bulk = db.instance_update_bulk
+
+        def fake_instance_update_bulk(context, instance_uuids, values):
+            update_calls.append(values['power_state'])
+            return orig_instance_update_bulk(context, instance_uuids, values)
+
+        self.stubs.Set(db, 'instance_update_bulk', fake_instance_update_bulk)
+
+        self.compute._sync_power_states(ctxt)
+
+        # one update per power state that changed
+        self.assertEqual(sorted([power_state.SHUTDOWN, power_state.CRASHED]),
+                         sorted(update_calls))
+        for instance_uuid, vm_power_state in vm_power_states.iteritems():
+            instance = db.instance_get_by_uuid(ctxt, instance_uuid)
+            if instance_uuid == busy['uuid']:
+                self.assertEqual(power_state.RUNNING, instance['power_state'])
+            else:
+                self.assertEqual(vm_power_state, instance['power_state'])
+
     def test_add_instance_fault(self):
         exc_info = None
         instance_uuid = str(utils.gen_uuid())
@@ -2396,6 +2441,27 @@ class ComputeTestCase(BaseTestCase):
         val = self.compute._running_deleted_instances('context')
         self.assertEqual(val, [instance1])
 
+    def test_roll_up_tenant_usage(self):
+        self.flags(tenant_usage_rollups=True,
+                   tenant_usage_rollup_backfill_hours=3)
+        timeutils.set_time_override(datetime.datetime(2012, 10, 1, 12, 30))
+        self._create_fake_instance(
+                {'launched_at': datetime.datetime(2012, 10, 1, 10, 30)})
+        ctxt = context.get_admin_context()
+        begin = datetime.datetime(2012, 10, 1, 9)
+        end = datetime.datetime(2012, 10, 1, 12)
+
+        for x in xrange(2):
+            self.compute._roll_up_tenant_usage(ctxt)
+
+            periods = db.tenant_usage_rollup_get_periods(ctxt, begin, end)
+            self.assertEqual(len(periods), 3)
+            totals = db.tenant_usage_rollup_get_totals(ctxt, begin, end)
+            self.assertEqual(len(totals), 1)
+            self.assertEqual(totals[0]['tenant_id'], self.project_id)
+            self.assertEqual(totals[0]['total_hours'], 1.5)
+            self.assertEqual(totals[0]['total_memory_mb_usage'], 768)
+
     def test_heal_instance_info_cache(self):
         # Update on every call for the test
         self.flags(heal_instance_info_cache_interval=-1)
@@ -2561,11 +2627,14 @@ class ComputeTestCase(BaseTestCase):
         self.stubs.Set(db, 'instance_get_all_by_filters',
                 fake_instance_get_all_by_filters)
 
-        def fake_set_instance_error_state(_ctxt, instance_uuid, **kwargs):
-            called['set_error_state'] += 1
+        def fake_instance_update_bulk(_ctxt, instance_uuids, **kwargs):
+            self.assertEqual(kwargs, {'vm_state': vm_states.ERROR,
+                    'expected_vm_state': vm_states.BUILDING})
+            called['set_error_state'] += len(instance_uuids)
+            return [instance_map[uuid] for uuid in instance_uuids]
 
-        self.stubs.Set(self.compute, '_set_instance_error_state',
-                fake_set_instance_error_state)
+        self.stubs.Set(self.compute, '_instance_update_bulk',
+                fake_instance_update_bulk)
 
         instance_map = {}
         instances = []
@@ -2593,11 +2662,14 @@ class ComputeTestCase(BaseTestCase):
         self.stubs.Set(db, 'instance_get_all_by_filters',
                 fake_instance_get_all_by_filters)
 
-        def fake_set_instance_error_state(_ctxt, instance_uuid, **kwargs):
-            called['set_error_state'] += 1
+        def fake_instance_update_bulk(_ctxt, instance_uuids, **kwargs):
+            self.assertEqual(kwargs, {'vm_state': vm_states.ERROR,
+                    'expected_vm_state': vm_states.BUILDING})
+            called['set_error_state'] += len(instance_uuids)
+            return [instance_map[uuid] for uuid in instance_uuids]
 
-        self.stubs.Set(self.compute, '_set_instance_error_state',
-                fake_set_instance_error_state)
+        self.stubs.Set(self.compute, '_instance_update_bulk',
+                fake_instance_update_bulk)
 
         instance_map = {}
         instances = []
@@ -2625,11 +2697,14 @@ class ComputeTestCase(BaseTestCase):
         self.stubs.Set(db, 'instance_get_all_by_filters',
                 fake_instance_get_all_by_filters)
 
-        def fake_set_instance_error_state(_ctxt, instance_uuid, **kwargs):
-            called['set_error_state'] += 1
+        def fake_instance_update_bulk(_ctxt, instance_uuids, **kwargs):
+            self.assertEqual(kwargs, {'vm_state': vm_states.ERROR,
+                    'expected_vm_state': vm_states.BUILDING})
+            called['set_error_state'] += len(instance_uuids)
+            return [instance_map[uuid] for uuid in instance_uuids]
 
-        self.stubs.Set(self.compute, '_set_instance_error_state',
-                fake_set_instance_error_state)
+        self.stubs.Set(self.compute, '_instance_update_bulk',
+                fake_instance_update_bulk)
 
         instance_map = {}
         instances = []
@@ -2667,7 +2742,7 @@ class ComputeAPITestCase(BaseTestCase):
         super(ComputeAPITestCase, self).setUp()
         self.stubs.Set(network_api.API, 'get_instance_nw_info',
                        fake_get_nw_info)
-        self.security_group_api = compute.api.SecurityGroupAPI()
+        self.security_group_api = compute_api.SecurityGroupAPI()
         self.compute_api = compute.API(
                                    security_group_api=self.security_group_api)
         self.fake_image = {
@@ -3957,6 +4032,54 @@ class ComputeAPITestCase(BaseTestCase):
         db.instance_destroy(c, instance2['uuid'])
         db.instance_destroy(c, instance3['uuid'])
 
+    def test_get_instance_type_request_cache(self):
+        c = context.get_admin_context()
+        c.request_cache = context.RequestCache()
+        calls = []
+
+        def counted(fn):
+            def wrapper(*args, **kwargs):
+                calls.append(fn.__name__)
+                return fn(*args, **kwargs)
+            return wrapper
+
+        self.stubs.Set(db, 'instance_type_get',
+                       counted(db.instance_type_get))
+        self.stubs.Set(db, 'instance_type_get_by_flavor_id',
+                       counted(db.instance_type_get_by_flavor_id))
+
+        for i in range(2):
+            instance_type = self.compute_api.get_instance_type(c, 1)
+            self.assertEqual(instance_type['id'], 1)
+            instance_type = self.compute_api.get_instance_type_by_flavor_id(
+                    c, 3)
+            self.assertEqual(instance_type['flavorid'], '3')
+
+        self.assertEqual(calls, ['instance_type_get',
+                                 'instance_type_get_by_flavor_id'])
+
+    def test_security_group_get_request_cache(self):
+        security_group_api = compute_api.SecurityGroupAPI()
+        self.context.request_cache = context.RequestCache()
+        security_group_api.create(self.context, 'testgroup', 'test')
+        calls = []
+
+        def fake_get_by_name(context, project_id, group_name):
+            calls.append(group_name)
+            return real_get_by_name(context, project_id, group_name)
+
+        real_get_by_name = db.security_group_get_by_name
+        self.stubs.Set(db, 'security_group_get_by_name', fake_get_by_name)
+
+        for i in range(2):
+            group = security_group_api.get(self.context, 'testgroup')
+            self.assertEqual(group['name'], 'testgroup')
+        self.assertEqual(calls, ['testgroup'])
+
+        security_group_api.destroy(self.context, group)
+        self.assertRaises(exception.NotFound, security_group_api.get,
+                          self.context, 'testgroup')
+
     def test_get_all_by_state(self):
         """Test searching instances by state"""
 
@@ -554,6 +554,29 @@ class ResourceTestCase(BaseTestCase):
         self.tracker.update_usage(self.context, instance)
         self.assertEqual(0, self.tracker.compute_node['current_workload'])
 
+    def testUpdateUsageBulk(self):
+        limits = {'disk_gb': 100, 'memory_mb': 100}
+        instances = [self._fake_instance(vcpus=1) for i in xrange(3)]
+        for instance in instances[:2]:
+            with self.tracker.resource_claim(self.context, instance, limits):
+                pass
+        self.assertEqual(2, self.tracker.compute_node['vcpus_used'])
+
+        update_calls = []
+
+        def fake_compute_node_update(*args, **kwargs):
+            update_calls.append(args)
+            return self._fake_compute_node_update(*args, **kwargs)
+
+        self.stubs.Set(db, 'compute_node_update', fake_compute_node_update)
+        for instance in instances:
+            instance['vm_state'] = vm_states.DELETED
+        self.tracker.update_usage_bulk(self.context, instances)
+
+        # only the claimed instances count, and the node is saved once:
+        self.assertEqual(0, self.tracker.compute_node['vcpus_used'])
+        self.assertEqual(1, len(update_calls))
+
     def testCpuStats(self):
         limits = {'disk_gb': 100, 'memory_mb': 100}
         self.assertEqual(0, self.tracker.compute_node['vcpus_used'])
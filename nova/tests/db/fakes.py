@@ -420,7 +420,8 @@ def stub_out_db_instance_api(stubs, injected=True):
                        'address_v6': 'fe80::a00:3',
                        'network_id': 'fake_flat'}
 
-    def fake_instance_type_get_all(context, inactive=0, filters=None):
+    def fake_instance_type_get_all(context, inactive=0, filters=None,
+                                   use_slave=False):
         return INSTANCE_TYPES.values()
 
     def fake_instance_type_get_by_name(context, name):
@@ -21,7 +21,10 @@ from nova import flags
 FLAGS = flags.FLAGS
 
 flags.DECLARE('compute_scheduler_driver', 'nova.scheduler.multi')
+flags.DECLARE('dhcp_reload_delay', 'nova.network.linux_net')
 flags.DECLARE('fake_network', 'nova.network.manager')
+flags.DECLARE('firewall_refresh_delay', 'nova.virt.firewall')
+flags.DECLARE('glance_metadata_cache_size', 'nova.image.glance')
 flags.DECLARE('iscsi_num_targets', 'nova.volume.driver')
 flags.DECLARE('network_size', 'nova.network.manager')
 flags.DECLARE('num_networks', 'nova.network.manager')
@@ -32,9 +35,12 @@ flags.DECLARE('volume_driver', 'nova.volume.manager')
 def set_defaults(conf):
     conf.set_default('api_paste_config', '$state_path/etc/nova/api-paste.ini')
     conf.set_default('compute_driver', 'nova.virt.fake.FakeDriver')
+    conf.set_default('dhcp_reload_delay', 0)
     conf.set_default('fake_network', True)
     conf.set_default('fake_rabbit', True)
+    conf.set_default('firewall_refresh_delay', 0)
     conf.set_default('flat_network_bridge', 'br100')
+    conf.set_default('glance_metadata_cache_size', 0)
     conf.set_default('iscsi_num_targets', 8)
     conf.set_default('network_size', 8)
     conf.set_default('num_networks', 2)
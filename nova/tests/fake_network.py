@@ -141,6 +141,20 @@ class FakeNetworkManager(network_manager.NetworkManager):
             return [ip for ip in self.fixed_ips
                     if ip['virtual_interface_id'] == vif_id]
 
+        def fixed_ip_get_by_ip_filter(self, context, fixed_ip=None, ip=None):
+            if fixed_ip is None and ip is None:
+                return []
+            results = []
+            for fixed in self.fixed_ips:
+                vif = self.vifs[fixed['virtual_interface_id']]
+                floating_ips = [floating['address']
+                                for floating in self.floating_ips
+                                if floating['fixed_ip_id'] == fixed['id']]
+                results.append({'instance_uuid': vif['instance_uuid'],
+                                'address': fixed['address'],
+                                'floating_ips': floating_ips})
+            return results
+
     def __init__(self):
         self.db = self.FakeDB()
         self.deallocate_called = None
@@ -154,7 +154,8 @@ def stub_out_db_instance_api(stubs):
             'vlan': 100}
         return FakeModel(fields)
 
-    def fake_instance_type_get_all(context, inactive=0, filters=None):
+    def fake_instance_type_get_all(context, inactive=0, filters=None,
+                                   use_slave=False):
         return INSTANCE_TYPES.values()
 
     def fake_instance_type_get_by_name(context, name):
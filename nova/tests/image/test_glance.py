@@ -17,17 +17,22 @@
 
 
 import datetime
+import httplib
 import random
+import StringIO
 import time
 
+import eventlet.wsgi
 import glanceclient.exc
 
 from nova import context
 from nova import exception
 from nova.image import glance
+from nova.openstack.common import timeutils
 from nova import test
 from nova.tests.api.openstack import fakes
 from nova.tests.glance import stubs as glance_stubs
+from nova import wsgi
 
 
 class NullWriter(object):
@@ -397,6 +402,43 @@ class TestGlanceImageService(test.TestCase):
                           self.context,
                           image_id)
 
+    def _count_client_calls(self):
+        calls = []
+        real_call = self.service._client.call
+
+        def fake_call(context, version, method, *args, **kwargs):
+            calls.append(method)
+            return real_call(context, version, method, *args, **kwargs)
+
+        self.stubs.Set(self.service._client, 'call', fake_call)
+        return calls
+
+    def test_show_uses_request_cache(self):
+        fixture = self._make_fixture(name='image1', is_public=True)
+        image_id = self.service.create(self.context, fixture)['id']
+        self.context.request_cache = context.RequestCache()
+        calls = self._count_client_calls()
+
+        image_meta = self.service.show(self.context, image_id)
+        image_meta['properties']['foo'] = 'bar'
+        image_meta = self.service.show(self.context, image_id)
+
+        self.assertEqual(calls, ['get'])
+        self.assertEqual(image_meta['properties'], {})
+        self.assertEqual(self.context.request_cache.hits, 1)
+
+    def test_update_invalidates_request_cache(self):
+        fixture = self._make_fixture(name='image1', is_public=True)
+        image_id = self.service.create(self.context, fixture)['id']
+        self.context.request_cache = context.RequestCache()
+        self.service.show(self.context, image_id)
+
+        self.service.update(self.context, image_id, {'name': 'image2'})
+        image_meta = self.service.show(self.context, image_id)
+
+        self.assertEqual(image_meta['name'], 'image2')
+        self.assertEqual(self.context.request_cache.hits, 0)
+
     def test_detail_passes_through_to_client(self):
         fixture = self._make_fixture(name='image10', is_public=True)
         image_id = self.service.create(self.context, fixture)['id']
@@ -546,6 +588,132 @@ def _create_failing_glance_client(info):
     return MyGlanceStubClient()
 
 
+class TestGlanceImageMetaCache(test.TestCase):
+
+    def setUp(self):
+        super(TestGlanceImageMetaCache, self).setUp()
+        self.flags(glance_metadata_cache_size=10)
+        glance._image_cache.clear()
+        self.addCleanup(glance._image_cache.clear)
+        timeutils.set_time_override()
+
+        self.client = glance_stubs.StubGlanceClient()
+        self.stubs.Set(glance, '_create_glance_client',
+                       lambda context, host, port, use_ssl, version:
+                       self.client)
+        self.service = glance.GlanceImageService(
+                client=glance.GlanceClientWrapper('fake', 'fake_host', 9292))
+        self.context = context.RequestContext('fake', 'fake', auth_token=True)
+
+        self.calls = []
+        real_call = self.service._client.call
+
+        def fake_call(context, version, method, *args, **kwargs):
+            self.calls.append(method)
+            return real_call(context, version, method, *args, **kwargs)
+
+        self.stubs.Set(self.service._client, 'call', fake_call)
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(TestGlanceImageMetaCache, self).tearDown()
+
+    def _create(self, **kwargs):
+        fixture = {'name': 'image1', 'properties': {}, 'status': 'active',
+                   'is_public': True}
+        fixture.update(kwargs)
+        return self.client.create(**fixture).id
+
+    def test_show_cached(self):
+        image_id = self._create()
+        image_meta = self.service.show(self.context, image_id)
+        image_meta['properties']['foo'] = 'bar'
+        image_meta = self.service.show(self.context, image_id)
+        self.assertEqual(image_meta['properties'], {})
+        self.assertEqual(self.calls, ['get'])
+
+        timeutils.advance_time_seconds(60)
+        self.service.show(self.context, image_id)
+        self.assertEqual(self.calls, ['get', 'get'])
+
+    def test_show_inactive_not_cached(self):
+        image_id = self._create(status='saving')
+        self.service.show(self.context, image_id)
+        self.service.show(self.context, image_id)
+        self.assertEqual(self.calls, ['get', 'get'])
+
+    def test_show_cached_disabled(self):
+        self.flags(glance_metadata_cache_size=0)
+        image_id = self._create()
+        self.service.show(self.context, image_id)
+        self.service.show(self.context, image_id)
+        self.assertEqual(self.calls, ['get', 'get'])
+
+    def test_show_not_found_cached(self):
+        for i in range(2):
+            self.assertRaises(exception.ImageNotFound,
+                              self.service.show, self.context, 'missing')
+        self.assertEqual(self.calls, ['get'])
+
+        timeutils.advance_time_seconds(5)
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, self.context, 'missing')
+        self.assertEqual(self.calls, ['get', 'get'])
+
+    def test_show_private_image_scoped(self):
+        image_id = self._create(is_public=False)
+        other = context.RequestContext('other', 'other', auth_token=True)
+        self.service.show(self.context, image_id)
+        self.service.show(self.context, image_id)
+        self.service.show(other, image_id)
+        self.assertEqual(self.calls, ['get', 'get'])
+
+    def test_show_public_image_shared(self):
+        image_id = self._create()
+        other = context.RequestContext('other', 'other', auth_token=True)
+        self.service.show(self.context, image_id)
+        self.service.show(other, image_id)
+        self.assertEqual(self.calls, ['get'])
+
+    def test_detail_fills_cache(self):
+        image_id = self._create()
+        self.service.detail(self.context)
+        self.service.show(self.context, image_id)
+        self.assertEqual(self.calls, ['list'])
+
+    def test_update_invalidates(self):
+        image_id = self._create()
+        self.service.show(self.context, image_id)
+        self.service.update(self.context, image_id, {'name': 'image2'})
+        image_meta = self.service.show(self.context, image_id)
+        self.assertEqual(image_meta['name'], 'image2')
+        self.assertEqual(self.calls, ['get', 'update', 'get'])
+
+    def test_delete_invalidates(self):
+        image_id = self._create()
+        self.service.show(self.context, image_id)
+        self.service.delete(self.context, image_id)
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, self.context, image_id)
+        self.assertEqual(self.calls, ['get', 'delete', 'get'])
+
+    def test_least_recently_used_evicted(self):
+        self.flags(glance_metadata_cache_size=2)
+        image_ids = [self._create() for i in range(3)]
+        self.service.show(self.context, image_ids[0])
+        self.service.show(self.context, image_ids[1])
+        self.service.show(self.context, image_ids[0])
+        self.service.show(self.context, image_ids[2])
+        self.assertEqual(len(glance._image_cache), 2)
+        self.calls = []
+
+        self.service.show(self.context, image_ids[0])
+        self.service.show(self.context, image_ids[2])
+        self.assertEqual(self.calls, [])
+        self.service.show(self.context, image_ids[1])
+        self.assertEqual(self.calls, ['get'])
+
+
 class TestGlanceClientWrapper(test.TestCase):
 
     def setUp(self):
@@ -554,6 +722,9 @@ class TestGlanceClientWrapper(test.TestCase):
         self.flags(glance_api_servers=['host1:9292', 'https://host2:9293',
             'http://host3:9294'])
 
+        glance._failed_api_servers.clear()
+        self.addCleanup(glance._failed_api_servers.clear)
+
         # Make the test run fast
         def _fake_sleep(secs):
             pass
@@ -702,3 +873,165 @@ class TestGlanceClientWrapper(test.TestCase):
 
         client2.call(ctxt, 1, 'get', 'meow')
         self.assertEqual(info['num_calls'], 2)
+
+    def test_default_client_fails_over(self):
+        self.flags(glance_num_retries=1)
+
+        ctxt = context.RequestContext('fake', 'fake')
+        info = {'num_calls': 0}
+        hosts = []
+        sleeps = []
+
+        def _fake_create_glance_client(context, host, port, use_ssl, version):
+            hosts.append(host)
+            return _create_failing_glance_client(info)
+
+        self.stubs.Set(random, 'shuffle', lambda servers: None)
+        self.stubs.Set(glance, '_create_glance_client',
+                _fake_create_glance_client)
+        self.stubs.Set(time, 'sleep', sleeps.append)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+        client = glance.GlanceClientWrapper()
+        client.call(ctxt, 1, 'get', 'meow')
+        self.assertEqual(hosts, ['host1', 'host2'])
+        self.assertEqual(sleeps, [])
+
+        # host1 failed, so it is skipped until the retry interval passed
+        client2 = glance.GlanceClientWrapper()
+        client2.call(ctxt, 1, 'get', 'meow')
+        self.assertEqual(hosts, ['host1', 'host2', 'host2'])
+
+        timeutils.advance_time_seconds(30)
+        client3 = glance.GlanceClientWrapper()
+        client3.call(ctxt, 1, 'get', 'meow')
+        self.assertEqual(hosts, ['host1', 'host2', 'host2', 'host1'])
+
+    def test_default_client_sleeps_when_all_servers_failed(self):
+        self.flags(glance_num_retries=1, glance_api_servers=['host1:9292'])
+
+        ctxt = context.RequestContext('fake', 'fake')
+        info = {'num_calls': 0}
+        sleeps = []
+
+        self.stubs.Set(glance, '_create_glance_client',
+                lambda *args: _create_failing_glance_client(info))
+        self.stubs.Set(time, 'sleep', sleeps.append)
+
+        client = glance.GlanceClientWrapper()
+        client.call(ctxt, 1, 'get', 'meow')
+        self.assertEqual(info['num_calls'], 2)
+        self.assertEqual(sleeps, [1])
+
+
+class TestGlanceConnectionPool(test.TestCase):
+    """Talk to a stub glance api server over real connections."""
+
+    def setUp(self):
+        super(TestGlanceConnectionPool, self).setUp()
+        glance._connection_pools.clear()
+        self.addCleanup(glance._connection_pools.clear)
+
+        self.connections = []
+        self.requests = 0
+        self.serve_ranges = True
+        connections = self.connections
+
+        class CountingProtocol(eventlet.wsgi.HttpProtocol):
+            def setup(self):
+                connections.append(self.client_address)
+                eventlet.wsgi.HttpProtocol.setup(self)
+
+        self.server = wsgi.Server('fake_glance', self._fake_glance_app,
+                                  host='127.0.0.1', port=0,
+                                  protocol=CountingProtocol)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.context = context.RequestContext('fake', 'fake')
+
+    def _fake_glance_app(self, environ, start_response):
+        self.requests += 1
+        image_id = environ['PATH_INFO'].split('/')[-1]
+        if environ['REQUEST_METHOD'] == 'GET':
+            data = 'x' * 1000 + 'y' * 1000
+            status = '200 OK'
+            byte_range = environ.get('HTTP_RANGE')
+            if byte_range and self.serve_ranges:
+                start, end = byte_range[len('bytes='):].split('-')
+                data = data[int(start):int(end) + 1]
+                status = '206 Partial Content'
+            start_response(status,
+                           [('Content-Type', 'application/octet-stream'),
+                            ('Content-Length', str(len(data)))])
+            return [data]
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', '0'),
+                                  ('x-image-meta-id', image_id),
+                                  ('x-image-meta-status', 'active')])
+        return ['']
+
+    def _get_images(self, *image_ids):
+        for image_id in image_ids:
+            client = glance._create_glance_client(self.context, '127.0.0.1',
+                                                  self.server.port, False)
+            image = client.images.get(image_id)
+            self.assertEqual(image.id, image_id)
+
+    def test_connection_reused(self):
+        self._get_images('1', '2', '3')
+        self.assertEqual(self.requests, 3)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_connection_per_call_without_pool(self):
+        self.flags(glance_connection_pool_size=0)
+        self._get_images('1', '2', '3')
+        self.assertEqual(len(self.connections), 3)
+
+    def test_busy_connection_not_shared(self):
+        pool = glance._get_connection_pool(
+                (httplib.HTTPConnection, ('127.0.0.1', self.server.port), {}))
+        conn1 = pool.get()
+        conn2 = pool.get()
+        self.assertNotEqual(conn1, conn2)
+
+        conn1.request('HEAD', '/v1/images/1')
+        conn1.getresponse().read()
+        self.assertEqual(pool.get(), conn1)
+
+    def test_pool_size(self):
+        self.flags(glance_connection_pool_size=2)
+        pool = glance._get_connection_pool(
+                (httplib.HTTPConnection, ('127.0.0.1', self.server.port), {}))
+        for i in range(3):
+            pool.get()
+        self.assertEqual(len(pool.connections), 2)
+
+    def test_closed_connection_reopened(self):
+        self._get_images('1')
+        pool, = glance._connection_pools.values()
+        pool.connections[0].sock.close()
+
+        self._get_images('2')
+        self.assertEqual(self.requests, 2)
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(len(pool.connections), 1)
+
+    def _download_range(self, start, end):
+        service = glance.GlanceImageService(glance.GlanceClientWrapper(
+                self.context, '127.0.0.1', self.server.port))
+        data = StringIO.StringIO()
+        served = service.download_range(self.context, '1', data, start, end)
+        return served, data.getvalue()
+
+    def test_download_range(self):
+        self.assertEqual(self._download_range(990, 1009),
+                         (True, 'x' * 10 + 'y' * 10))
+
+    def test_download_range_not_served(self):
+        self.serve_ranges = False
+        self.assertEqual(self._download_range(990, 1009), (False, ''))
+
+        # The connection is not reused while the image is on the way
+        self._get_images('2')
+        self.assertEqual(len(self.connections), 2)
@@ -128,6 +128,14 @@
             "namespace": "http://docs.openstack.org/compute/ext/createserverext/api/v1.1",
             "updated": "%(timestamp)s"
         },
+        {
+            "alias": "os-db-query-stats",
+            "description": "%(text)s",
+            "links": [],
+            "name": "DbQueryStats",
+            "namespace": "http://docs.openstack.org/compute/ext/db_query_stats/api/v2",
+            "updated": "%(timestamp)s"
+        },
         {
             "alias": "os-deferred-delete",
             "description": "%(text)s",
@@ -48,6 +48,9 @@
   <extension alias="os-create-server-ext" updated="%(timestamp)s" namespace="http://docs.openstack.org/compute/ext/createserverext/api/v1.1" name="Createserverext">
     <description>%(text)s</description>
   </extension>
+  <extension alias="os-db-query-stats" updated="%(timestamp)s" namespace="http://docs.openstack.org/compute/ext/db_query_stats/api/v2" name="DbQueryStats">
+    <description>%(text)s</description>
+  </extension>
   <extension alias="os-deferred-delete" updated="%(timestamp)s" namespace="http://docs.openstack.org/compute/ext/deferred-delete/api/v1.1" name="DeferredDelete">
     <description>%(text)s</description>
   </extension>
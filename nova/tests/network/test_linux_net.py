@@ -188,7 +188,7 @@ vifs = [{'id': 0,
          'instance_uuid': '00000000-0000-0000-0000-0000000000000001'}]
 
 
-def get_associated(context, network_id, host=None):
+def get_associated(context, network_id, host=None, address=None):
     result = []
     for datum in fixed_ips:
         if (datum['network_id'] == network_id and datum['allocated']
@@ -197,6 +197,8 @@ def get_associated(context, network_id, host=None):
             instance = instances[datum['instance_uuid']]
             if host and host != instance['host']:
                 continue
+            if address and address != datum['address']:
+                continue
             cleaned = {}
             cleaned['address'] = datum['address']
             cleaned['instance_uuid'] = datum['instance_uuid']
@@ -231,6 +233,8 @@ class LinuxNetworkTestCase(test.TestCase):
         self.stubs.Set(db, 'virtual_interface_get_by_instance', get_vifs)
         self.stubs.Set(db, 'instance_get', get_instance)
         self.stubs.Set(db, 'network_get_associated_fixed_ips', get_associated)
+        self.stubs.Set(self.driver, '_dhcp_hosts', {})
+        self.stubs.Set(self.driver, '_dhcp_reloads', {})
 
     def test_update_dhcp_for_nw00(self):
         self.flags(use_single_default_gateway=True)
@@ -238,6 +242,7 @@ class LinuxNetworkTestCase(test.TestCase):
         self.mox.StubOutWithMock(self.driver, 'write_to_file')
         self.mox.StubOutWithMock(utils, 'ensure_tree')
         self.mox.StubOutWithMock(os, 'chmod')
+        self.mox.StubOutWithMock(os, 'rename')
 
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
@@ -250,6 +255,8 @@ class LinuxNetworkTestCase(test.TestCase):
         utils.ensure_tree(mox.IgnoreArg())
         os.chmod(mox.IgnoreArg(), mox.IgnoreArg())
         os.chmod(mox.IgnoreArg(), mox.IgnoreArg())
+        os.rename(mox.IgnoreArg(), mox.IgnoreArg())
+        os.rename(mox.IgnoreArg(), mox.IgnoreArg())
 
         self.mox.ReplayAll()
 
@@ -261,6 +268,7 @@ class LinuxNetworkTestCase(test.TestCase):
         self.mox.StubOutWithMock(self.driver, 'write_to_file')
         self.mox.StubOutWithMock(utils, 'ensure_tree')
         self.mox.StubOutWithMock(os, 'chmod')
+        self.mox.StubOutWithMock(os, 'rename')
 
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
@@ -273,6 +281,8 @@ class LinuxNetworkTestCase(test.TestCase):
         utils.ensure_tree(mox.IgnoreArg())
         os.chmod(mox.IgnoreArg(), mox.IgnoreArg())
         os.chmod(mox.IgnoreArg(), mox.IgnoreArg())
+        os.rename(mox.IgnoreArg(), mox.IgnoreArg())
+        os.rename(mox.IgnoreArg(), mox.IgnoreArg())
 
         self.mox.ReplayAll()
 
@@ -308,7 +318,7 @@ class LinuxNetworkTestCase(test.TestCase):
         self.assertEquals(actual_hosts, expected)
 
     def test_get_dhcp_opts_for_nw00(self):
-        expected_opts = 'NW-0,3\nNW-3,3\nNW-4,3'
+        expected_opts = 'NW-3,3\nNW-4,3'
         actual_opts = self.driver.get_dhcp_opts(self.context, networks[0])
 
         self.assertEquals(actual_opts, expected_opts)
@@ -320,6 +330,96 @@ class LinuxNetworkTestCase(test.TestCase):
 
         self.assertEquals(actual_opts, expected_opts)
 
+    def _stub_out_dhcp_files(self):
+        self.files = {}
+        self.restarts = []
+
+        def fake_write_dhcp_file(path, data):
+            self.files[path.split('.')[-1]] = data
+
+        def fake_restart_dhcp(context, dev, network_ref):
+            self.restarts.append(dev)
+
+        self.stubs.Set(self.driver, '_write_dhcp_file', fake_write_dhcp_file)
+        self.stubs.Set(self.driver, 'restart_dhcp', fake_restart_dhcp)
+        self.stubs.Set(utils, 'ensure_tree', lambda path: None)
+
+    def test_add_and_remove_dhcp_host(self):
+        self.flags(use_single_default_gateway=True)
+        self._stub_out_dhcp_files()
+        deallocated = set(['192.168.0.102'])
+
+        def get_allocated(context, network_id, host=None, address=None):
+            return [datum for datum in get_associated(context, network_id,
+                                                      host, address)
+                    if datum['address'] not in deallocated]
+
+        self.stubs.Set(db, 'network_get_associated_fixed_ips', get_allocated)
+        self.driver.update_dhcp(self.context, "eth0", networks[0])
+        self.assertEqual(['eth0'], self.restarts)
+        self.assertEqual('NW-3,3', self.files['opts'])
+
+        def get_vifs(_context, instance_uuid):
+            self.fail('vifs looked up again')
+
+        self.stubs.Set(db, 'virtual_interface_get_by_instance', get_vifs)
+        deallocated.clear()
+        self.driver.add_dhcp_host(self.context, "eth0", networks[0],
+                                  '192.168.0.102')
+        self.assertEqual(self.driver.get_dhcp_hosts(self.context,
+                                                    networks[0]),
+                         self.files['conf'])
+        self.assertEqual('NW-3,3\nNW-4,3', self.files['opts'])
+        self.assertEqual(['eth0', 'eth0'], self.restarts)
+
+        # Nothing changed
+        self.driver.add_dhcp_host(self.context, "eth0", networks[0],
+                                  '192.168.0.102')
+        self.assertEqual(2, len(self.restarts))
+
+        self.driver.remove_dhcp_host(self.context, "eth0", networks[0],
+                                     '192.168.0.100')
+        self.assertFalse('192.168.0.100' in self.files['conf'])
+        self.assertEqual(3, len(self.restarts))
+
+    def test_dhcp_hosts_remove_forgets_default_gateway(self):
+        hosts = self.driver.DhcpHosts()
+        hosts.load([dict(address='a', instance_uuid='i1', vif_id=1),
+                    dict(address='b', instance_uuid='i1', vif_id=2),
+                    dict(address='c', instance_uuid='i2', vif_id=3)])
+        hosts.default_gw_vifs = {'i1': 1, 'i2': 3}
+
+        self.assertTrue(hosts.remove('a'))
+        self.assertEqual({'i1': 1, 'i2': 3}, hosts.default_gw_vifs)
+        self.assertTrue(hosts.remove('b'))
+        self.assertEqual({'i2': 3}, hosts.default_gw_vifs)
+        self.assertFalse(hosts.remove('b'))
+
+    def test_dhcp_reloads_are_coalesced(self):
+        self.flags(dhcp_reload_delay=10)
+        self._stub_out_dhcp_files()
+        scheduled = []
+
+        def fake_spawn_after(delay, func, *args):
+            self.assertEqual(10, delay)
+            scheduled.append((func, args))
+
+        self.stubs.Set(self.driver.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        self.driver.update_dhcp(self.context, "eth0", networks[0])
+        self.assertEqual(['eth0'], self.restarts)
+
+        self.driver.remove_dhcp_host(self.context, "eth0", networks[0],
+                                     '192.168.0.100')
+        self.driver.remove_dhcp_host(self.context, "eth0", networks[0],
+                                     '192.168.1.101')
+        self.assertEqual(1, len(scheduled))
+        self.assertEqual(['eth0'], self.restarts)
+
+        func, args = scheduled.pop()
+        func(*args)
+        self.assertEqual(['eth0', 'eth0'], self.restarts)
+
     def test_dhcp_opts_not_default_gateway_network(self):
         expected = "NW-0,3"
         data = get_associated(self.context, 0)[0]
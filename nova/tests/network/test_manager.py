@@ -977,7 +977,7 @@ class VlanNetworkTestCase(test.TestCase):
         def network_get(_context, network_id, project_only="allow_none"):
             return networks[network_id]
 
-        def teardown_network_on_host(_context, network):
+        def teardown_network_on_host(_context, network, address=None):
             if network['id'] == 0:
                 raise test.TestingException()
 
@@ -1329,6 +1329,15 @@ class CommonNetworkTestCase(test.TestCase):
         self.assertEqual(res[0]['instance_uuid'], _vifs[1]['instance_uuid'])
         self.assertEqual(res[1]['instance_uuid'], _vifs[2]['instance_uuid'])
 
+        # Get instance 0 and 1 by floating ip
+        res = manager.get_instance_uuids_by_ip_filter(fake_context,
+                                                      {'ip': '172.16.1'})
+        self.assertEqual(len(res), 2)
+        self.assertEqual(res[0]['instance_uuid'], _vifs[0]['instance_uuid'])
+        self.assertEqual(res[0]['ip'], '172.16.1.1')
+        self.assertEqual(res[1]['instance_uuid'], _vifs[1]['instance_uuid'])
+        self.assertEqual(res[1]['ip'], '172.16.1.2')
+
     def test_get_instance_uuids_by_ipv6_regex(self):
         manager = fake_network.FakeNetworkManager()
         _vifs = manager.db.virtual_interface_get_all(None)
@@ -25,10 +25,13 @@ from nova import db
 from nova import exception
 from nova.scheduler import driver
 from nova.scheduler import filter_scheduler
+from nova.scheduler import host_columns
 from nova.scheduler import host_manager
 from nova.scheduler import least_cost
+from nova import test
 from nova.tests.scheduler import fakes
 from nova.tests.scheduler import test_scheduler
+from nova import utils
 
 
 def fake_filter_hosts(hosts, filter_properties):
@@ -191,6 +194,108 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         for weighted_host in weighted_hosts:
             self.assertTrue(weighted_host.host_state is not None)
 
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_schedule_host_columns(self):
+        """Scheduling with host columns spreads instances using the
+        columnar filters and weighing."""
+        self.flags(scheduler_use_host_columns=True,
+                   scheduler_default_filters=['RamFilter', 'ComputeFilter'],
+                   ram_allocation_ratio=1.0)
+        sched = fakes.FakeFilterScheduler()
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+        self.stubs.Set(utils, 'service_is_up', lambda service: True)
+        fakes.mox_host_manager_db_calls(self.mox, fake_context)
+
+        request_spec = {'num_instances': 3,
+                        'instance_type': {'memory_mb': 3072, 'root_gb': 1,
+                                          'ephemeral_gb': 0,
+                                          'vcpus': 1},
+                        'instance_properties': {'project_id': 1,
+                                                'root_gb': 1,
+                                                'memory_mb': 3072,
+                                                'ephemeral_gb': 0,
+                                                'vcpus': 1,
+                                                'os_type': 'Linux'}}
+        self.mox.ReplayAll()
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                request_spec, {})
+
+        # host2 is disabled and host1 is too small, the default spread
+        # first weighing prefers host4 until it has less free RAM than
+        # host3.
+        hosts = [weighted_host.host_state.host
+                 for weighted_host in weighted_hosts]
+        self.assertEqual(sorted(hosts), ['host3', 'host4', 'host4'])
+
+    def _schedule_hosts(self, batch, num_instances, memory_mb):
+        self.flags(scheduler_batch_placement=batch,
+                   scheduler_default_filters=['RamFilter', 'ComputeFilter'],
+                   ram_allocation_ratio=1.0)
+        sched = fakes.FakeFilterScheduler()
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+        request_spec = {'num_instances': num_instances,
+                        'instance_type': {'memory_mb': memory_mb,
+                                          'root_gb': 1,
+                                          'ephemeral_gb': 0,
+                                          'vcpus': 1},
+                        'instance_properties': {'project_id': 1,
+                                                'root_gb': 1,
+                                                'memory_mb': memory_mb,
+                                                'ephemeral_gb': 0,
+                                                'vcpus': 1,
+                                                'os_type': 'Linux'}}
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                request_spec, {})
+        return [(weighted_host.weight, weighted_host.host_state.host)
+                for weighted_host in weighted_hosts]
+
+    def test_schedule_batch_placement(self):
+        """Batch placement picks the same hosts as filtering and
+        weighing all hosts for every instance."""
+        self.stubs.Set(utils, 'service_is_up', lambda service: True)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(mox.IgnoreArg()).AndReturn(
+                fakes.COMPUTE_NODES)
+        db.compute_node_get_all(mox.IgnoreArg()).AndReturn(
+                fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+
+        expected = self._schedule_hosts(False, 8, 1024)
+        self.assertEqual(len(expected), 8)
+        self.assertEqual(expected, self._schedule_hosts(True, 8, 1024))
+
+    def test_schedule_batch_placement_runs_out_of_hosts(self):
+        self.stubs.Set(utils, 'service_is_up', lambda service: True)
+        fakes.mox_host_manager_db_calls(self.mox, None)
+        self.mox.ReplayAll()
+
+        # Only host3 and host4 have room for 3GB, once each and twice.
+        hosts = self._schedule_hosts(True, 5, 3072)
+        self.assertEqual(sorted(host for weight, host in hosts),
+                         ['host3', 'host4', 'host4'])
+
+    def test_schedule_claim_conflict(self):
+        """A host whose claim conflicts is refreshed and weighed again."""
+        self.flags(scheduler_claim_resources=True)
+        self.stubs.Set(utils, 'service_is_up', lambda service: True)
+        fakes.mox_host_manager_db_calls(self.mox, None)
+        self.mox.StubOutWithMock(db, 'compute_node_claim_resources')
+        self.mox.StubOutWithMock(db, 'compute_node_get')
+
+        # host4 is chosen first, but another scheduler took most of it.
+        db.compute_node_claim_resources(mox.IgnoreArg(), 4,
+                mox.IgnoreArg(), 1024, 1, 1).AndReturn(False)
+        db.compute_node_get(mox.IgnoreArg(), 4).AndReturn(
+                dict(fakes.COMPUTE_NODES[3], free_ram_mb=2048))
+        db.compute_node_claim_resources(mox.IgnoreArg(), 3,
+                mox.IgnoreArg(), 1024, 1, 1).AndReturn(True)
+        self.mox.ReplayAll()
+
+        hosts = self._schedule_hosts(False, 1, 1024)
+        self.assertEqual(hosts, [(-3072, 'host3')])
+
     def test_schedule_prep_resize_doesnt_update_host(self):
         fake_context = context.RequestContext('user', 'project',
                 is_admin=True)
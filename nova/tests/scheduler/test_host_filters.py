@@ -26,6 +26,7 @@ from nova.openstack.common import jsonutils
 from nova.scheduler import filters
 from nova.scheduler.filters import extra_specs_ops
 from nova.scheduler.filters.trusted_filter import AttestationService
+from nova.scheduler import host_columns
 from nova import test
 from nova.tests.scheduler import fakes
 from nova import utils
@@ -312,6 +313,27 @@ class HostFiltersTestCase(test.TestCase):
 
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_affinity_filter_reads_instances_from_primary(self):
+        filt_cls = self.class_map['DifferentHostFilter']()
+        host = fakes.FakeHostState('host1', 'compute', {})
+        instance = fakes.FakeInstance(context=self.context,
+                                         params={'host': 'host1'})
+        use_slaves = []
+        orig_get_all_by_filters = db.instance_get_all_by_filters
+
+        def fake_get_all_by_filters(*args, **kwargs):
+            use_slaves.append(kwargs.get('use_slave'))
+            return orig_get_all_by_filters(*args, **kwargs)
+
+        self.stubs.Set(db, 'instance_get_all_by_filters',
+                       fake_get_all_by_filters)
+        filter_properties = {'context': self.context.elevated(),
+                             'scheduler_hints': {
+                                'different_host': [instance.uuid], }}
+
+        self.assertFalse(filt_cls.host_passes(host, filter_properties))
+        self.assertEqual([False], use_slaves)
+
     def test_affinity_different_filter_no_list_passes(self):
         filt_cls = self.class_map['DifferentHostFilter']()
         host = fakes.FakeHostState('host1', 'compute', {})
@@ -1157,6 +1179,38 @@ class HostFiltersTestCase(test.TestCase):
         }
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_json_filter_compiles_query_once(self):
+        filt_cls = self.class_map['JsonFilter']()
+        raw = ['and', ['>=', '$free_ram_mb', 1024],
+                      ['=', '$capabilities.enabled', True]]
+        filter_properties = {
+            'scheduler_hints': {
+                'query': jsonutils.dumps(raw),
+            },
+        }
+        self.stubs.Set(self.class_map['JsonFilter'], '_compiled_queries',
+                       {})
+        loads = self.mox.CreateMockAnything()
+        self.stubs.Set(jsonutils, 'loads', loads)
+        loads(jsonutils.dumps(raw)).AndReturn(raw)
+        self.mox.ReplayAll()
+
+        hosts = [fakes.FakeHostState('host1', 'compute',
+                    {'free_ram_mb': 1024,
+                     'capabilities': {'enabled': True}}),
+                 fakes.FakeHostState('host2', 'compute',
+                    {'free_ram_mb': 1023,
+                     'capabilities': {'enabled': True}}),
+                 fakes.FakeHostState('host3', 'compute',
+                    {'free_ram_mb': 1024,
+                     'capabilities': {'enabled': False}})]
+        self.assertEqual([True, False, False],
+                [filt_cls.host_passes(host, filter_properties)
+                 for host in hosts])
+        # A new filter instance reuses the compiled query
+        filt_cls = self.class_map['JsonFilter']()
+        self.assertTrue(filt_cls.host_passes(hosts[0], filter_properties))
+
     def test_trusted_filter_default_passes(self):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['TrustedFilter']()
@@ -1308,3 +1362,65 @@ class HostFiltersTestCase(test.TestCase):
                                    {'num_instances': 5})
         filter_properties = {}
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
+
+    def _assert_columns_match_host_passes(self, filter_name, hosts,
+                                          filter_properties):
+        filt_cls = self.class_map[filter_name]()
+        columns = host_columns.HostColumns(hosts)
+        mask = filt_cls.filter_columns(columns, filter_properties)
+        for passes, host in zip(mask, hosts):
+            self.assertEqual(passes,
+                             filt_cls.host_passes(host, filter_properties))
+        return mask
+
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_ram_filter_columns(self):
+        self.flags(ram_allocation_ratio=2.0)
+        filter_properties = {'instance_type': {'memory_mb': 1024}}
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                    {'free_ram_mb': free, 'total_usable_ram_mb': 1024})
+                 for i, free in enumerate((-1024, -1, 0, 2048))]
+        mask = self._assert_columns_match_host_passes('RamFilter', hosts,
+                filter_properties)
+        self.assertEqual([False, False, True, True], list(mask))
+        self.assertEqual(2048, hosts[2].limits['memory_mb'])
+        self.assertFalse('memory_mb' in hosts[1].limits)
+
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_disk_filter_columns(self):
+        self.flags(disk_allocation_ratio=1.0)
+        filter_properties = {'instance_type': {'root_gb': 2,
+                                               'ephemeral_gb': 1}}
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                    {'free_disk_mb': free * 1024, 'total_usable_disk_gb': 13})
+                 for i, free in enumerate((2, 3, 13))]
+        mask = self._assert_columns_match_host_passes('DiskFilter', hosts,
+                filter_properties)
+        self.assertEqual([False, True, True], list(mask))
+        self.assertEqual(13, hosts[1].limits['disk_gb'])
+
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_core_filter_columns(self):
+        self.flags(cpu_allocation_ratio=2)
+        filter_properties = {'instance_type': {'vcpus': 1}}
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                    {'vcpus_total': total, 'vcpus_used': used})
+                 for i, (total, used) in enumerate(((4, 7), (4, 8), (0, 8)))]
+        mask = self._assert_columns_match_host_passes('CoreFilter', hosts,
+                filter_properties)
+        self.assertEqual([True, False, True], list(mask))
+        self.assertEqual(8, hosts[1].limits['vcpu'])
+        self.assertFalse('vcpu' in hosts[2].limits)
+
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_io_ops_and_num_instances_filter_columns(self):
+        self.flags(max_io_ops_per_host=8, max_instances_per_host=5)
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                    {'num_io_ops': io_ops, 'num_instances': instances})
+                 for i, (io_ops, instances) in enumerate(((7, 5), (8, 4)))]
+        mask = self._assert_columns_match_host_passes('IoOpsFilter', hosts,
+                {})
+        self.assertEqual([True, False], list(mask))
+        mask = self._assert_columns_match_host_passes('NumInstancesFilter',
+                hosts, {})
+        self.assertEqual([False, True], list(mask))
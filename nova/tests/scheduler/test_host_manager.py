@@ -16,17 +16,24 @@
 Tests For HostManager
 """
 
+import datetime
 
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
 from nova import exception
+from nova import flags
 from nova.openstack.common import timeutils
+from nova.scheduler.filters import io_ops_filter
+from nova.scheduler import host_columns
 from nova.scheduler import host_manager
 from nova import test
 from nova.tests.scheduler import fakes
 
 
+FLAGS = flags.FLAGS
+
+
 class ComputeFilterClass1(object):
     def host_passes(self, *args, **kwargs):
         pass
@@ -88,6 +95,75 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(len(filtered_hosts), 1)
         self.assertEqual(filtered_hosts[0], fake_host2)
 
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_filter_host_columns(self):
+        self.flags(max_io_ops_per_host=8)
+        self.host_manager.filter_classes = [ComputeFilterClass1,
+                io_ops_filter.IoOpsFilter]
+        self.mox.StubOutWithMock(ComputeFilterClass1, 'host_passes')
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                                     {'num_io_ops': i * 4})
+                 for i in xrange(4)]
+        filter_properties = {'ignore_hosts': ['host0']}
+
+        # Only hosts passing the column filter are checked per host
+        ComputeFilterClass1.host_passes(hosts[1],
+                filter_properties).AndReturn(True)
+        self.mox.ReplayAll()
+        columns = self.host_manager.filter_host_columns(
+                host_columns.HostColumns(hosts), filter_properties,
+                filters=['ComputeFilterClass1', 'IoOpsFilter'])
+        self.assertEqual(columns.host_states, [hosts[1]])
+        self.assertEqual(list(columns.num_io_ops), [4])
+
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_filter_host_columns_force_hosts(self):
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute', {})
+                 for i in xrange(3)]
+        filter_properties = {'force_hosts': ['host1', 'host2'],
+                             'ignore_hosts': ['host2']}
+        columns = self.host_manager.filter_host_columns(
+                host_columns.HostColumns(hosts), filter_properties)
+        self.assertEqual(columns.host_states, [hosts[1]])
+
+    def test_claim_resources(self):
+        context = 'fake_context'
+        host_state = host_manager.HostState('host1', 'compute')
+        host_state.update_from_compute_node(dict(fakes.COMPUTE_NODES[0],
+                                                 free_disk_gb=512))
+        instance = dict(root_gb=10, ephemeral_gb=0, memory_mb=128, vcpus=1)
+
+        self.mox.StubOutWithMock(db, 'compute_node_claim_resources')
+        db.compute_node_claim_resources(context, 1,
+                dict(free_ram_mb=512, free_disk_gb=512, vcpus_used=1),
+                128, 10, 1).AndReturn(True)
+        self.mox.ReplayAll()
+
+        self.assertTrue(self.host_manager.claim_resources(context,
+                host_state, instance))
+        self.assertEqual(host_state.claim_baseline,
+                dict(free_ram_mb=384, free_disk_gb=502, vcpus_used=2))
+
+    def test_claim_resources_conflict(self):
+        context = 'fake_context'
+        host_state = host_manager.HostState('host1', 'compute')
+        host_state.update_from_compute_node(fakes.COMPUTE_NODES[0])
+        instance = dict(root_gb=10, ephemeral_gb=0, memory_mb=128, vcpus=1)
+        refreshed = dict(fakes.COMPUTE_NODES[0], free_ram_mb=256)
+
+        self.mox.StubOutWithMock(db, 'compute_node_claim_resources')
+        self.mox.StubOutWithMock(db, 'compute_node_get')
+        db.compute_node_claim_resources(context, 1,
+                dict(free_ram_mb=512, free_disk_gb=None, vcpus_used=1),
+                128, 10, 1).AndReturn(False)
+        db.compute_node_get(context, 1).AndReturn(refreshed)
+        self.mox.ReplayAll()
+
+        self.assertFalse(self.host_manager.claim_resources(context,
+                host_state, instance))
+        self.assertEqual(host_state.free_ram_mb, 256)
+        self.assertEqual(host_state.claim_baseline['free_ram_mb'], 256)
+
     def test_update_service_capabilities(self):
         service_states = self.host_manager.service_states
         self.assertDictMatch(service_states, {})
@@ -159,6 +235,95 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(host_states['host4'].free_disk_mb, 8388608)
 
 
+class CachingHostManagerTestCase(test.TestCase):
+    """Test case for CachingHostManager class"""
+
+    def setUp(self):
+        super(CachingHostManagerTestCase, self).setUp()
+        self.host_manager = host_manager.CachingHostManager()
+        self.context = 'fake_context'
+        self.now = timeutils.utcnow()
+        timeutils.set_time_override(self.now)
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _prime_cache(self):
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(self.context).AndReturn(
+                fakes.COMPUTE_NODES[:4])
+
+    def test_get_all_host_states_served_from_cache(self):
+        self._prime_cache()
+        self.mox.ReplayAll()
+
+        host_states = self.host_manager.get_all_host_states(self.context,
+                'compute')
+        self.assertEqual(len(host_states), 4)
+        host_states['host1'].consume_from_instance(fakes.INSTANCES[0])
+
+        # Within the refresh interval, no database access happens and
+        # the consumed resources are remembered.
+        timeutils.advance_time_seconds(1)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                'compute')
+        self.assertEqual(len(host_states), 4)
+        self.assertEqual(host_states['host1'].free_ram_mb, 0)
+
+    def test_get_all_host_states_incremental_refresh(self):
+        self._prime_cache()
+        updated = dict(fakes.COMPUTE_NODES[2], free_ram_mb=1024,
+                       updated_at=self.now)
+        deleted = dict(fakes.COMPUTE_NODES[3], deleted=True)
+        updated_since = self.now - datetime.timedelta(
+                seconds=FLAGS.scheduler_host_state_refresh_margin)
+        db.compute_node_get_all(self.context,
+                updated_since=updated_since).AndReturn([updated, deleted])
+        self.mox.StubOutWithMock(db, 'service_get_all_by_topic')
+        disabled = dict(fakes.COMPUTE_NODES[0]['service'], disabled=True)
+        db.service_get_all_by_topic(self.context, 'compute').AndReturn(
+                [disabled])
+        self.mox.ReplayAll()
+
+        host_states = self.host_manager.get_all_host_states(self.context,
+                'compute')
+        host3 = host_states['host3']
+        self.assertEqual(host3.free_ram_mb, 3072)
+
+        timeutils.advance_time_seconds(
+                FLAGS.scheduler_host_state_refresh_interval + 1)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                'compute')
+        self.assertEqual(len(host_states), 3)
+        self.assertTrue(host_states['host3'] is host3)
+        self.assertEqual(host3.free_ram_mb, 1024)
+        self.assertFalse('host4' in host_states)
+        self.assertTrue(host_states['host1'].service['disabled'])
+
+    def test_get_all_host_states_full_resync(self):
+        self._prime_cache()
+        db.compute_node_get_all(self.context).AndReturn(
+                fakes.COMPUTE_NODES[:2])
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(self.context, 'compute')
+        timeutils.advance_time_seconds(
+                FLAGS.scheduler_host_state_resync_interval + 1)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                'compute')
+        self.assertEqual(len(host_states), 2)
+
+    def test_update_service_capabilities_updates_cached_state(self):
+        self._prime_cache()
+        self.mox.ReplayAll()
+
+        host_states = self.host_manager.get_all_host_states(self.context,
+                'compute')
+        self.host_manager.update_service_capabilities('compute', 'host1',
+                dict(allowed_vm_type='hvm'))
+        self.assertEqual(host_states['host1'].allowed_vm_type, 'hvm')
+        self.assertEqual(host_states['host1'].service,
+                fakes.COMPUTE_NODES[0]['service'])
+
+
 class HostStateTestCase(test.TestCase):
     """Test case for HostState class"""
 
@@ -16,6 +16,7 @@
 Tests For Least Cost functions.
 """
 from nova import context
+from nova.scheduler import host_columns
 from nova.scheduler import host_manager
 from nova.scheduler import least_cost
 from nova import test
@@ -88,6 +89,30 @@ class LeastCostTestCase(test.TestCase):
         self.assertEqual(weighted_host.weight, 10512)
         self.assertEqual(weighted_host.host_state.host, 'host1')
 
+    @test.skip_unless(host_columns.is_available(), "numpy not available")
+    def test_weighted_sum_columns(self):
+        fn_tuples = [(1.0, offset), (1.0, scale),
+                     (-1.0, least_cost.compute_fill_first_cost_fn)]
+        hostinfo_list = self._get_all_hosts()
+        columns = host_columns.HostColumns(hostinfo_list)
+
+        # [offset, scale, fill_first]=
+        # [10512, 11024, 13072, 18192]
+        # [1024,  2048, 6144, 16384]
+        # [512, 1024, 3072, 8192]
+
+        # adjusted [ 1.0 * x + 1.0 * y - 1.0 * z] =
+        # [11024, 12048, 16144, 26384]
+
+        # so, host1 should win:
+        options = {}
+        weighted_host = least_cost.weighted_sum_columns(fn_tuples, columns,
+                options)
+        self.assertEqual(weighted_host.weight, 11024)
+        self.assertEqual(weighted_host.host_state.host, 'host1')
+        self.assertEqual(weighted_host.weight, least_cost.weighted_sum(
+                fn_tuples, hostinfo_list, options).weight)
+
 
 class TestWeightedHost(test.TestCase):
     def test_dict_conversion_without_host_state(self):
@@ -74,3 +74,65 @@ class ContextTestCase(test.TestCase):
         self.assertTrue(c)
         self.assertIn("'extra_arg1': 'meow'", info['log_msg'])
         self.assertIn("'extra_arg2': 'wuff'", info['log_msg'])
+
+    def test_elevated_shares_request_cache(self):
+        ctxt = context.RequestContext('111', '222')
+        ctxt.request_cache = context.RequestCache()
+        self.assertTrue(ctxt.elevated().request_cache is ctxt.request_cache)
+        self.assertFalse('request_cache' in ctxt.to_dict())
+
+
+class RequestCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RequestCacheTestCase, self).setUp()
+        self.ctxt = context.RequestContext('111', '222')
+        self.ctxt.request_cache = context.RequestCache()
+        self.calls = []
+
+    def _lookup(self, key):
+        self.calls.append(key)
+        return {'key': key, 'values': []}
+
+    def test_cached_lookup(self):
+        value = context.cached_lookup(self.ctxt, 'thing', 1,
+                                      self._lookup, 1)
+        value['values'].append('changed')
+        value = context.cached_lookup(self.ctxt, 'thing', 1,
+                                      self._lookup, 1)
+        context.cached_lookup(self.ctxt, 'thing', 2, self._lookup, 2)
+
+        self.assertEqual(value, {'key': 1, 'values': []})
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.ctxt.request_cache.hits, 1)
+        self.assertEqual(self.ctxt.request_cache.misses, 2)
+
+    def test_cached_lookup_without_cache(self):
+        self.ctxt.request_cache = None
+        context.cached_lookup(self.ctxt, 'thing', 1, self._lookup, 1)
+        context.cached_lookup(self.ctxt, 'thing', 1, self._lookup, 1)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_cached_lookup_per_visibility(self):
+        context.cached_lookup(self.ctxt, 'thing', 1, self._lookup, 1)
+        context.cached_lookup(self.ctxt.elevated(), 'thing', 1,
+                              self._lookup, 1)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_exceptions_not_cached(self):
+        def fail():
+            self.calls.append('fail')
+            raise ValueError()
+
+        for i in range(2):
+            self.assertRaises(ValueError, context.cached_lookup,
+                              self.ctxt, 'thing', 1, fail)
+        self.assertEqual(self.calls, ['fail', 'fail'])
+
+    def test_invalidate_cached(self):
+        context.cached_lookup(self.ctxt, 'thing', 1, self._lookup, 1)
+        context.cached_lookup(self.ctxt, 'other', 1, self._lookup, 1)
+        context.invalidate_cached(self.ctxt, 'thing')
+        context.cached_lookup(self.ctxt, 'thing', 1, self._lookup, 1)
+        context.cached_lookup(self.ctxt, 'other', 1, self._lookup, 1)
+        self.assertEqual(self.calls, [1, 1, 1])
@@ -21,8 +21,15 @@
 
 import datetime
 
+import mox
+from sqlalchemy import exc as sqla_exc
+
 from nova import context
 from nova import db
+from nova.db import query_stats
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session
 from nova import exception
 from nova import flags
 from nova.openstack.common import timeutils
@@ -143,6 +150,83 @@ class DbApiTestCase(test.TestCase):
                           self.context, {'display_name': '%test%'},
                           marker=str(utils.gen_uuid()))
 
+    def test_instance_get_all_by_filters_paginate_same_created_at(self):
+        now = timeutils.utcnow()
+        for i in xrange(5):
+            self.create_instances_with_args(display_name='test%d' % i,
+                                            created_at=now)
+
+        seen = []
+        marker = None
+        while True:
+            result = db.instance_get_all_by_filters(self.context, {},
+                                                    sort_dir='asc',
+                                                    limit=2, marker=marker)
+            if not result:
+                break
+            seen.extend(instance['display_name'] for instance in result)
+            marker = result[-1]['uuid']
+        self.assertEqual(['test%d' % i for i in xrange(5)], seen)
+
+    def test_instance_get_all_by_filters_exact_and_prefix(self):
+        self.create_instances_with_args(display_name='web1')
+        self.create_instances_with_args(display_name='web10')
+        self.create_instances_with_args(display_name='web_1')
+        self.create_instances_with_args(display_name='db1')
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': '^web1$'})
+        self.assertEqual(['web1'], [r['display_name'] for r in result])
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': '^web1'})
+        self.assertEqual(set(['web1', 'web10']),
+                         set(r['display_name'] for r in result))
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': '^web_'})
+        self.assertEqual(['web_1'], [r['display_name'] for r in result])
+
+    def test_instance_get_all_by_filters_prefix_is_case_sensitive(self):
+        self.create_instances_with_args(display_name='web1')
+        self.create_instances_with_args(display_name='Web2')
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': '^Web'})
+        self.assertEqual(['Web2'], [r['display_name'] for r in result])
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': '^WEB1$'})
+        self.assertEqual([], result)
+
+    def test_instance_get_all_by_filters_columns_to_join(self):
+        self.create_instances_with_args(metadata={'foo': 'bar'})
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                columns_to_join=[])
+        self.assertEqual(1, len(result))
+        self.assertFalse('metadata' in result[0].__dict__)
+        self.assertFalse('info_cache' in result[0].__dict__)
+        result = db.instance_get_all_by_filters(self.context, {})
+        self.assertTrue('metadata' in result[0].__dict__)
+
+    def test_regex_to_literal(self):
+        self.assertEqual(('web1', True), sqlalchemy_api._regex_to_literal(
+                '^web1$'))
+        self.assertEqual(('web1', False), sqlalchemy_api._regex_to_literal(
+                '^web1'))
+        self.assertEqual(('10.0.0.1', True),
+                         sqlalchemy_api._regex_to_literal('^10\\.0\\.0\\.1$'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('web1'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('^web.1'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('^web\\d'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('^web\\'))
+
+    def test_regex_to_like_prefix(self):
+        to_like = sqlalchemy_api._regex_to_like_prefix
+        self.assertEqual('10_0_0_1%', to_like('10.0.0.1'))
+        self.assertEqual('10.0.%', to_like('^10\\.0\\.'))
+        self.assertEqual('172_16_0%', to_like('172.16.0.*'))
+        self.assertEqual('10\\_%', to_like('10_'))
+        self.assertEqual('17%', to_like('17[23]'))
+        self.assertEqual('web%', to_like('web\\d'))
+        self.assertEqual(None, to_like('.*1034'))
+        self.assertEqual(None, to_like('10.0.0.1|10.0.0.2'))
+
     def test_migration_get_unconfirmed_by_dest_compute(self):
         ctxt = context.get_admin_context()
 
@@ -279,6 +363,44 @@ class DbApiTestCase(test.TestCase):
         self.assertEquals("building", old_ref["vm_state"])
         self.assertEquals("needscoffee", new_ref["vm_state"])
 
+    def test_instance_update_bulk(self):
+        ctxt = context.get_admin_context()
+        building = [db.instance_create(ctxt, {'vm_state': 'building'})
+                    for i in xrange(3)]
+        active = db.instance_create(ctxt, {'vm_state': 'active'})
+        uuids = [instance['uuid'] for instance in building + [active]]
+
+        results = db.instance_update_bulk(ctxt, uuids,
+                {'vm_state': 'error', 'expected_vm_state': 'building'})
+
+        self.assertEqual(set(instance['uuid'] for instance in building),
+                         set(new_ref['uuid'] for old_ref, new_ref in results))
+        for old_ref, new_ref in results:
+            self.assertEqual('building', old_ref['vm_state'])
+            self.assertEqual('error', new_ref['vm_state'])
+        for instance in building:
+            instance = db.instance_get_by_uuid(ctxt, instance['uuid'])
+            self.assertEqual('error', instance['vm_state'])
+        active = db.instance_get_by_uuid(ctxt, active['uuid'])
+        self.assertEqual('active', active['vm_state'])
+
+    def test_instance_update_bulk_expected_task_state_none(self):
+        ctxt = context.get_admin_context()
+        idle = db.instance_create(ctxt, {'task_state': None})
+        busy = db.instance_create(ctxt, {'task_state': 'rebooting'})
+
+        results = db.instance_update_bulk(ctxt, [idle['uuid'], busy['uuid']],
+                {'power_state': 4, 'expected_task_state': None})
+
+        self.assertEqual([idle['uuid']],
+                         [new_ref['uuid'] for old_ref, new_ref in results])
+        idle = db.instance_get_by_uuid(ctxt, idle['uuid'])
+        busy = db.instance_get_by_uuid(ctxt, busy['uuid'])
+        self.assertEqual(4, idle['power_state'])
+        self.assertNotEqual(4, busy['power_state'])
+        self.assertEqual([], db.instance_update_bulk(ctxt, [busy['uuid']],
+                {'power_state': 4, 'expected_task_state': None}))
+
     def test_instance_fault_create(self):
         """Ensure we can create an instance fault"""
         ctxt = context.get_admin_context()
@@ -405,6 +527,11 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(record['vif_address'], vif['address'])
         data = db.network_get_associated_fixed_ips(ctxt, 1, 'nothing')
         self.assertEqual(len(data), 0)
+        data = db.network_get_associated_fixed_ips(ctxt, 1,
+                                                   address=fixed_address)
+        self.assertEqual([fixed_address], [d['address'] for d in data])
+        data = db.network_get_associated_fixed_ips(ctxt, 1, address='qux')
+        self.assertEqual(len(data), 0)
 
     def _timeout_test(self, ctxt, timeout, multi_host):
         values = {'host': 'foo'}
@@ -961,6 +1088,47 @@ class CapacityTestCase(test.TestCase):
         self.assertEqual(2, int(stats['num_proj_12345']))
         self.assertEqual(3, int(stats['num_vm_building']))
 
+    def test_compute_node_get_all_updated_since(self):
+        now = timeutils.utcnow()
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+        item = self._create_helper('host1')
+
+        later = now + datetime.timedelta(seconds=10)
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=later)
+        self.assertEqual(0, len(nodes))
+
+        # A service heartbeat alone doesn't return the node
+        timeutils.advance_time_seconds(20)
+        db.service_update(self.ctxt, self.service['id'], {'report_count': 2})
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=later)
+        self.assertEqual(0, len(nodes))
+
+        db.compute_node_update(self.ctxt, item['id'],
+                               {'stats': dict(num_instances=4)})
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=later)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(item['id'], nodes[0]['id'])
+
+    def test_compute_node_claim_resources(self):
+        item = self._create_helper('host1')
+        expected = dict(free_ram_mb=1024, free_disk_gb=2048, vcpus_used=0)
+        self.assertTrue(db.compute_node_claim_resources(self.ctxt,
+                item['id'], expected, 512, 10, 1))
+
+        node = db.compute_node_get(self.ctxt, item['id'])
+        self.assertEqual(512, node['free_ram_mb'])
+        self.assertEqual(512, node['memory_mb_used'])
+        self.assertEqual(2038, node['free_disk_gb'])
+        self.assertEqual(10, node['local_gb_used'])
+        self.assertEqual(1, node['vcpus_used'])
+
+        # A second claim from the same stale view conflicts
+        self.assertFalse(db.compute_node_claim_resources(self.ctxt,
+                item['id'], expected, 512, 10, 1))
+        node = db.compute_node_get(self.ctxt, item['id'])
+        self.assertEqual(512, node['free_ram_mb'])
+
     def test_compute_node_update(self):
         item = self._create_helper('host1')
 
@@ -1041,6 +1209,34 @@ class TestIpAllocation(test.TestCase):
         self.assertEqual(fixed_ip.instance_uuid, self.instance.uuid)
         self.assertEqual(fixed_ip.network_id, self.network.id)
 
+    def test_fixed_ip_get_by_ip_filter(self):
+        vif = db.virtual_interface_create(self.ctxt,
+                {'address': 'fake_vif', 'instance_uuid': self.instance.uuid})
+        vif_params = {'instance_uuid': self.instance.uuid,
+                      'virtual_interface_id': vif.id}
+        self.create_fixed_ip(address='10.0.0.1', **vif_params)
+        address = self.create_fixed_ip(address='10.0.1.1', **vif_params)
+        db.floating_ip_create(self.ctxt,
+                {'address': '172.16.0.1',
+                 'fixed_ip_id': db.fixed_ip_get_by_address(self.ctxt,
+                                                           address).id})
+        # Not allocated to an instance
+        self.create_fixed_ip(address='10.0.0.2')
+
+        def get(**filters):
+            return [(f['address'], f['floating_ips']) for f in
+                    db.fixed_ip_get_by_ip_filter(self.ctxt, **filters)]
+
+        self.assertEqual([], get())
+        self.assertEqual([('10.0.0.1', [])], get(fixed_ip='10.0.0.1'))
+        self.assertEqual([('10.0.0.1', [])], get(ip='10.0.0.'))
+        self.assertEqual([('10.0.1.1', ['172.16.0.1'])], get(ip='172.16'))
+        self.assertEqual([('10.0.0.1', []), ('10.0.1.1', ['172.16.0.1'])],
+                         get(ip='.*1'))
+        self.assertEqual([], get(ip='192.168'))
+        result = db.fixed_ip_get_by_ip_filter(self.ctxt, fixed_ip='10.0.0.1')
+        self.assertEqual(self.instance.uuid, result[0]['instance_uuid'])
+
 
 class InstanceDestroyConstraints(test.TestCase):
 
@@ -1096,6 +1292,221 @@ def _get_sm_flavor_params():
     return params
 
 
+class SlaveConnectionTestCase(test.TestCase):
+    def setUp(self):
+        super(SlaveConnectionTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.engines = []
+
+        def fake_create_engine(sql_connection):
+            self.engines.append(sql_connection)
+            return session.get_engine()
+
+        self.stubs.Set(session, 'create_engine', fake_create_engine)
+        self.stubs.Set(session, '_SLAVE_ENGINE', None)
+        self.stubs.Set(session, '_SLAVE_MAKER', None)
+
+    def test_use_slave_without_slave_connection(self):
+        self.flags(slave_connection=None)
+        db.instance_type_get_all(self.context, use_slave=True)
+        self.assertEqual([], self.engines)
+
+    def test_use_slave(self):
+        self.flags(slave_connection='sqlite://slave')
+        db.instance_type_get_all(self.context)
+        self.assertEqual([], self.engines)
+        db.instance_type_get_all(self.context, use_slave=True)
+        db.quota_usage_get_all_by_project(self.context, 'fake',
+                                          use_slave=True)
+        self.assertEqual(['sqlite://slave'], self.engines)
+
+
+class QueryStatsTestCase(test.TestCase):
+    def setUp(self):
+        super(QueryStatsTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.flags(sql_query_stats=True)
+        self.engine = session.create_engine('sqlite://')
+        models.BASE.metadata.create_all(self.engine)
+        self.stubs.Set(session, '_ENGINE', self.engine)
+        self.stubs.Set(session, '_MAKER', session.get_maker(self.engine))
+        query_stats.reset_stats()
+        self.addCleanup(query_stats.reset_stats)
+
+    def _get_stats(self):
+        return dict((stats['name'], stats)
+                    for stats in query_stats.get_stats())
+
+    def test_scope(self):
+        with query_stats.scope('test'):
+            db.instance_type_get_all(self.context)
+            db.instance_type_get_all(self.context)
+            db.quota_usage_get_all_by_project(self.context, 'fake')
+        stats = self._get_stats()['test']
+        self.assertEqual(1, stats['count'])
+        self.assertEqual(3, stats['statements'])
+        functions = dict((f['function'], f['statements'])
+                         for f in stats['functions'])
+        self.assertEqual({'instance_type_get_all': 2,
+                          'quota_usage_get_all_by_project': 1}, functions)
+
+    def test_detached_scope(self):
+        with query_stats.scope('test'):
+            db.instance_type_get_all(self.context)
+            stats = query_stats.detach()
+        db.instance_type_get_all(self.context)
+        with query_stats.resume(stats):
+            db.instance_type_get_all(self.context)
+        self.assertEqual(['unscoped'], self._get_stats().keys())
+        query_stats.finish(stats)
+        stats = self._get_stats()['test']
+        self.assertEqual(1, stats['count'])
+        self.assertEqual(2, stats['statements'])
+
+    def test_statements_outside_db_api(self):
+        self.engine.execute('SELECT 1')
+        stats = self._get_stats()[query_stats.UNSCOPED]
+        self.assertEqual(1, stats['statements'])
+        self.assertEqual('nova.tests.test_db_api.'
+                         'test_statements_outside_db_api',
+                         stats['functions'][0]['function'])
+
+    def test_failed_statement(self):
+        conn = self.engine.connect()
+        self.assertRaises(sqla_exc.OperationalError, conn.execute,
+                          'SELECT * FROM missing')
+        self.assertEqual([], conn.info['query_stats_start'])
+        conn.execute('SELECT 1')
+        self.assertEqual([], conn.info['query_stats_start'])
+        conn.close()
+
+    def test_scope_disabled(self):
+        self.flags(sql_query_stats=False)
+        with query_stats.scope('test'):
+            db.instance_type_get_all(self.context)
+        self.assertEqual([], query_stats.get_stats())
+
+    def test_slow_query(self):
+        self.flags(sql_query_stats=False, sql_slow_query_time=0.000001)
+        self.mox.StubOutWithMock(query_stats.LOG, 'warn')
+        query_stats.LOG.warn(mox.IgnoreArg(), mox.ContainsKeyValue(
+                'function', 'instance_type_get_all'))
+        self.mox.ReplayAll()
+        db.instance_type_get_all(self.context)
+
+
+class TenantUsageRollupTestCase(test.TestCase):
+    def setUp(self):
+        super(TenantUsageRollupTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.begin = datetime.datetime(2012, 10, 1, 10)
+        self.hour = datetime.timedelta(hours=1)
+
+    def _usage(self, hours):
+        return dict(instances=1, total_hours=hours,
+                    total_local_gb_usage=10 * hours,
+                    total_vcpus_usage=2 * hours,
+                    total_memory_mb_usage=512 * hours)
+
+    def _roll_up(self, hours_from_begin, usages):
+        period_beginning = self.begin + hours_from_begin * self.hour
+        return db.tenant_usage_rollup_create_safe(
+                self.context, period_beginning,
+                period_beginning + self.hour, usages)
+
+    def test_create_safe(self):
+        totals = self._roll_up(0, {'project1': self._usage(1),
+                                   'project2': self._usage(0.5)})
+        self.assertEqual(totals['instances'], 2)
+        self.assertEqual(totals['total_hours'], 1.5)
+
+        # The period can't be rolled up twice
+        self.assertEqual(self._roll_up(0, {'project3': self._usage(1)}),
+                         None)
+        totals = db.tenant_usage_rollup_get_totals(
+                self.context, self.begin, self.begin + self.hour)
+        self.assertEqual(sorted(usage['tenant_id'] for usage in totals),
+                         ['project1', 'project2'])
+
+    def test_get_periods(self):
+        self._roll_up(2, {})
+        self._roll_up(0, {'project1': self._usage(1)})
+        self._roll_up(5, {'project1': self._usage(1)})
+
+        periods = db.tenant_usage_rollup_get_periods(
+                self.context, self.begin, self.begin + 5 * self.hour)
+        self.assertEqual(periods, [(self.begin, self.begin + self.hour),
+                                   (self.begin + 2 * self.hour,
+                                    self.begin + 3 * self.hour)])
+
+    def test_get_totals(self):
+        self._roll_up(0, {'project1': self._usage(1),
+                          'project2': self._usage(0.5)})
+        self._roll_up(1, {'project1': self._usage(1)})
+        self._roll_up(2, {'project1': self._usage(1)})
+
+        totals = db.tenant_usage_rollup_get_totals(
+                self.context, self.begin, self.begin + 2 * self.hour)
+        totals = dict((usage['tenant_id'], usage) for usage in totals)
+        self.assertEqual(totals['project1']['total_hours'], 2)
+        self.assertEqual(totals['project1']['total_memory_mb_usage'], 1024)
+        self.assertEqual(totals['project2']['total_vcpus_usage'], 1)
+
+        totals = db.tenant_usage_rollup_get_totals(
+                self.context, self.begin, self.begin + 2 * self.hour,
+                project_id='project2')
+        self.assertEqual([usage['tenant_id'] for usage in totals],
+                         ['project2'])
+
+    def test_get_totals_by_window(self):
+        flavor = db.instance_type_get_by_name(self.context, 'm1.small')
+        gone = db.instance_type_create(self.context,
+                                       dict(name='gone', memory_mb=64,
+                                            vcpus=1, root_gb=1,
+                                            ephemeral_gb=0, flavorid='gone',
+                                            swap=0, rxtx_factor=1))
+        db.instance_type_destroy(self.context, 'gone')
+        begin = self.begin + datetime.timedelta(minutes=15)
+        end = begin + self.hour
+
+        def create(project_id, launched_at, terminated_at=None,
+                   instance_type=flavor):
+            db.instance_create(self.context,
+                               dict(project_id=project_id,
+                                    instance_type_id=instance_type['id'],
+                                    launched_at=launched_at,
+                                    terminated_at=terminated_at))
+
+        create('project1', self.begin)
+        create('project1', self.begin - self.hour)
+        create('project1', begin + datetime.timedelta(minutes=30))
+        create('project2', self.begin, begin + datetime.timedelta(minutes=6))
+        # Not billed during the window
+        create('project2', self.begin, begin)
+        create('project2', end)
+        create('project2', None)
+        create('project3', self.begin, instance_type=gone)
+
+        totals = db.tenant_usage_get_totals_by_window(self.context, begin,
+                                                      end)
+        totals = dict((usage['tenant_id'], usage) for usage in totals)
+        self.assertEqual(sorted(totals), ['project1', 'project2'])
+        self.assertAlmostEqual(totals['project1']['total_hours'], 2.5)
+        self.assertAlmostEqual(totals['project1']['total_memory_mb_usage'],
+                               2.5 * flavor['memory_mb'])
+        self.assertAlmostEqual(totals['project1']['total_local_gb_usage'],
+                               2.5 * (flavor['root_gb'] +
+                                      flavor['ephemeral_gb']))
+        self.assertAlmostEqual(totals['project2']['total_hours'], 0.1)
+        self.assertAlmostEqual(totals['project2']['total_vcpus_usage'],
+                               0.1 * flavor['vcpus'])
+
+        totals = db.tenant_usage_get_totals_by_window(
+                self.context, begin, end, project_id='project2')
+        self.assertEqual([usage['tenant_id'] for usage in totals],
+                         ['project2'])
+
+
 class SMVolumeDBApiTestCase(test.TestCase):
     def setUp(self):
         super(SMVolumeDBApiTestCase, self).setUp()
@@ -17,6 +17,7 @@
 #    under the License.
 """Unit Tests for network code."""
 
+from nova import exception
 from nova.network import linux_net
 from nova import test
 
@@ -170,3 +171,170 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('[0:0] -A %s -j %s-%s' %
                             (chain, self.binary_name, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+
+class IptablesManagerApplyTestCase(test.TestCase):
+
+    def setUp(self):
+        super(IptablesManagerApplyTestCase, self).setUp()
+        self.flags(use_ipv6=False)
+        self.saved = {'filter': IptablesManagerTestCase.sample_filter,
+                      'nat': IptablesManagerTestCase.sample_nat}
+        self.restores = []
+        self.manager = linux_net.IptablesManager(execute=self.fake_execute)
+        self.binary_name = linux_net.binary_name
+
+    def fake_execute(self, *cmd, **kwargs):
+        if cmd[0] == 'iptables-save':
+            return '\n'.join(self.saved[cmd[-1]]), ''
+        self.assertEqual('iptables-restore', cmd[0])
+        lines = kwargs['process_input'].split('\n')
+        self.restores.append((cmd, lines))
+        table = [line for line in lines if line.startswith('*')][0][1:]
+        if '--noflush' not in cmd:
+            self.saved[table] = lines
+            return '', ''
+        # Flush the declared chains, then append and delete
+        saved = self.saved[table][:-1]
+        commit = self.saved[table][-1]
+        for line in lines[1:]:
+            if line.startswith(':'):
+                chain = line[1:].split(' ')[0]
+                saved = [l for l in saved
+                         if ' -A %s ' % chain not in l and
+                         not l.startswith(':%s ' % chain)]
+                saved.append(line)
+            elif line.startswith('-X'):
+                chain = line.split(' ')[1]
+                saved.remove(':%s - [0:0]' % chain)
+            elif line.startswith('['):
+                saved.append(line)
+        self.saved[table] = saved + [commit]
+        return '', ''
+
+    def test_first_apply_rebuilds_tables(self):
+        self.manager.apply()
+        self.assertEqual(2, len(self.restores))
+        for cmd, lines in self.restores:
+            self.assertEqual(('iptables-restore', '-c'), cmd)
+
+    def test_apply_rewrites_changed_chains(self):
+        self.manager.apply()
+        self.restores = []
+
+        table = self.manager.ipv4['filter']
+        table.add_chain('inst-1')
+        table.add_rule('inst-1', '-s 10.0.0.1 -j ACCEPT')
+        table.add_rule('local', '-d 10.0.0.2 -j $inst-1')
+        self.manager.apply()
+
+        self.assertEqual(1, len(self.restores))
+        cmd, lines = self.restores[0]
+        self.assertEqual(('iptables-restore', '-c', '--noflush'), cmd)
+        self.assertEqual(['*filter',
+                          ':%s-inst-1 - [0:0]' % self.binary_name,
+                          ':%s-local - [0:0]' % self.binary_name,
+                          '[0:0] -A %s-inst-1 -s 10.0.0.1 -j ACCEPT' %
+                          self.binary_name,
+                          '[0:0] -A %s-local -d 10.0.0.2 -j %s-inst-1' %
+                          (self.binary_name, self.binary_name),
+                          'COMMIT', ''], lines)
+
+        # Nothing changed, nothing to restore
+        self.restores = []
+        self.manager.apply()
+        self.assertEqual([], self.restores)
+
+        table.remove_chain('inst-1')
+        self.manager.apply()
+        self.assertEqual(1, len(self.restores))
+        cmd, lines = self.restores[0]
+        self.assertEqual(('iptables-restore', '-c', '--noflush'), cmd)
+        self.assertEqual(['*filter',
+                          ':%s-local - [0:0]' % self.binary_name,
+                          ':%s-inst-1 - [0:0]' % self.binary_name,
+                          '-X %s-inst-1' % self.binary_name,
+                          'COMMIT', ''], lines)
+
+    def test_apply_rebuilds_on_unwrapped_changes(self):
+        self.manager.apply()
+        self.restores = []
+
+        table = self.manager.ipv4['filter']
+        table.add_rule('FORWARD', '-j ACCEPT', wrap=False)
+        self.manager.apply()
+        self.assertEqual([('iptables-restore', '-c')],
+                         [cmd for cmd, lines in self.restores])
+
+    def test_apply_rebuilds_missing_chains(self):
+        self.manager.apply()
+        self.restores = []
+
+        # Flushed behind our back
+        self.saved['filter'] = IptablesManagerTestCase.sample_filter
+        self.manager.ipv4['filter'].add_rule('local', '-j DROP')
+        self.manager.apply()
+        self.assertEqual([('iptables-restore', '-c')],
+                         [cmd for cmd, lines in self.restores])
+        self.assertTrue('[0:0] -A %s-local -j DROP' % self.binary_name in
+                        self.restores[0][1])
+
+    def test_apply_rebuilds_when_restore_fails(self):
+        self.manager.apply()
+        self.restores = []
+
+        def fake_execute(*cmd, **kwargs):
+            if '--noflush' in cmd:
+                raise exception.ProcessExecutionError()
+            return self.fake_execute(*cmd, **kwargs)
+
+        self.manager.execute = fake_execute
+        self.manager.ipv4['filter'].add_rule('local', '-j DROP')
+        self.manager.apply()
+        self.assertEqual([('iptables-restore', '-c')],
+                         [cmd for cmd, lines in self.restores])
+
+
+class IpsetManagerTestCase(test.TestCase):
+    def setUp(self):
+        super(IpsetManagerTestCase, self).setUp()
+        self.restores = []
+        self.manager = linux_net.IpsetManager(execute=self.fake_execute)
+
+    def fake_execute(self, *cmd, **kwargs):
+        if cmd == ('ipset', '-exist', 'restore'):
+            self.restores.append(kwargs['process_input'].splitlines())
+        else:
+            self.restores.append(list(cmd))
+        return '', ''
+
+    def test_update_set_creates_set(self):
+        self.manager.update_set('nova-sg-1-v4', ['10.0.0.2', '10.0.0.1'])
+        self.assertEqual([['create nova-sg-1-v4 hash:ip family inet',
+                           'flush nova-sg-1-v4',
+                           'add nova-sg-1-v4 10.0.0.1',
+                           'add nova-sg-1-v4 10.0.0.2']], self.restores)
+
+    def test_update_set_only_passes_changes(self):
+        self.manager.update_set('nova-sg-1-v6', ['fe80::1', 'fe80::2'],
+                                family='inet6')
+        self.restores = []
+
+        self.manager.update_set('nova-sg-1-v6', ['fe80::2', 'fe80::3'],
+                                family='inet6')
+        self.assertEqual([['add nova-sg-1-v6 fe80::3',
+                           'del nova-sg-1-v6 fe80::1']], self.restores)
+
+        self.manager.update_set('nova-sg-1-v6', ['fe80::3', 'fe80::2'],
+                                family='inet6')
+        self.assertEqual(1, len(self.restores))
+
+    def test_destroy_set(self):
+        self.manager.update_set('nova-sg-1-v4', [])
+        self.restores = []
+
+        self.manager.destroy_set('nova-sg-1-v4')
+        self.manager.destroy_set('nova-sg-1-v4')
+        self.assertEqual([['ipset', 'destroy', 'nova-sg-1-v4']],
+                         self.restores)
+        self.assertEqual({}, self.manager.sets)
@@ -37,6 +37,7 @@ from nova import context
 from nova import db
 from nova import exception
 from nova import flags
+from nova.network import linux_net
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
@@ -3149,6 +3150,221 @@ class IptablesFirewallTestCase(test.TestCase):
         self.mox.ReplayAll()
         self.fw.do_refresh_security_group_rules("fake")
 
+    def _stub_out_scheduled_refresh(self):
+        self.flags(firewall_refresh_delay=10)
+        self.scheduled = []
+        self.refreshed = []
+
+        def fake_spawn_after(delay, func):
+            self.assertEqual(10, delay)
+            self.scheduled.append(func)
+
+        def fake_do_refresh_instance_rules(instance):
+            self.refreshed.append(instance['id'])
+
+        def fake_do_refresh_security_group_rules(security_group):
+            self.refreshed.append('all')
+
+        def fake_apply():
+            self.refreshed.append('apply')
+
+        self.stubs.Set(base_firewall.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        self.stubs.Set(self.fw, 'do_refresh_instance_rules',
+                       fake_do_refresh_instance_rules)
+        self.stubs.Set(self.fw, 'do_refresh_security_group_rules',
+                       fake_do_refresh_security_group_rules)
+        self.stubs.Set(self.fw.iptables, 'apply', fake_apply)
+
+    def test_security_group_refreshes_are_coalesced(self):
+        self._stub_out_scheduled_refresh()
+        self.fw.instances = {1: {'id': 1}}
+
+        self.fw.refresh_security_group_members('fake')
+        self.fw.refresh_security_group_rules('fake')
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.assertEqual(1, len(self.scheduled))
+        self.assertEqual([], self.refreshed)
+
+        self.scheduled.pop()()
+        self.assertEqual(['all', 'apply'], self.refreshed)
+        self.assertEqual(3, self.fw.refresh_stats['requests'])
+        self.assertEqual(1, self.fw.refresh_stats['refreshes'])
+
+        # Later refreshes are scheduled again
+        self.fw.refresh_security_group_members('fake')
+        self.assertEqual(1, len(self.scheduled))
+
+    def test_instance_refreshes_are_coalesced(self):
+        self._stub_out_scheduled_refresh()
+        self.fw.instances = {1: {'id': 1}, 2: {'id': 2}}
+
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.fw.refresh_instance_security_rules({'id': 2})
+        self.fw.refresh_instance_security_rules({'id': 1})
+        # Not filtered on this host
+        self.fw.refresh_instance_security_rules({'id': 3})
+        self.assertEqual(1, len(self.scheduled))
+
+        self.scheduled.pop()()
+        self.assertEqual([1, 2, 'apply'], self.refreshed)
+        self.assertEqual(4, self.fw.refresh_stats['requests'])
+
+    def test_failed_refresh_is_retried(self):
+        self._stub_out_scheduled_refresh()
+        self.fw.instances = {1: {'id': 1}, 2: {'id': 2}}
+
+        fake_apply = self.fw.iptables.apply
+        failures = [exception.ProcessExecutionError()]
+
+        def fail_once():
+            if failures:
+                raise failures.pop()
+            fake_apply()
+
+        self.stubs.Set(self.fw.iptables, 'apply', fail_once)
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.scheduled.pop()()
+        self.assertEqual([1], self.refreshed)
+        self.assertEqual(1, len(self.scheduled))
+        self.refreshed = []
+        self.assertEqual(0, self.fw.refresh_stats['refreshes'])
+
+        # Requested while the failed refresh was pending a retry
+        self.fw.refresh_instance_security_rules({'id': 2})
+        self.assertEqual(1, len(self.scheduled))
+
+        self.scheduled.pop()()
+        self.assertEqual([1, 2, 'apply'], self.refreshed)
+        self.assertEqual(2, self.fw.refresh_stats['requests'])
+        self.assertEqual(1, self.fw.refresh_stats['refreshes'])
+
+    def test_failed_refreshes_back_off(self):
+        self._stub_out_scheduled_refresh()
+        self.fw.instances = {1: {'id': 1}}
+        delays = []
+
+        def fake_spawn_after(delay, func):
+            delays.append(delay)
+            self.scheduled.append(func)
+
+        def fail_apply():
+            raise exception.ProcessExecutionError()
+
+        self.stubs.Set(base_firewall.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        self.stubs.Set(self.fw.iptables, 'apply', fail_apply)
+        self.fw.refresh_instance_security_rules({'id': 1})
+        for i in xrange(5):
+            self.scheduled.pop()()
+        self.assertEqual([10, 10, 20, 40, 60, 60], delays)
+
+        # A successful refresh resets the delay
+        self.stubs.Set(self.fw.iptables, 'apply', lambda: None)
+        self.scheduled.pop()()
+        self.assertEqual([], self.scheduled)
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.assertEqual(10, delays[-1])
+
+    def test_grantee_groups_are_matched_with_ipsets(self):
+        instance_ref = self._create_instance_ref()
+        src_instance_ref = self._create_instance_ref()
+
+        admin_ctxt = context.get_admin_context()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        src_secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': 'testsourcegroup',
+                                                 'description': 'src group'})
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'group_id': src_secgroup['id']})
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+        db.instance_add_security_group(admin_ctxt, src_instance_ref['uuid'],
+                                       src_secgroup['id'])
+
+        network_model = _fake_network_info(self.stubs, 1, spectacular=True)
+        _fake_stub_out_get_nw_info(self.stubs, lambda *a, **kw: network_model)
+        network_info = network_model.legacy()
+
+        restores = []
+
+        def fake_ipset_execute(*cmd, **kwargs):
+            restores.append(kwargs.get('process_input'))
+            return '', ''
+
+        self.fw.ipset = linux_net.IpsetManager(execute=fake_ipset_execute)
+        inst_ipv4, inst_ipv6 = self.fw.instance_rules(instance_ref,
+                                                      network_info)
+
+        name = 'nova-sg-%s-v4' % src_secgroup['id']
+        ips = set(ip['address'] for ip in network_model.fixed_ips()
+                  if ip['version'] == 4)
+        self.assertTrue('-j ACCEPT -m set --match-set %s src' % name
+                        in inst_ipv4)
+        for ip in ips:
+            self.assertFalse('-j ACCEPT -s %s' % ip in inst_ipv4)
+        self.assertEqual(ips, self.fw.ipset.sets[name])
+        self.assertEqual(set([name]),
+                         self.fw.instance_ipsets[instance_ref['id']])
+        self.assertEqual(1, len(restores))
+
+        # The members of a known set are not looked up again
+        self.fw.instance_rules(instance_ref, network_info)
+        self.assertEqual(1, len(restores))
+
+        self.fw.remove_filters_for_instance(instance_ref)
+        self.fw.purge_ipsets()
+        self.assertEqual({}, self.fw.ipset.sets)
+
+    def test_member_refreshes_only_update_ipsets(self):
+        self._stub_out_scheduled_refresh()
+        self.fw.instances = {1: {'id': 1}}
+        self.fw.ipset = linux_net.IpsetManager(execute=lambda *a, **kw: None)
+        refreshed_groups = []
+        self.stubs.Set(self.fw, 'do_refresh_security_group_ipsets',
+                       refreshed_groups.append)
+
+        self.fw.refresh_security_group_members('fake')
+        self.fw.refresh_security_group_members('fake')
+        self.assertEqual(1, len(self.scheduled))
+
+        self.scheduled.pop()()
+        self.assertEqual(['fake'], refreshed_groups)
+        self.assertEqual([], self.refreshed)
+
+    def test_member_refreshes_skip_deleted_groups(self):
+        self._stub_out_scheduled_refresh()
+        self.fw.ipset = linux_net.IpsetManager(execute=lambda *a, **kw: None)
+        for security_group_id in (1, 2):
+            name = self.fw._security_group_ipset_name(security_group_id, 4)
+            self.fw.ipset.sets[name] = set()
+
+        def fake_security_group_get(context, security_group_id):
+            if security_group_id == 1:
+                raise exception.SecurityGroupNotFound(
+                        security_group_id=security_group_id)
+            return {'id': security_group_id}
+
+        updated = []
+        self.stubs.Set(db, 'security_group_get', fake_security_group_get)
+        self.stubs.Set(self.fw, '_update_ipset',
+                       lambda ctxt, group, version: updated.append(
+                               group['id']))
+
+        self.fw.refresh_security_group_members(1)
+        self.fw.refresh_security_group_members(2)
+        self.scheduled.pop()()
+        self.assertEqual([2], updated)
+        self.assertEqual([], self.scheduled)
+        self.assertEqual(2, self.fw.refresh_stats['requests'])
+
     def test_unfilter_instance_undefines_nwfilter(self):
         admin_ctxt = context.get_admin_context()
 
@@ -32,6 +32,7 @@ from nova import quota
 from nova.scheduler import driver as scheduler_driver
 from nova import test
 import nova.tests.image.fake
+from nova import utils
 from nova import volume
 
 
@@ -331,6 +332,9 @@ class FakeDriver(object):
     def expire(self, context):
         self.called.append(('expire', context))
 
+    def invalidate(self, context, project_id=None, quota_class=None):
+        self.called.append(('invalidate', context, project_id, quota_class))
+
 
 class BaseResourceTestCase(test.TestCase):
     def test_no_flag(self):
@@ -705,6 +709,16 @@ class QuotaEngineTestCase(test.TestCase):
                 ('expire', context),
                 ])
 
+    def test_invalidate(self):
+        context = FakeContext(None, None)
+        driver = FakeDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.invalidate(context, project_id='test_project')
+
+        self.assertEqual(driver.called, [
+                ('invalidate', context, 'test_project', None),
+                ])
+
     def test_resources(self):
         quota_obj = self._make_quota_obj(None)
 
@@ -825,7 +839,7 @@ class DbQuotaDriverTestCase(test.TestCase):
                 injected_file_path_bytes=127,
                 )
 
-        def fake_qugabp(context, project_id):
+        def fake_qugabp(context, project_id, use_slave=False):
             self.calls.append('quota_usage_get_all_by_project')
             self.assertEqual(project_id, 'test_project')
             return dict(
@@ -1386,6 +1400,271 @@ class DbQuotaDriverTestCase(test.TestCase):
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
 
+class CachedDbQuotaDriverTestCase(test.TestCase):
+    def setUp(self):
+        super(CachedDbQuotaDriverTestCase, self).setUp()
+
+        self.flags(quota_instances=10,
+                   quota_cores=20,
+                   quota_cache_ttl=30,
+                   until_refresh=0,
+                   max_age=0)
+
+        self.driver = quota.CachedDbQuotaDriver()
+        self.calls = []
+
+        def fake_get_project_quotas(context, resources, project_id,
+                                    quota_class=None, defaults=True,
+                                    usages=True):
+            self.calls.append(('get_project_quotas', project_id,
+                               quota_class))
+            return dict((k, dict(limit=v.default))
+                        for k, v in resources.items())
+
+        self.stubs.Set(self.driver, 'get_project_quotas',
+                       fake_get_project_quotas)
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _get_quotas(self, project_id='test_project',
+                    quota_class='test_class'):
+        return self.driver._get_quotas(FakeContext(project_id, quota_class),
+                                       quota.QUOTAS._resources,
+                                       ['instances', 'cores'], True)
+
+    def test_get_quotas_cached(self):
+        self.assertEqual(self._get_quotas(), dict(instances=10, cores=20))
+        self.assertEqual(self._get_quotas(), dict(instances=10, cores=20))
+        self.assertEqual(self.calls, [
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ])
+
+    def test_get_quotas_cached_per_project(self):
+        self._get_quotas()
+        self._get_quotas(project_id='other_project')
+        self.assertEqual(self.calls, [
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ('get_project_quotas', 'other_project', 'test_class'),
+                ])
+
+    def test_get_quotas_expired(self):
+        self._get_quotas()
+        timeutils.advance_time_seconds(31)
+        self._get_quotas()
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidate_project(self):
+        self._get_quotas()
+        self._get_quotas(project_id='other_project')
+        self.driver.invalidate(None, project_id='test_project')
+        self._get_quotas()
+        self._get_quotas(project_id='other_project')
+        self.assertEqual(self.calls, [
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ('get_project_quotas', 'other_project', 'test_class'),
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ])
+
+    def test_invalidate_quota_class(self):
+        self._get_quotas()
+        self._get_quotas(quota_class='other_class')
+        self.driver.invalidate(None, quota_class='test_class')
+        self._get_quotas()
+        self._get_quotas(quota_class='other_class')
+        self.assertEqual(self.calls, [
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ('get_project_quotas', 'test_project', 'other_class'),
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ])
+
+    def test_reserve(self):
+        def fake_quota_reserve_delta(context, resources, quotas, deltas,
+                                     expire, until_refresh, max_age):
+            self.calls.append(('quota_reserve_delta', quotas, deltas))
+            return ['resv-1']
+
+        self.stubs.Set(db, 'quota_reserve_delta', fake_quota_reserve_delta)
+        result = self.driver.reserve(FakeContext('test_project',
+                                                 'test_class'),
+                                     quota.QUOTAS._resources,
+                                     dict(instances=2))
+
+        self.assertEqual(self.calls, [
+                ('get_project_quotas', 'test_project', 'test_class'),
+                ('quota_reserve_delta', dict(instances=10),
+                 dict(instances=2)),
+                ])
+        self.assertEqual(result, ['resv-1'])
+
+
+class QuotaReserveDeltaTestCase(test.TestCase):
+    def setUp(self):
+        super(QuotaReserveDeltaTestCase, self).setUp()
+
+        self.context = context.RequestContext('fake', 'fake')
+        self.admin_context = self.context.elevated()
+        self.expire = timeutils.utcnow() + datetime.timedelta(seconds=3600)
+        self.synced = []
+
+        def make_sync(res_name):
+            def sync(context, project_id, session):
+                self.synced.append(res_name)
+                return {res_name: 1}
+            return sync
+
+        self.resources = {}
+        for res_name in ('instances', 'cores'):
+            res = quota.ReservableResource(res_name, make_sync(res_name))
+            self.resources[res_name] = res
+
+        for res_name in ('instances', 'cores'):
+            db.quota_usage_create(self.admin_context, 'fake', res_name,
+                                  1, 0, None)
+
+    def _reserve(self, quotas, deltas, until_refresh=0, max_age=0):
+        return db.quota_reserve_delta(self.context, self.resources, quotas,
+                                      deltas, self.expire, until_refresh,
+                                      max_age)
+
+    def _get_usages(self):
+        usages = db.quota_usage_get_all_by_project(self.context, 'fake')
+        del usages['project_id']
+        return usages
+
+    def test_reserve(self):
+        result = self._reserve(dict(instances=10, cores=20),
+                               dict(instances=2, cores=4))
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(self.synced, [])
+        self.assertEqual(self._get_usages(), dict(
+                instances=dict(in_use=1, reserved=2),
+                cores=dict(in_use=1, reserved=4)))
+
+        db.reservation_commit(self.context, result)
+        self.assertEqual(self._get_usages(), dict(
+                instances=dict(in_use=3, reserved=0),
+                cores=dict(in_use=5, reserved=0)))
+
+    def test_reserve_negative_delta(self):
+        self._reserve(dict(instances=10), dict(instances=-1))
+
+        self.assertEqual(self.synced, [])
+        self.assertEqual(self._get_usages()['instances'],
+                         dict(in_use=1, reserved=0))
+
+    def test_reserve_unlimited(self):
+        self._reserve(dict(instances=-1), dict(instances=100))
+
+        self.assertEqual(self._get_usages()['instances'],
+                         dict(in_use=1, reserved=100))
+
+    def test_reserve_over_quota(self):
+        self._reserve(dict(instances=10), dict(instances=5))
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          dict(instances=10), dict(instances=5))
+        self.assertEqual(self._get_usages()['instances'],
+                         dict(in_use=1, reserved=5))
+
+    def test_reserve_missing_usage(self):
+        db.quota_usage_destroy(self.admin_context, 'fake', 'cores')
+        self._reserve(dict(cores=20), dict(cores=4))
+
+        self.assertEqual(self.synced, ['cores'])
+        self.assertEqual(self._get_usages()['cores'],
+                         dict(in_use=1, reserved=4))
+
+    def test_reserve_until_refresh(self):
+        db.quota_usage_update(self.admin_context, 'fake', 'instances',
+                              1, 0, 2)
+        self._reserve(dict(instances=10), dict(instances=1),
+                      until_refresh=2)
+        self.assertEqual(self.synced, [])
+        self._reserve(dict(instances=10), dict(instances=1),
+                      until_refresh=2)
+        self.assertEqual(self.synced, ['instances'])
+
+
+class ReservationSqlAlchemyTestCase(test.TestCase):
+    def setUp(self):
+        super(ReservationSqlAlchemyTestCase, self).setUp()
+
+        self.context = context.RequestContext('fake', 'fake')
+        self.admin_context = self.context.elevated()
+        self.expire = timeutils.utcnow() + datetime.timedelta(seconds=60)
+
+        self.usages = {}
+        for res_name in ('instances', 'cores'):
+            usage = db.quota_usage_create(self.admin_context, 'fake',
+                                          res_name, 1, 0, None)
+            self.usages[res_name] = usage
+
+    def _reserve(self, resource, delta, expire=None):
+        uuid = str(utils.gen_uuid())
+        usage = self.usages[resource]
+        db.reservation_create(self.admin_context, uuid, usage, 'fake',
+                              resource, delta, expire or self.expire)
+        if delta > 0:
+            db.quota_usage_update(self.admin_context, 'fake', resource,
+                                  usage.in_use, usage.reserved + delta,
+                                  None)
+            usage.reserved += delta
+        return uuid
+
+    def _get_usages(self):
+        usages = db.quota_usage_get_all_by_project(self.context, 'fake')
+        del usages['project_id']
+        return usages
+
+    def test_reservation_commit(self):
+        reservations = [self._reserve('instances', 2),
+                        self._reserve('cores', 4),
+                        self._reserve('cores', -1)]
+        db.reservation_commit(self.context, reservations)
+
+        self.assertEqual(self._get_usages(), dict(
+                instances=dict(in_use=3, reserved=0),
+                cores=dict(in_use=4, reserved=0)))
+        self.assertRaises(exception.ReservationNotFound,
+                          db.reservation_get, self.context, reservations[0])
+
+    def test_reservation_rollback(self):
+        reservations = [self._reserve('instances', 2),
+                        self._reserve('cores', -1)]
+        db.reservation_rollback(self.context, reservations)
+
+        self.assertEqual(self._get_usages(), dict(
+                instances=dict(in_use=1, reserved=0),
+                cores=dict(in_use=1, reserved=0)))
+        self.assertRaises(exception.ReservationNotFound,
+                          db.reservation_get, self.context, reservations[0])
+
+    def test_reservation_commit_twice(self):
+        reservations = [self._reserve('instances', 2)]
+        db.reservation_commit(self.context, reservations)
+        db.reservation_commit(self.context, reservations)
+
+        self.assertEqual(self._get_usages()['instances'],
+                         dict(in_use=3, reserved=0))
+
+    def test_reservation_expire(self):
+        expired = timeutils.utcnow() - datetime.timedelta(seconds=1)
+        reservations = [self._reserve('instances', 1, expire=expired)
+                        for i in xrange(5)]
+        current = self._reserve('cores', 2)
+
+        sqa_api.reservation_expire(self.admin_context, batch_size=2)
+
+        self.assertEqual(self._get_usages(), dict(
+                instances=dict(in_use=1, reserved=0),
+                cores=dict(in_use=1, reserved=2)))
+        for uuid in reservations:
+            self.assertRaises(exception.ReservationNotFound,
+                              db.reservation_get, self.context, uuid)
+        db.reservation_get(self.context, current)
+
+
 class FakeSession(object):
     def begin(self):
         return self
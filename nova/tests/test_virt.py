@@ -15,15 +15,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import os
 import platform
 
 from nova import exception
 from nova import flags
+from nova.image import glance
 from nova import test
 from nova import utils
 from nova.virt.disk import api as disk_api
 from nova.virt import driver
+from nova.virt import images
 
 from nova.openstack.common import jsonutils
 
@@ -194,3 +197,94 @@ class TestVirtDiskPaths(test.TestCase):
             json_file = os.path.join(tmpdir, 'meta.js')
             json_data = jsonutils.loads(open(json_file).read())
             self.assertEqual(metadata, json_data)
+
+
+class FakeImageService(object):
+    """Serve image data, failing once after fail_after bytes if set."""
+
+    def __init__(self, data, ranges=True, fail_after=None):
+        self.data = data
+        self.ranges = ranges
+        self.fail_after = fail_after
+        self.calls = []
+        self.image_meta = {'size': len(data),
+                           'checksum': hashlib.md5(data).hexdigest()}
+
+    def show(self, context, image_id):
+        return self.image_meta
+
+    def _write(self, data, start, end):
+        if self.fail_after is not None and end - start > self.fail_after:
+            data.write(self.data[start:start + self.fail_after])
+            self.fail_after = None
+            raise IOError('connection reset')
+        data.write(self.data[start:end])
+
+    def download(self, context, image_id, data):
+        self.calls.append((0, None))
+        self._write(data, 0, len(self.data))
+
+    def download_range(self, context, image_id, data, start, end=None):
+        self.calls.append((start, end))
+        if not self.ranges:
+            return False
+        end = len(self.data) if end is None else end + 1
+        self._write(data, start, end)
+        return True
+
+
+class TestVirtImages(test.TestCase):
+    def setUp(self):
+        super(TestVirtImages, self).setUp()
+        self.stubs.Set(images, 'RANGE_MIN_SIZE', 4)
+        self.data = 'abcdefghijklmnopqrstuvwxyz'
+
+    def _fetch(self, image_service):
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (image_service, 'fake'))
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            images.fetch(None, 'fake', path, None, None)
+            with open(path) as f:
+                return f.read()
+
+    def test_fetch(self):
+        image_service = FakeImageService(self.data)
+        self.assertEqual(self._fetch(image_service), self.data)
+        self.assertEqual(image_service.calls, [(0, None)])
+
+    def test_fetch_resumes(self):
+        image_service = FakeImageService(self.data, fail_after=10)
+        self.assertEqual(self._fetch(image_service), self.data)
+        self.assertEqual(image_service.calls, [(0, None), (10, None)])
+
+    def test_fetch_restarts_without_ranges(self):
+        image_service = FakeImageService(self.data, ranges=False,
+                                         fail_after=10)
+        self.assertEqual(self._fetch(image_service), self.data)
+        self.assertEqual(image_service.calls,
+                         [(0, None), (10, None), (0, None)])
+
+    def test_fetch_gives_up(self):
+        self.flags(image_download_retries=0)
+        image_service = FakeImageService(self.data, fail_after=10)
+        self.assertRaises(IOError, self._fetch, image_service)
+
+    def test_fetch_bad_checksum(self):
+        image_service = FakeImageService(self.data)
+        image_service.image_meta['checksum'] = 'bad'
+        self.assertRaises(exception.ImageUnacceptable, self._fetch,
+                          image_service)
+
+    def test_fetch_ranges(self):
+        self.flags(image_download_ranges=3)
+        image_service = FakeImageService(self.data, fail_after=5)
+        self.assertEqual(self._fetch(image_service), self.data)
+        self.assertEqual(sorted(image_service.calls),
+                         [(0, 8), (5, 8), (9, 17), (18, 25)])
+
+    def test_fetch_ranges_not_served(self):
+        self.flags(image_download_ranges=3)
+        image_service = FakeImageService(self.data, ranges=False)
+        self.assertEqual(self._fetch(image_service), self.data)
+        self.assertEqual(image_service.calls, [(0, 8), (0, None)])
@@ -17,8 +17,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
+from eventlet import greenthread
+
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
 from nova import network
 from nova.network import linux_net
@@ -39,11 +44,25 @@ firewall_opts = [
     cfg.BoolOpt('allow_same_net_traffic',
                 default=True,
                 help='Whether to allow network traffic from same network'),
+    cfg.FloatOpt('firewall_refresh_delay',
+                 default=0.5,
+                 help='Number of seconds security group refreshes are '
+                      'collected for before the firewall rules are rebuilt '
+                      'and applied once for all of them, 0 applies each '
+                      'refresh right away'),
+    cfg.BoolOpt('firewall_use_ipset',
+                default=False,
+                help='Match the members of the security groups granted '
+                     'access by a rule with an ipset per group, rather than '
+                     'with a rule per member address'),
 ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(firewall_opts)
 
+# Longest wait, in seconds, before retrying a failed refresh
+REFRESH_RETRY_MAX_DELAY = 60
+
 
 def load_driver(default, *args, **kwargs):
     fw_class = importutils.import_class(FLAGS.firewall_driver or default)
@@ -145,6 +164,22 @@ class IptablesFirewallDriver(FirewallDriver):
         self.network_infos = {}
         self.basicly_filtered = False
 
+        # Security group refreshes waiting to be applied
+        self._refresh_scheduled = False
+        self._refresh_all = False
+        self._refresh_instances = {}
+        self._refresh_groups = set()
+        self._refresh_requests = 0
+        self._refresh_failures = 0
+        # Totals of the refreshes applied so far
+        self.refresh_stats = {'requests': 0, 'refreshes': 0, 'time': 0.0}
+
+        self.ipset = None
+        if FLAGS.firewall_use_ipset:
+            self.ipset = linux_net.IpsetManager()
+        # The ipsets matched by the rules of each instance
+        self.instance_ipsets = {}
+
         self.iptables.ipv4['filter'].add_chain('sg-fallback')
         self.iptables.ipv4['filter'].add_rule('sg-fallback', '-j DROP')
         self.iptables.ipv6['filter'].add_chain('sg-fallback')
@@ -172,6 +207,7 @@ class IptablesFirewallDriver(FirewallDriver):
             self.network_infos.pop(instance['id'])
             self.remove_filters_for_instance(instance)
             self.iptables.apply()
+            self.purge_ipsets()
         else:
             LOG.info(_('Attempted to unfilter instance which is not '
                      'filtered'), instance=instance)
@@ -232,6 +268,7 @@ class IptablesFirewallDriver(FirewallDriver):
 
     def remove_filters_for_instance(self, instance):
         chain_name = self._instance_chain_name(instance)
+        self.instance_ipsets.pop(instance['id'], None)
 
         self.iptables.ipv4['filter'].remove_chain(chain_name)
         if FLAGS.use_ipv6:
@@ -241,6 +278,44 @@ class IptablesFirewallDriver(FirewallDriver):
     def _security_group_chain_name(security_group_id):
         return 'nova-sg-%s' % (security_group_id,)
 
+    @staticmethod
+    def _security_group_ipset_name(security_group_id, version):
+        return 'nova-sg-%s-v%d' % (security_group_id, version)
+
+    @staticmethod
+    def _security_group_ips(ctxt, security_group, version):
+        """Return the fixed ips of the instances in a security group."""
+        # FIXME(jkoelker) This needs to be ported up into
+        #                 the compute manager which already
+        #                 has access to a nw_api handle,
+        #                 and should be the only one making
+        #                 making rpc calls.
+        nw_api = network.API()
+        ips = []
+        for instance in security_group['instances']:
+            nw_info = nw_api.get_instance_nw_info(ctxt, instance)
+            ips += [ip['address'] for ip in nw_info.fixed_ips()
+                    if ip['version'] == version]
+        return ips
+
+    def _update_ipset(self, ctxt, security_group, version):
+        """Make the ipset of a security group hold its members' ips."""
+        name = self._security_group_ipset_name(security_group['id'], version)
+        ips = self._security_group_ips(ctxt, security_group, version)
+        LOG.debug('ipset %s ips: %r', name, ips)
+        self.ipset.update_set(name, ips,
+                              family='inet' if version == 4 else 'inet6')
+
+    def purge_ipsets(self):
+        """Destroy the ipsets no instance rule matches anymore."""
+        if self.ipset is None:
+            return
+        in_use = set()
+        for names in self.instance_ipsets.itervalues():
+            in_use.update(names)
+        for name in set(self.ipset.sets) - in_use:
+            self.ipset.destroy_set(name)
+
     def _instance_chain_name(self, instance):
         return 'inst-%s' % (instance['id'],)
 
@@ -346,6 +421,7 @@ class IptablesFirewallDriver(FirewallDriver):
 
         security_groups = db.security_group_get_by_instance(ctxt,
                                                             instance['id'])
+        ipsets = set()
 
         # then, security group chains and rules
         for security_group in security_groups:
@@ -386,29 +462,31 @@ class IptablesFirewallDriver(FirewallDriver):
                     LOG.debug('Using cidr %r', rule.cidr, instance=instance)
                     args += ['-s', rule.cidr]
                     fw_rules += [' '.join(args)]
-                else:
-                    if rule['grantee_group']:
-                        # FIXME(jkoelker) This needs to be ported up into
-                        #                 the compute manager which already
-                        #                 has access to a nw_api handle,
-                        #                 and should be the only one making
-                        #                 making rpc calls.
-                        nw_api = network.API()
-                        for instance in rule['grantee_group']['instances']:
-                            nw_info = nw_api.get_instance_nw_info(ctxt,
-                                                                  instance)
-
-                            ips = [ip['address']
-                                for ip in nw_info.fixed_ips()
-                                    if ip['version'] == version]
-
-                            LOG.debug('ips: %r', ips, instance=instance)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
+                elif rule['grantee_group'] and self.ipset is not None:
+                    grantee_group = rule['grantee_group']
+                    name = self._security_group_ipset_name(
+                            grantee_group['id'], version)
+                    # NOTE: The members of a known ipset are kept up to
+                    #       date by refresh_security_group_members.
+                    if name not in self.ipset.sets:
+                        self._update_ipset(ctxt, grantee_group, version)
+                    ipsets.add(name)
+                    subrule = args + ['-m set --match-set %s src' % name]
+                    fw_rules += [' '.join(subrule)]
+                elif rule['grantee_group']:
+                    ips = self._security_group_ips(ctxt,
+                                                   rule['grantee_group'],
+                                                   version)
+                    LOG.debug('ips: %r', ips, instance=instance)
+                    for ip in ips:
+                        subrule = args + ['-s %s' % ip]
+                        fw_rules += [' '.join(subrule)]
 
                 LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
 
+        if self.ipset is not None:
+            self.instance_ipsets[instance['id']] = ipsets
+
         ipv4_rules += ['-j $sg-fallback']
         ipv6_rules += ['-j $sg-fallback']
 
@@ -418,16 +496,104 @@ class IptablesFirewallDriver(FirewallDriver):
         pass
 
     def refresh_security_group_members(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        if self.ipset is not None:
+            # Only the ipsets of the group have to be updated
+            self._schedule_refresh(security_group_id=security_group)
+        else:
+            self._schedule_refresh()
 
     def refresh_security_group_rules(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        self._schedule_refresh()
 
     def refresh_instance_security_rules(self, instance):
-        self.do_refresh_instance_rules(instance)
-        self.iptables.apply()
+        self._schedule_refresh(instance)
+
+    def _schedule_refresh(self, instance=None, security_group_id=None):
+        """Refresh the rules of an instance, or of all of them.
+
+        With security_group_id, only the ipsets of that group's members
+        are refreshed.
+
+        Refreshes requested within firewall_refresh_delay seconds of the
+        first one are coalesced, their rules are rebuilt and applied once.
+        """
+        self._refresh_requests += 1
+        if security_group_id is not None:
+            self._refresh_groups.add(security_group_id)
+        elif instance is not None:
+            self._refresh_instances[instance['id']] = instance
+        else:
+            self._refresh_all = True
+
+        if FLAGS.firewall_refresh_delay <= 0:
+            self._do_scheduled_refresh()
+        else:
+            self._schedule_run()
+
+    def _schedule_run(self, delay=None):
+        if not self._refresh_scheduled:
+            self._refresh_scheduled = True
+            greenthread.spawn_after(delay or FLAGS.firewall_refresh_delay,
+                                    self._do_scheduled_refresh)
+
+    def _do_scheduled_refresh(self):
+        requests = self._refresh_requests
+        refresh_all = self._refresh_all
+        instances = self._refresh_instances
+        groups = self._refresh_groups
+        # NOTE: Refreshes requested from now on are applied by the next
+        #       run, as the rules built by this one may already be stale.
+        self._refresh_scheduled = False
+        self._refresh_all = False
+        self._refresh_instances = {}
+        self._refresh_groups = set()
+        self._refresh_requests = 0
+
+        start = time.time()
+        try:
+            for security_group_id in groups:
+                self.do_refresh_security_group_ipsets(security_group_id)
+            if refresh_all:
+                self.do_refresh_security_group_rules(None)
+            else:
+                for instance in instances.itervalues():
+                    if instance['id'] in self.instances:
+                        self.do_refresh_instance_rules(instance)
+            if refresh_all or instances:
+                self.iptables.apply()
+                self.purge_ipsets()
+        except Exception as e:
+            if FLAGS.firewall_refresh_delay <= 0:
+                raise
+            # Back off while the refresh keeps failing, and only log the
+            # traceback of the first failure.
+            delay = min(FLAGS.firewall_refresh_delay *
+                        2 ** self._refresh_failures,
+                        REFRESH_RETRY_MAX_DELAY)
+            if self._refresh_failures:
+                LOG.warn(_('Failed to refresh the firewall rules again, '
+                           'retrying in %(delay).1f secs: %(e)s'), locals())
+            else:
+                LOG.exception(_('Failed to refresh the firewall rules, '
+                                'retrying in %(delay).1f secs'), locals())
+            self._refresh_failures += 1
+            # Merge the failed refreshes into the ones requested since,
+            # which are more recent, and run them all again.
+            self._refresh_requests += requests
+            self._refresh_all = self._refresh_all or refresh_all
+            instances.update(self._refresh_instances)
+            self._refresh_instances = instances
+            self._refresh_groups |= groups
+            self._schedule_run(delay)
+            return
+        elapsed = time.time() - start
+        self._refresh_failures = 0
+
+        self.refresh_stats['requests'] += requests
+        self.refresh_stats['refreshes'] += 1
+        self.refresh_stats['time'] += elapsed
+        LOG.debug(_('Applied %(requests)d security group refreshes at once '
+                    'in %(elapsed).3f secs'), locals())
 
     @utils.synchronized('iptables', external=True)
     def do_refresh_security_group_rules(self, security_group):
@@ -435,6 +601,28 @@ class IptablesFirewallDriver(FirewallDriver):
             self.remove_filters_for_instance(instance)
             self.add_filters_for_instance(instance)
 
+    @utils.synchronized('iptables', external=True)
+    def do_refresh_security_group_ipsets(self, security_group_id):
+        ctxt = context.get_admin_context()
+        security_group = None
+        for version in (4, 6):
+            name = self._security_group_ipset_name(security_group_id,
+                                                   version)
+            if name not in self.ipset.sets:
+                # No rule on this host matches the group
+                continue
+            if security_group is None:
+                try:
+                    security_group = db.security_group_get(
+                            ctxt, security_group_id)
+                except exception.SecurityGroupNotFound:
+                    # The group was deleted since the refresh was
+                    # requested, purge_ipsets() destroys its sets
+                    LOG.debug(_('Security group %s is gone, not '
+                                'refreshing its ipsets'), security_group_id)
+                    return
+            self._update_ipset(ctxt, security_group, version)
+
     @utils.synchronized('iptables', external=True)
     def do_refresh_instance_rules(self, instance):
         self.remove_filters_for_instance(instance)
@@ -21,8 +21,12 @@
 Handling of VM disk images.
 """
 
+import hashlib
+import httplib
 import os
 
+import eventlet
+
 from nova import exception
 from nova import flags
 from nova.image import glance
@@ -37,11 +41,26 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format'),
+    cfg.IntOpt('image_download_ranges',
+               default=1,
+               help='Number of parts of an image to download in parallel, '
+                    'when the image service serves byte ranges'),
+    cfg.IntOpt('image_download_retries',
+               default=3,
+               help='Number of times to resume an image download after it '
+                    'failed'),
 ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(image_opts)
 
+# Images smaller than two ranges of this size are downloaded as a whole
+RANGE_MIN_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_DOWNLOAD_ERRORS = (IOError, httplib.HTTPException,
+                    exception.GlanceConnectionFailed)
+
 
 def qemu_img_info(path):
     """Return a dict containing the parsed output from qemu-img info."""
@@ -66,6 +85,99 @@ def convert_image(source, dest, out_format):
     utils.execute(*cmd)
 
 
+class _ImageWriter(object):
+    """Write image data from an offset of a file, hashing it on the way."""
+
+    def __init__(self, image_file, offset=0):
+        self.image_file = image_file
+        self.start = self.offset = offset
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.image_file.write(data)
+        self.offset += len(data)
+        self.md5.update(data)
+
+    def restart(self):
+        self.image_file.seek(self.start)
+        self.image_file.truncate()
+        self.offset = self.start
+        self.md5 = hashlib.md5()
+
+
+def _download(context, image_service, image_id, writer, size=None, end=None):
+    """Download an image, or the range of it up to end, into writer.
+
+    Failed downloads are resumed from the last byte written, with a range
+    request if the image service serves them or from the start otherwise.
+
+    :returns: False if the range up to end could not be downloaded because
+              the image service does not serve ranges
+    """
+    can_resume = hasattr(image_service, 'download_range')
+    attempt = 0
+    while True:
+        try:
+            if writer.offset == 0 and end is None:
+                image_service.download(context, image_id, writer)
+            elif not image_service.download_range(context, image_id, writer,
+                                                  writer.offset, end):
+                if end is not None:
+                    return False
+                writer.restart()
+                continue
+            return True
+        except _DOWNLOAD_ERRORS as e:
+            attempt += 1
+            if attempt > FLAGS.image_download_retries:
+                raise
+            offset = writer.offset
+            LOG.warn(_("Download of image %(image_id)s failed after "
+                       "%(offset)d bytes, resuming: %(e)s"), locals())
+            # NOTE: a connection which failed once all the bytes were
+            # written leaves nothing to ask a range for, so the
+            # download is started over.
+            if not can_resume or (size is not None and offset >= size):
+                writer.restart()
+
+
+def _download_ranges(context, image_service, image_id, path, size, count):
+    """Download count ranges of an image in parallel.
+
+    :returns: False if the image service does not serve ranges
+    """
+    range_size = max(RANGE_MIN_SIZE, (size + count - 1) // count)
+
+    def download_range(start):
+        end = min(start + range_size, size) - 1
+        with open(path, 'r+b') as image_file:
+            image_file.seek(start)
+            writer = _ImageWriter(image_file, start)
+            return _download(context, image_service, image_id, writer,
+                             end=end)
+
+    with open(path, 'wb') as image_file:
+        image_file.truncate(size)
+
+    # Probe with the first range alone, so that an image service which
+    # ignores ranges is sent a single request for them.
+    starts = range(0, size, range_size)
+    if not download_range(starts[0]):
+        return False
+
+    pool = eventlet.GreenPool(count)
+    results = list(pool.imap(download_range, starts[1:]))
+    return all(results)
+
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(CHUNK_SIZE), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
 def fetch(context, image_href, path, _user_id, _project_id):
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
@@ -74,8 +186,28 @@ def fetch(context, image_href, path, _user_id, _project_id):
     (image_service, image_id) = glance.get_remote_image_service(context,
                                                                 image_href)
     with utils.remove_path_on_error(path):
-        with open(path, "wb") as image_file:
-            image_service.download(context, image_id, image_file)
+        image_meta = image_service.show(context, image_id)
+        size = image_meta.get('size')
+        checksum = image_meta.get('checksum')
+
+        count = FLAGS.image_download_ranges
+        if (count > 1 and size and size >= 2 * RANGE_MIN_SIZE and
+                hasattr(image_service, 'download_range') and
+                _download_ranges(context, image_service, image_id, path,
+                                 size, count)):
+            # NOTE: the ranges arrive out of order, so the image is
+            # hashed once complete, while it is still in the page cache.
+            md5 = _file_md5(path) if checksum else None
+        else:
+            with open(path, "wb") as image_file:
+                writer = _ImageWriter(image_file)
+                _download(context, image_service, image_id, writer, size)
+                md5 = writer.md5.hexdigest()
+
+        if checksum and md5 != checksum:
+            raise exception.ImageUnacceptable(image_id=image_href,
+                reason=_("checksum %(md5)s does not match %(checksum)s") %
+                locals())
 
 
 def fetch_to_raw(context, image_href, path, user_id, project_id):
@@ -57,6 +57,9 @@ class Dom0IptablesFirewallDriver(firewall.IptablesFirewallDriver):
         self.iptables.ipv4['filter'].add_rule('sg-fallback', '-j DROP')
         self.iptables.ipv6['filter'].add_chain('sg-fallback')
         self.iptables.ipv6['filter'].add_rule('sg-fallback', '-j DROP')
+        # NOTE: The dom0 plugin only runs iptables commands, so the
+        #       members of a security group are matched address by address.
+        self.ipset = None
 
     def _build_tcp_udp_rule(self, rule, version):
         if rule.from_port == rule.to_port:
@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Helpers shared by the benchmark scripts under tools/.
+
+Importing this module puts the nova tree it lives in first on sys.path
+and installs gettext, so a benchmark run from a checkout benchmarks that
+checkout.  Each benchmark builds its argument parser with
+argument_parser() and hands it to main() with its run and report
+functions; the arguments the parser doesn't recognize are parsed as
+nova flags.
+"""
+
+import argparse
+import gettext
+import json
+import os
+import sys
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(__file__),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+from nova.openstack.common import log as logging
+
+
+FLAGS = flags.FLAGS
+
+
+def percentile(values, percent):
+    """Return the value below which percent of the values fall."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round((len(values) - 1) * percent / 100.0))]
+
+
+def summarize(latencies):
+    """Return the count, total, rate and p50/p99 of a list of latencies."""
+    total = sum(latencies)
+    return dict(calls=len(latencies), total=total,
+                per_second=len(latencies) / total if total else 0.0,
+                p50=percentile(latencies, 50),
+                p99=percentile(latencies, 99))
+
+
+def argument_parser(description):
+    """Return a parser with the --seed and --output options of all runs."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the generated data')
+    parser.add_argument('--output', help='also write the results as JSON '
+                                         'to this file')
+    return parser
+
+
+def main(parser, run, print_report, overrides=None):
+    """Parse the arguments and nova flags, then run and report.
+
+    overrides are flags forced for the benchmark whatever the
+    configuration says.
+    """
+    args, nova_args = parser.parse_known_args()
+    flags.parse_args([sys.argv[0]] + nova_args, default_config_files=[])
+    logging.setup("nova")
+    for name, value in (overrides or {}).iteritems():
+        FLAGS.set_override(name, value)
+
+    results = run(args)
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
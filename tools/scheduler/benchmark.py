@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the FilterScheduler host selection against a synthetic fleet.
+
+N compute nodes are synthesized and served through a fake
+db.compute_node_get_all, then a stream of request specs is run through
+FilterScheduler._schedule.  Nothing is cast to compute hosts and no
+instances are created.
+
+The request specs are either generated from a few flavors or replayed
+from a file with one JSON document per line.  Each line is a request spec,
+or a 'scheduler.run_instance.start' notification carrying one in its
+payload, so recorded notifications can be replayed directly.
+
+The report gives decisions per second, p50/p99 latency per request and
+the time spent in each filter and cost function.  With --output the
+results are also written as JSON, to compare runs before and after a
+filter or weigher change.
+
+Run like:
+
+    ./tools/scheduler/benchmark.py --hosts 10000 --requests 200
+    ./tools/scheduler/benchmark.py --replay run_instance.log \\
+        --config-file /etc/nova/nova.conf
+
+Options not recognized by this script are parsed as nova flags, so the
+filters, cost functions and host manager under test can be chosen with
+e.g. --scheduler_default_filters or --scheduler_host_manager.  Filters
+that look up the database, like AggregateInstanceExtraSpecsFilter, use
+the configured sql_connection.
+"""
+
+import functools
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import benchmark_utils
+
+from nova import context
+from nova import db
+from nova import flags
+from nova.openstack.common import timeutils
+from nova.scheduler import filter_scheduler
+
+
+FLAGS = flags.FLAGS
+
+FLAVORS = [
+    dict(name='m1.tiny', memory_mb=512, vcpus=1, root_gb=0, ephemeral_gb=0),
+    dict(name='m1.small', memory_mb=2048, vcpus=1, root_gb=20,
+         ephemeral_gb=0),
+    dict(name='m1.medium', memory_mb=4096, vcpus=2, root_gb=40,
+         ephemeral_gb=0),
+    dict(name='m1.large', memory_mb=8192, vcpus=4, root_gb=80,
+         ephemeral_gb=0),
+    dict(name='m1.xlarge', memory_mb=16384, vcpus=8, root_gb=160,
+         ephemeral_gb=0),
+]
+
+HOST_SIZES = [
+    dict(memory_mb=32768, vcpus=8, local_gb=500),
+    dict(memory_mb=65536, vcpus=16, local_gb=1000),
+    dict(memory_mb=131072, vcpus=32, local_gb=2000),
+]
+
+
+def make_compute_nodes(num_hosts, rand):
+    """Return num_hosts compute node dicts with random usage."""
+    now = timeutils.utcnow()
+    compute_nodes = []
+    for i in xrange(num_hosts):
+        size = rand.choice(HOST_SIZES)
+        used = rand.random()
+        memory_mb_used = int(size['memory_mb'] * used)
+        local_gb_used = int(size['local_gb'] * used)
+        vcpus_used = int(size['vcpus'] * used * 2)
+        num_instances = vcpus_used
+        service = dict(id=i + 1, host='host%05d' % i, topic='compute',
+                       disabled=False, availability_zone='nova',
+                       created_at=now, updated_at=now)
+        stats = [dict(key='num_instances', value=num_instances),
+                 dict(key='num_vm_active', value=num_instances),
+                 dict(key='io_workload', value=rand.randint(0, 4))]
+        compute_nodes.append(dict(id=i + 1,
+                                  memory_mb=size['memory_mb'],
+                                  memory_mb_used=memory_mb_used,
+                                  free_ram_mb=size['memory_mb'] -
+                                      memory_mb_used,
+                                  local_gb=size['local_gb'],
+                                  local_gb_used=local_gb_used,
+                                  free_disk_gb=size['local_gb'] -
+                                      local_gb_used,
+                                  disk_available_least=None,
+                                  vcpus=size['vcpus'],
+                                  vcpus_used=vcpus_used,
+                                  created_at=now, updated_at=now,
+                                  deleted=False,
+                                  service=service, stats=stats))
+    return compute_nodes
+
+
+def make_capabilities(compute_nodes):
+    """Return service capabilities as reported by the compute hosts."""
+    return dict((node['service']['host'],
+                 {'compute': {'enabled': True,
+                              'hypervisor_type': 'QEMU',
+                              'hypervisor_version': 1000000}})
+                for node in compute_nodes)
+
+
+def make_request_specs(num_requests, max_instances, rand):
+    """Return num_requests request specs for random flavors."""
+    request_specs = []
+    for i in xrange(num_requests):
+        flavor = rand.choice(FLAVORS)
+        num_instances = rand.randint(1, max_instances)
+        instance_properties = dict(project_id='project%d' % (i % 10),
+                                   os_type='linux',
+                                   vm_state='building',
+                                   task_state='scheduling',
+                                   memory_mb=flavor['memory_mb'],
+                                   vcpus=flavor['vcpus'],
+                                   root_gb=flavor['root_gb'],
+                                   ephemeral_gb=flavor['ephemeral_gb'])
+        request_specs.append(dict(instance_type=flavor,
+                                  instance_properties=instance_properties,
+                                  image={'properties': {}},
+                                  num_instances=num_instances))
+    return request_specs
+
+
+def load_request_specs(filename):
+    """Load request specs, or notifications carrying them, from a file."""
+    request_specs = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            request_spec = json.loads(line)
+            if 'payload' in request_spec:
+                request_spec = request_spec['payload']['request_spec']
+            # Recorded specs are for actual instances, schedule as many
+            # hosts without the uuids.
+            instance_uuids = request_spec.pop('instance_uuids', None)
+            if instance_uuids:
+                request_spec['num_instances'] = len(instance_uuids)
+            request_specs.append(request_spec)
+    return request_specs
+
+
+class Timer(object):
+    """Accumulates the time spent in wrapped callables."""
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.totals[name] = (self.totals.get(name, 0.0) +
+                                     time.time() - start)
+                self.calls[name] = self.calls.get(name, 0) + 1
+        return timed
+
+    def results(self):
+        return dict((name, dict(total=total, calls=self.calls[name]))
+                    for name, total in self.totals.iteritems())
+
+
+def instrument(scheduler, timer):
+    """Time every filter class and cost function of the scheduler."""
+    for cls in scheduler.host_manager.filter_classes:
+        for method in ('host_passes', 'filter_columns'):
+            fn = cls.__dict__.get(method)
+            if fn is None:
+                continue
+            setattr(cls, method, timer.wrap('filter %s.%s' % (cls.__name__,
+                                                             method), fn))
+
+    cost_functions = [(weight, timer.wrap('cost %s' % fn.__name__, fn))
+                      for weight, fn in scheduler.get_cost_functions()]
+    scheduler.cost_function_cache['compute'] = cost_functions
+
+
+def run(args):
+    rand = random.Random(args.seed)
+    compute_nodes = make_compute_nodes(args.hosts, rand)
+
+    def fake_compute_node_get_all(context, updated_since=None):
+        if updated_since is not None:
+            return []
+        return compute_nodes
+
+    db.compute_node_get_all = fake_compute_node_get_all
+
+    if args.replay:
+        request_specs = load_request_specs(args.replay)
+    else:
+        request_specs = make_request_specs(args.requests,
+                                           args.max_instances, rand)
+
+    scheduler = filter_scheduler.FilterScheduler()
+    scheduler.host_manager.service_states = make_capabilities(compute_nodes)
+    timer = Timer()
+    instrument(scheduler, timer)
+
+    ctxt = context.get_admin_context()
+    latencies = []
+    decisions = 0
+    failures = 0
+    start = time.time()
+    for request_spec in request_specs:
+        request_start = time.time()
+        weighted_hosts = scheduler._schedule(ctxt, 'compute', request_spec,
+                                             {})
+        latencies.append(time.time() - request_start)
+        decisions += len(weighted_hosts)
+        failures += request_spec.get('num_instances', 1) - len(weighted_hosts)
+    elapsed = time.time() - start
+
+    return dict(hosts=args.hosts,
+                requests=len(request_specs),
+                decisions=decisions,
+                failures=failures,
+                elapsed=elapsed,
+                decisions_per_second=decisions / elapsed if elapsed else 0.0,
+                p50=benchmark_utils.percentile(latencies, 50),
+                p99=benchmark_utils.percentile(latencies, 99),
+                timings=timer.results())
+
+
+def print_report(results):
+    print "%(requests)d requests, %(decisions)d decisions, %(failures)d " \
+          "unplaced instances on %(hosts)d hosts in %(elapsed).2f secs" % \
+          results
+    print "%.1f decisions/sec" % results['decisions_per_second']
+    print "latency per request: p50 %.2f ms, p99 %.2f ms" % (
+            results['p50'] * 1000, results['p99'] * 1000)
+    print
+    print "%-60s %10s %12s" % ("", "calls", "total secs")
+    timings = results['timings']
+    for name in sorted(timings, key=lambda n: -timings[n]['total']):
+        print "%-60s %10d %12.3f" % (name, timings[name]['calls'],
+                                     timings[name]['total'])
+
+
+def _argument_parser():
+    parser = benchmark_utils.argument_parser(
+            'Benchmark FilterScheduler host selection.')
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='number of compute nodes to synthesize')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='number of requests to generate')
+    parser.add_argument('--max-instances', type=int, default=1,
+                        help='maximum number of instances per generated '
+                             'request')
+    parser.add_argument('--replay',
+                        help='file of request specs to replay instead of '
+                             'generating requests')
+    return parser
+
+
+if __name__ == "__main__":
+    benchmark_utils.main(_argument_parser(), run, print_report)